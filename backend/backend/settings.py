@@ -31,7 +31,16 @@ CACHES = {
         'BACKEND': 'django_redis.cache.RedisCache',
         'LOCATION': 'redis://redis:6379/2',
         'TIMEOUT': None,  # 永不过期
-    }
+    },
+    # 管道指标：短超时，Redis缓慢或不可用时丢弃指标而不阻塞下载
+    'metrics': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://redis:6379/1',
+        'OPTIONS': {
+            'SOCKET_CONNECT_TIMEOUT': 1,
+            'SOCKET_TIMEOUT': 1,
+        },
+    },
 }
 ALLOWED_HOSTS = ['localhost', '127.0.0.1', 'your_domain.com']  # 根据实际情况添加域名或IP地址
 
@@ -110,6 +119,43 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 STATIC_ROOT = BASE_DIR / 'static_collected'
+
+# NDVI下载压缩包的磁盘缓存目录（按产品与版本缓存）
+NDVI_ARCHIVE_CACHE_DIR = BASE_DIR / 'data_pipeline' / 'cache' / 'archives'
+
+# NDVI瓦片缓存：进程内LRU条数与Redis过期时间（秒）
+NDVI_TILE_LRU_SIZE = 2048
+NDVI_TILE_CACHE_TIMEOUT = 24 * 3600
+
+# 点查询/分区统计共享的栅格块缓存上限（字节）与单次分区统计的最大像元数
+NDVI_BLOCK_CACHE_BYTES = 256 * 1024 * 1024
+NDVI_ZONAL_MAX_PIXELS = 50_000_000
+
+# NDVI时间序列立方体目录（每期产品入库后追加）
+NDVI_CUBE_DIR = BASE_DIR / 'data_pipeline' / 'data' / 'ndvi_cube'
+
+# NDVI处理区域：区域键 -> Earth Engine边界资产（产品名为 {区域键}_ndvi_{日期}）
+NDVI_DEFAULT_REGION = 'beijing'
+NDVI_REGIONS = {
+    'beijing': {
+        'label': '北京',
+        'asset': 'projects/ee-brucepengyuan/assets/bei_jing',
+    },
+}
+# 历史回填：单个时间窗口天数与同时下发的作业数
+NDVI_BACKFILL_WINDOW_DAYS = 7
+NDVI_BACKFILL_PARALLELISM = 4
+# 处理作业的Redis租约时长（秒），持有期间每1/3租期续期一次
+NDVI_LEASE_TTL = 600
+
+# PostGIS栅格入库（SatelliteRaster）：开启后每期产品入库时按固定尺寸切块写入数据库
+NDVI_RASTER_DB_ENABLED = os.getenv('NDVI_RASTER_DB_ENABLED', '0') == '1'
+NDVI_RASTER_DB_TILE_SIZE = 256
+# 概视图抽稀倍数，与原始分辨率存放在同一张表（overview字段区分）
+NDVI_RASTER_DB_OVERVIEWS = (4, 16)
+# 数据库服务器上对应BASE_DIR的路径；设置后改为out-db模式（表中只存文件引用），
+# 需要数据库容器挂载数据目录并开启postgis.enable_outdb_rasters
+NDVI_RASTER_DB_OUTDB_ROOT = os.getenv('NDVI_RASTER_DB_OUTDB_ROOT') or None
 # STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
 # 本地开发数据配置
 # DATABASES = {
@@ -8,4 +8,6 @@ urlpatterns = [
     # 用户接口相关路由
     path('api/geodata/', include('geodata.urls')),
     # 获取数据的路由
+    path('api/pipeline/', include('data_pipeline.urls')),
+    # 数据管道运行指标
 ]
\ No newline at end of file
@@ -0,0 +1,16 @@
+from django.contrib import admin
+
+from data_pipeline.models import PipelineRun, TileJob
+
+
+class TileJobInline(admin.TabularInline):
+    model = TileJob
+    extra = 0
+    readonly_fields = ('index', 'status', 'attempts', 'size', 'seconds', 'error', 'updated_at')
+
+
+@admin.register(PipelineRun)
+class PipelineRunAdmin(admin.ModelAdmin):
+    list_display = ('name', 'region', 'status', 'stage', 'tiles_done', 'tiles_total', 'started_at', 'finished_at')
+    list_filter = ('status', 'region', 'source')
+    inlines = [TileJobInline]
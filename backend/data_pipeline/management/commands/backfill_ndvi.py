@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from data_pipeline.utils.backfill import plan_jobs
+
+
+class Command(BaseCommand):
+    help = '按时间窗口与区域批量回填NDVI历史产品'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', required=True, help='起始日期（YYYY-MM-DD，含）')
+        parser.add_argument('--end-date', required=True, help='结束日期（YYYY-MM-DD，不含）')
+        parser.add_argument('--regions', type=str, default='', help='区域键，逗号分隔（默认全部已配置区域）')
+        parser.add_argument('--window-days', type=int, default=None, help='单个时间窗口天数')
+        parser.add_argument('--parallelism', type=int, default=None, help='每批并行的作业数')
+        parser.add_argument('--force', action='store_true', help='忽略已完成记录，全部重跑')
+        parser.add_argument('--dry-run', action='store_true', help='只列出待处理作业')
+
+    def handle(self, *args, **options):
+        from data_pipeline.tasks import backfill_ndvi
+
+        regions = [r.strip() for r in options['regions'].split(',') if r.strip()] or None
+        try:
+            jobs = plan_jobs(options['start_date'], options['end_date'], regions,
+                             options['window_days'], options['force'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for job in jobs:
+            self.stdout.write(f"{job['region']}: {job['start_date']} ~ {job['end_date']}")
+        if options['dry_run'] or not jobs:
+            self.stdout.write(f"待处理作业: {len(jobs)}")
+            return
+
+        result = backfill_ndvi.apply_async(
+            kwargs={
+                'start_date': options['start_date'],
+                'end_date': options['end_date'],
+                'regions': regions,
+                'window_days': options['window_days'],
+                'parallelism': options['parallelism'],
+                'force': options['force'],
+            },
+            queue='satellite_sync',
+        )
+        self.stdout.write(self.style.SUCCESS(f"已提交 {len(jobs)} 个回填作业: {result.id}"))
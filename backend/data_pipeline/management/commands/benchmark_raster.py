@@ -0,0 +1,368 @@
+import io
+import json
+import multiprocessing
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from osgeo import gdal
+
+from data_pipeline.utils.synthetic import make_band_pair, make_tile_set
+
+CASES = ('validate', 'validate_pool', 'merge_tiles', 'merge_tiles_direct', 'calculate_stats',
+         'generate_thumbnail', 'download_archive', 'calculate_ndvi', 'calculate_ndvi_gdal_calc')
+DEFAULT_SIZES = '2,6,12,24,48'
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _proc_status_kb(field):
+    """读取/proc/self/status中的内存字段（KB），非Linux返回None"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """重置本进程的RSS峰值（Linux 4.0+写clear_refs=5），失败时返回False"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def max_rss_kb():
+    # 优先VmHWM（可重置）；ru_maxrss为进程生命周期峰值，Linux下单位为KB
+    return _proc_status_kb('VmHWM') or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_case_child(func, conn):
+    """子进程入口：重置峰值后执行用例，结果通过管道返回"""
+    try:
+        reset_peak_rss()
+        baseline = _proc_status_kb('VmRSS')
+        result = func()
+        if result is None:
+            conn.send(('ok', None))
+            return
+        peak = max_rss_kb()
+        result['max_rss_kb'] = peak
+        result['rss_growth_kb'] = peak - baseline if baseline is not None else None
+        conn.send(('ok', result))
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {str(e)}"))
+    finally:
+        conn.close()
+
+
+class Command(BaseCommand):
+    help = '栅格热点路径基准测试（合成NDVI分块）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=str, default=DEFAULT_SIZES,
+                            help='分块数量列表，逗号分隔（最大48，对应8x6网格）')
+        parser.add_argument('--tile-size', type=int, default=1024, help='单个分块边长（像元）')
+        parser.add_argument('--repeat', type=int, default=3, help='每个用例重复次数')
+        parser.add_argument('--cases', type=str, default=','.join(CASES),
+                            help=f"要运行的用例，逗号分隔（{','.join(CASES)}）")
+        parser.add_argument('--product-format', choices=['cog', 'gtiff', 'vrt'], default='cog',
+                            help='merge_tiles的输出格式')
+        parser.add_argument('--work-dir', type=str, default=None, help='合成数据目录（默认临时目录）')
+        parser.add_argument('--keep', action='store_true', help='保留合成数据')
+        parser.add_argument('--output', type=str, default=None,
+                            help='结果JSON路径（默认data_pipeline/benchmarks/<时间>_<提交>.json）')
+        parser.add_argument('--compare', type=str, default=None,
+                            help='与之前的结果JSON对比，输出各用例耗时变化')
+        parser.add_argument('--threshold', type=float, default=1.2,
+                            help='对比时耗时超过基线该倍数即标记为回退')
+
+    def handle(self, *args, **options):
+        sizes = sorted({int(v) for v in options['sizes'].split(',') if v.strip()})
+        if not sizes or sizes[0] < 1 or sizes[-1] > 48:
+            raise CommandError("分块数量须在1到48之间")
+        cases = [c.strip() for c in options['cases'].split(',') if c.strip()]
+        unknown = set(cases) - set(CASES)
+        if unknown:
+            raise CommandError(f"未知用例: {sorted(unknown)}")
+
+        self.repeat = max(1, options['repeat'])
+        self.tile_size = options['tile_size']
+        self.fetch = self.fetch_command(options['product_format'])
+
+        work_dir = Path(options['work_dir'] or tempfile.mkdtemp(prefix='ndvi_bench_'))
+        commit = git_commit()
+        report = {
+            'created_at': datetime.now().isoformat(),
+            'git_commit': commit,
+            'python': platform.python_version(),
+            'gdal': gdal.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'params': {
+                'sizes': sizes,
+                'tile_size': self.tile_size,
+                'repeat': self.repeat,
+                'product_format': options['product_format'],
+            },
+            'results': [],
+        }
+
+        try:
+            for n_tiles in sizes:
+                tile_dir = work_dir / f'tiles_{n_tiles}'
+                self.stdout.write(f"生成 {n_tiles} 个 {self.tile_size}x{self.tile_size} 合成分块...")
+                tile_files = make_tile_set(tile_dir, n_tiles, tile_size=self.tile_size)
+                by_case = {}
+                for case in cases:
+                    result = self.run_isolated(getattr(self, f'bench_{case}'), tile_dir, tile_files)
+                    if result is None:
+                        self.stdout.write(f"  {case:<20} 跳过（环境不支持）")
+                        continue
+                    result.update({'case': case, 'tiles': n_tiles,
+                                   'pixels': n_tiles * self.tile_size * self.tile_size})
+                    result['mpix_per_second'] = round(result['pixels'] / 1e6 / result['median_seconds'], 2) \
+                        if result['median_seconds'] else None
+                    report['results'].append(result)
+                    by_case[case] = result
+                    self.stdout.write(
+                        f"  {case:<20} {result['median_seconds']:>8.3f}s  "
+                        f"Python峰值 {result['peak_python_bytes'] / 1024 / 1024:>7.1f}MB  "
+                        f"RSS峰值 {result['max_rss_kb'] / 1024:>7.1f}MB"
+                    )
+                numpy_ndvi, gdal_calc = by_case.get('calculate_ndvi'), by_case.get('calculate_ndvi_gdal_calc')
+                if numpy_ndvi and gdal_calc and numpy_ndvi['median_seconds']:
+                    speedup = round(gdal_calc['median_seconds'] / numpy_ndvi['median_seconds'], 2)
+                    numpy_ndvi['speedup_vs_gdal_calc'] = speedup
+                    self.stdout.write(f"  进程内NDVI相对gdal_calc加速 x{speedup}")
+        finally:
+            if not options['keep']:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        output = Path(options['output']) if options['output'] else (
+            Path(settings.BASE_DIR) / 'data_pipeline' / 'benchmarks'
+            / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit or 'nogit'}.json"
+        )
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"结果已保存: {output}"))
+
+        if options['compare']:
+            self.compare(report, Path(options['compare']), options['threshold'])
+
+    def fetch_command(self, product_format):
+        """复用fetch_sentinel2的实现，日志输出到内存"""
+        from data_pipeline.management.commands.fetch_sentinel2 import Command as FetchCommand
+
+        fetch = FetchCommand(stdout=io.StringIO())
+        fetch.product_format = product_format
+        fetch.compress = 'ZSTD'
+        fetch.predictor = 3
+        fetch.num_threads = 'ALL_CPUS'
+        fetch.stats_workers = 4
+        fetch.thumbnail_sizes = []
+        return fetch
+
+    # ---------- 计时 ----------
+
+    def run_isolated(self, bench, tile_dir, tile_files):
+        """每个用例在fork出的子进程中运行
+
+        ru_maxrss是进程生命周期的峰值，同一进程内后续用例只会读到之前的最大值；
+        子进程中先重置峰值再运行，RSS峰值只反映本用例（含GDAL块缓存与NumPy分配）。
+        """
+        ctx = multiprocessing.get_context('fork')
+        receiver, sender = ctx.Pipe(duplex=False)
+        process = ctx.Process(target=_run_case_child, args=(lambda: bench(tile_dir, tile_files), sender))
+        process.start()
+        sender.close()
+        try:
+            status, payload = receiver.recv()
+        except EOFError:
+            status, payload = 'error', f"子进程异常退出（退出码 {process.exitcode}）"
+        process.join()
+        if status != 'ok':
+            raise CommandError(f"{bench.__name__} 失败: {payload}")
+        return payload
+
+    def measure(self, func, setup=None, teardown=None):
+        """重复执行并记录耗时；tracemalloc统计Python/NumPy分配的峰值（不含GDAL块缓存）"""
+        timings = []
+        peak = 0
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                func()
+            finally:
+                elapsed = time.perf_counter() - start
+                _, run_peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            timings.append(elapsed)
+            peak = max(peak, run_peak)
+            if teardown:
+                teardown()
+        return {
+            'seconds': [round(t, 4) for t in timings],
+            'median_seconds': round(statistics.median(timings), 4),
+            'min_seconds': round(min(timings), 4),
+            'peak_python_bytes': peak,
+        }
+
+    def ensure_product(self, tile_dir, tile_files):
+        """统计/缩略图/打包用例共用的合并产品"""
+        product = tile_dir / ('bench_product.vrt' if self.fetch._product_driver() == 'VRT' else 'bench_product.tif')
+        if not product.exists():
+            self.fetch.merge_tiles(tile_dir, product, tile_files)
+        return product
+
+    # ---------- 用例 ----------
+
+    def bench_validate(self, tile_dir, tile_files):
+        def clean_sidecars():
+            # 校验若写出.aux.xml（旧版GetStatistics），每轮前清理以免后续轮次读取缓存的统计量
+            for sidecar in tile_dir.glob('*.aux.xml'):
+                sidecar.unlink()
+
+        def run():
+            for path in tile_files:
+                if not self.fetch._validate_tile_completely(path):
+                    raise RuntimeError(f"校验失败: {path}")
+
+        result = self.measure(run, setup=clean_sidecars)
+        clean_sidecars()
+        return result
+
+    def bench_validate_pool(self, tile_dir, tile_files):
+        """下载前复核清单的路径：进程池并行校验结构、校验和与抽样块"""
+        from data_pipeline.utils.tile_manifest import TileManifest
+        from data_pipeline.utils.tile_validation import validate_tiles
+
+        manifest = TileManifest.load(tile_dir)
+        items = [(path, manifest.tiles[i]) for i, path in enumerate(tile_files)]
+
+        def run():
+            failed = [r for r in validate_tiles(items) if not r['ok']]
+            if failed:
+                raise RuntimeError(f"校验失败: {failed[0]['path']}: {failed[0]['error']}")
+
+        return self.measure(run)
+
+    def bench_merge_tiles(self, tile_dir, tile_files):
+        output = tile_dir / ('bench_merge.vrt' if self.fetch._product_driver() == 'VRT' else 'bench_merge.tif')
+        result = self.measure(lambda: self.fetch.merge_tiles(tile_dir, output, tile_files),
+                              teardown=lambda: output.unlink(missing_ok=True))
+        return result
+
+    def bench_merge_tiles_direct(self, tile_dir, tile_files):
+        output = tile_dir / 'bench_merge_direct.tif'
+        return self.measure(lambda: self.fetch.merge_tiles_direct(tile_files, output),
+                            teardown=lambda: output.unlink(missing_ok=True))
+
+    def bench_calculate_stats(self, tile_dir, tile_files):
+        product = self.ensure_product(tile_dir, tile_files)
+        return self.measure(lambda: self.fetch.calculate_stats(product))
+
+    def bench_generate_thumbnail(self, tile_dir, tile_files):
+        product = self.ensure_product(tile_dir, tile_files)
+        thumbnail = tile_dir / 'bench_thumbnail.png'
+        return self.measure(lambda: self.fetch.generate_thumbnail(product, thumbnail),
+                            teardown=lambda: thumbnail.unlink(missing_ok=True))
+
+    def bench_download_archive(self, tile_dir, tile_files):
+        """NDVIDownloadAPI的流式打包路径（不经过数据库与HTTP层）"""
+        from geodata.archive import stream_archive
+
+        product = self.ensure_product(tile_dir, tile_files)
+        members = [(path, path.name) for path in tile_files] + [(product, product.name)]
+        size = {}
+
+        def run():
+            size['bytes'] = sum(len(chunk) for chunk in stream_archive(members))
+
+        result = self.measure(run)
+        result['archive_bytes'] = size.get('bytes')
+        return result
+
+    def ensure_bands(self, tile_dir, tile_files):
+        """NDVI用例的B04/B08输入，像元数与同规模分块集一致"""
+        band_dir = tile_dir / 'bands'
+        red, nir = band_dir / 'B04.tif', band_dir / 'B08.tif'
+        if not (red.exists() and nir.exists()):
+            red, nir = make_band_pair(band_dir, self.tile_size, self.tile_size * len(tile_files))
+        return red, nir
+
+    def bench_calculate_ndvi(self, tile_dir, tile_files):
+        """进程内分块NumPy引擎"""
+        from data_pipeline.utils.gdal_utils import GDALWrapper
+
+        red, nir = self.ensure_bands(tile_dir, tile_files)
+        output = tile_dir / 'bench_ndvi_numpy.tif'
+        return self.measure(lambda: GDALWrapper().calculate_ndvi(str(red), str(nir), str(output), 6),
+                            teardown=lambda: output.unlink(missing_ok=True))
+
+    def bench_calculate_ndvi_gdal_calc(self, tile_dir, tile_files):
+        """gdal_calc.py子进程（对照组，未安装时跳过）；子进程内存不计入本进程RSS"""
+        from data_pipeline.utils.gdal_utils import GDALWrapper
+
+        if shutil.which('gdal_calc.py') is None:
+            return None
+        red, nir = self.ensure_bands(tile_dir, tile_files)
+        output = tile_dir / 'bench_ndvi_gdal_calc.tif'
+        return self.measure(
+            lambda: GDALWrapper().calculate_ndvi(str(red), str(nir), str(output), 6, engine='gdal_calc'),
+            teardown=lambda: output.unlink(missing_ok=True),
+        )
+
+    # ---------- 对比 ----------
+
+    def compare(self, report, baseline_path, threshold):
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        previous = {(r['case'], r['tiles']): r for r in baseline.get('results', [])}
+        regressions = 0
+        self.stdout.write(f"\n与 {baseline.get('git_commit')} 对比（{baseline_path.name}）:")
+        for result in report['results']:
+            old = previous.get((result['case'], result['tiles']))
+            if not old or not old.get('median_seconds'):
+                continue
+            ratio = result['median_seconds'] / old['median_seconds']
+            flag = ''
+            if ratio > threshold:
+                flag = '  <-- 回退'
+                regressions += 1
+            memory = ''
+            if old.get('max_rss_kb') and result.get('max_rss_kb'):
+                memory = f"  RSS峰值 {old['max_rss_kb'] / 1024:.1f}MB -> {result['max_rss_kb'] / 1024:.1f}MB"
+            self.stdout.write(
+                f"  {result['case']:<20} {result['tiles']:>3}块  {old['median_seconds']:>8.3f}s -> "
+                f"{result['median_seconds']:>8.3f}s  x{ratio:.2f}{memory}{flag}"
+            )
+        if regressions:
+            self.stdout.write(self.style.WARNING(f"{regressions} 个用例耗时超过基线 {threshold} 倍"))
@@ -1,21 +1,44 @@
 import json
+import os
+import random
+import shutil
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 import ee
 import geemap
 from datetime import datetime, timedelta
 import logging
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from pathlib import Path
-from geodata.models import NDVIData  # 根据你的实际应用调整导入路径
+from geodata.models import NDVIData, NDVITile  # 根据你的实际应用调整导入路径
 from django.core.files import File
-import numpy as np
-from PIL import Image
 from osgeo import gdal
+from data_pipeline.utils.ee_session import EESession
+from data_pipeline.utils.lease_lock import LeaseLost, check_fencing_token
+from data_pipeline.utils.metrics import RunTimings, flush as flush_metrics, increment
+from data_pipeline.utils.mosaic import mosaic_tiles
+from data_pipeline.utils.composite import composite_rasters
+from data_pipeline.utils.local_s2 import (cell_region, common_grid, fishnet_cells, process_scene,
+                                          warp_tile, warp_to_grid)
+from data_pipeline.utils.gdal_utils import (
+    MOSAIC_FILENAME, PRODUCT_FILENAME, build_mosaic_vrt, product_creation_options, raster_footprint
+)
+from data_pipeline.utils.ndvi_cube import NDVICube, region_cube_dir
+from data_pipeline.utils.progress import ProgressTracker
+from data_pipeline.utils.raster_stats import compute_raster_stats
+from data_pipeline.utils.thumbnail import generate_thumbnails
+from data_pipeline.utils.tile_manifest import TileManifest
+from data_pipeline.utils.tile_source import EarthEngineTileSource, LocalTileSource
+from data_pipeline.utils.tile_validation import validate_tile, validate_tiles
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     help = 'NDVI数据'
+    # 由任务通过call_command传入的租约丢失事件（命令行不可用）
+    stealth_options = ('lease_lost',)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -63,6 +86,103 @@ class Command(BaseCommand):
                             type=str,
                             default='/root/.config/earthengine/service-account.json',
                             help='GEE服务账户文件路径')
+        parser.add_argument('--workers',
+                            type=int,
+                            default=4,
+                            help='并发下载分块的线程数（1为串行）')
+        parser.add_argument('--max-retries',
+                            type=int,
+                            default=3,
+                            help='单个分块下载失败后的最大重试次数')
+        parser.add_argument('--retry-backoff',
+                            type=float,
+                            default=2.0,
+                            help='重试退避基准秒数（指数增长）')
+        parser.add_argument('--tile-source',
+                            choices=['gee', 'local'],
+                            default='gee',
+                            help='分块数据源：gee为Earth Engine，local为本地假数据源')
+        parser.add_argument('--local-tiles',
+                            type=str,
+                            default=None,
+                            help='local数据源的分块目录（包含tile_1.tif...）')
+        parser.add_argument('--stats-workers',
+                            type=int,
+                            default=4,
+                            help='统计计算与备用镶嵌的线程数（1为单线程）')
+        parser.add_argument('--thumbnail-sizes',
+                            type=str,
+                            default='1024',
+                            help='额外生成的缩略图尺寸（逗号分隔，256px缩略图始终生成）')
+        parser.add_argument('--product-format',
+                            choices=['cog', 'gtiff', 'vrt'],
+                            default='cog',
+                            help='合并产品格式：cog保留为正式产品（含概视图），gtiff为旧版临时文件，'
+                                 'vrt为引用分块的虚拟镶嵌（不写出合并文件）')
+        parser.add_argument('--compress',
+                            choices=['ZSTD', 'DEFLATE', 'LZW'],
+                            default='ZSTD',
+                            help='合并产品压缩算法')
+        parser.add_argument('--predictor',
+                            type=int,
+                            choices=[1, 2, 3],
+                            default=3,
+                            help='压缩预测器（3为浮点预测器）')
+        parser.add_argument('--num-threads',
+                            type=str,
+                            default='ALL_CPUS',
+                            help='GDAL压缩线程数（数字或ALL_CPUS）')
+        parser.add_argument('--cube-dir',
+                            type=str,
+                            default=None,
+                            help='NDVI时间序列立方体目录（默认使用settings.NDVI_CUBE_DIR）')
+        parser.add_argument('--no-cube',
+                            action='store_true',
+                            help='不追加到时间序列立方体')
+        parser.add_argument('--raster-db',
+                            action='store_true',
+                            help='入库后把产品切块写入PostGIS栅格表（默认取settings.NDVI_RASTER_DB_ENABLED）')
+        parser.add_argument('--region',
+                            type=str,
+                            default=None,
+                            help='处理区域（settings.NDVI_REGIONS中的键，默认NDVI_DEFAULT_REGION）')
+        parser.add_argument('--start-date',
+                            type=str,
+                            default=None,
+                            help='时间窗口起始日期（YYYY-MM-DD，含，默认结束日期前7天）')
+        parser.add_argument('--end-date',
+                            type=str,
+                            default=None,
+                            help='时间窗口结束日期（YYYY-MM-DD，不含，默认今天），同时作为产品日期')
+        parser.add_argument('--validation-workers',
+                            type=int,
+                            default=None,
+                            help='复核已有分块的进程数（默认CPU核数）')
+        parser.add_argument('--lease',
+                            type=str,
+                            default=None,
+                            help='调度方持有的Redis租约键（由任务传入）')
+        parser.add_argument('--fencing-token',
+                            type=int,
+                            default=None,
+                            help='租约栅栏令牌，入库前校验，过期的持有者不会覆盖新结果')
+        parser.add_argument('--local-scenes',
+                            type=str,
+                            nargs='+',
+                            default=None,
+                            help='离线模式：本地L2A场景目录（含B04、B08、QA60、云概率GeoTIFF），多个场景时做时间中值合成')
+        parser.add_argument('--boa-offset',
+                            type=float,
+                            default=0.0,
+                            help='本地L2A反射率偏移（处理基线04.00及以后为-1000，与S2_SR_HARMONIZED一致）')
+        parser.add_argument('--composite-extras',
+                            type=str,
+                            default='',
+                            help='中值合成时额外输出的统计量，逗号分隔（mean,max,count）')
+        parser.add_argument('--memory-budget',
+                            type=int,
+                            default=256,
+                            help='本地合成的内存预算（MB）')
 
     def handle(self, *args, **kwargs):
         # 路径解析
@@ -71,15 +191,164 @@ class Command(BaseCommand):
 
         # 显式传递服务账户路径
         self.service_account = Path(kwargs['service_account']).resolve()
+        self.workers = max(1, kwargs.get('workers') or 1)
+        self.max_retries = max(0, kwargs.get('max_retries') or 0)
+        self.retry_backoff = kwargs.get('retry_backoff') or 0.0
+        self.tile_source_name = kwargs.get('tile_source') or 'gee'
+        self.local_tiles = kwargs.get('local_tiles')
+        self.stats_workers = max(1, kwargs.get('stats_workers') or 1)
+        self.validation_workers = kwargs.get('validation_workers')
+        self.product_format = kwargs.get('product_format') or 'cog'
+        self.compress = kwargs.get('compress') or 'ZSTD'
+        self.predictor = kwargs.get('predictor') or 3
+        self.num_threads = kwargs.get('num_threads') or 'ALL_CPUS'
+        from django.conf import settings
+        if kwargs.get('no_cube'):
+            self.cube_dir = None
+        else:
+            self.cube_dir = kwargs.get('cube_dir') or getattr(settings, 'NDVI_CUBE_DIR', None)
+        self.raster_db = kwargs.get('raster_db') or getattr(settings, 'NDVI_RASTER_DB_ENABLED', False)
+        self.thumbnail_sizes = [
+            int(v) for v in (kwargs.get('thumbnail_sizes') or '').split(',') if v.strip()
+        ]
+        self.local_scenes = kwargs.get('local_scenes')
+        self.boa_offset = kwargs.get('boa_offset') or 0.0
+        self.composite_extras = [s.strip() for s in (kwargs.get('composite_extras') or '').split(',') if s.strip()]
+        self.memory_budget = (kwargs.get('memory_budget') or 256) * 1024 * 1024
+        self.session = EESession()
+        self.lease = kwargs.get('lease')
+        self.fencing_token = kwargs.get('fencing_token')
+        self.lease_lost = kwargs.get('lease_lost')
+        self.setup_window(kwargs)
+        self.timings = RunTimings(run_id=f"{self.product_name()}_{datetime.now().strftime('%H%M%S')}")
+        self.output_path = None
+        self.ndvi_data = None
+        self.progress = self.start_progress()
+        status = 'failed'
+        error = ''
 
         try:
-            self._init_gee()
-            ndvi_data = self.get_sentinel2_data()
-            self.export_ndvi(ndvi_data, output_dir)
+            if self.local_scenes:
+                self.process_local([Path(p).resolve() for p in self.local_scenes], output_dir)
+            else:
+                self._init_gee()
+                with self.stage('ee_graph'):
+                    ndvi_data = self.get_sentinel2_data()
+                self.export_ndvi(ndvi_data, output_dir)
+            status = 'success'
             self.log(self.style.SUCCESS(f'数据已保存至：{output_dir}'))
         except Exception as e:
+            error = str(e)
             logger.error(f'下载失败：{str(e)}')
             raise e  # 抛出详细错误
+        finally:
+            summary = self.session.summary()
+            self.log(f"EE服务端往返次数: {summary['round_trips']}，"
+                     f"累计耗时 {summary['round_trip_seconds']}s")
+            timings = self.finish_timings(status, summary)
+            self.report('finish', status, error, timings=timings, ndvi=self.ndvi_data)
+
+    def start_progress(self):
+        """登记本次运行（数据库不可用时仅记录日志，不影响处理）"""
+        try:
+            return ProgressTracker.start(
+                name=self.product_name(),
+                region=self.region,
+                start_date=self.start_date,
+                end_date=self.end_date,
+                source='local' if self.local_scenes else self.tile_source_name,
+            )
+        except Exception as e:
+            self.log(f"运行记录创建失败: {str(e)}", logging.WARNING)
+            return None
+
+    def report(self, event, *args, **kwargs):
+        """转发进度事件（未登记运行时忽略）"""
+        progress = getattr(self, 'progress', None)
+        if progress is not None:
+            getattr(progress, event)(*args, **kwargs)
+
+    def stage(self, name):
+        """阶段计时并更新运行进度中的当前阶段（未在handle中初始化计时时不记录）
+
+        进入每个阶段前检查租约，续期失败后不再继续处理。
+        """
+        self.ensure_lease_held()
+        self.report('set_stage', name)
+        return self.timed(name)
+
+    def timed(self, name):
+        """只计时不切换当前阶段，用于下载线程内的子步骤（如逐块校验）"""
+        timings = getattr(self, 'timings', None)
+        return timings.stage(name) if timings else nullcontext()
+
+    def finish_timings(self, status, ee_summary):
+        """记录运行结果计数，并把分阶段耗时写入产品目录的timings.json"""
+        increment('ndvi_pipeline_runs_total', status=status)
+        flush_metrics()
+        summary = self.timings.summary()
+        for stage, entry in sorted(summary['stages'].items(), key=lambda kv: -kv[1]['seconds']):
+            self.log(f"阶段耗时 {stage}: {entry['seconds']}s（{entry['count']}次）")
+        if self.output_path and self.output_path.exists():
+            try:
+                self.timings.save(self.output_path, {'status': status, 'ee': ee_summary})
+            except OSError as e:
+                self.log(f"计时汇总写入失败: {str(e)}", logging.WARNING)
+        return summary
+
+    def setup_window(self, kwargs):
+        """解析处理区域与时间窗口（缺省为默认区域的最近7天滚动窗口）"""
+        from django.conf import settings
+
+        regions = getattr(settings, 'NDVI_REGIONS', {})
+        self.region = kwargs.get('region') or getattr(settings, 'NDVI_DEFAULT_REGION', 'beijing')
+        if self.region not in regions:
+            raise CommandError(f"未配置的区域: {self.region}")
+        self.region_config = regions[self.region]
+        self.default_region = self.region == getattr(settings, 'NDVI_DEFAULT_REGION', 'beijing')
+
+        try:
+            end = kwargs.get('end_date')
+            self.end_date = datetime.strptime(end, '%Y-%m-%d').date() if end else datetime.now().date()
+            start = kwargs.get('start_date')
+            self.start_date = datetime.strptime(start, '%Y-%m-%d').date() if start \
+                else self.end_date - timedelta(days=7)
+        except ValueError as e:
+            raise CommandError(f"日期格式错误: {str(e)}")
+        if self.start_date >= self.end_date:
+            raise CommandError(f"起始日期须早于结束日期: {self.start_date} ~ {self.end_date}")
+
+        # 区域立方体网格各不相同，非默认区域写入各自的子目录
+        if self.cube_dir:
+            self.cube_dir = region_cube_dir(self.cube_dir, self.region,
+                                            getattr(settings, 'NDVI_DEFAULT_REGION', 'beijing'))
+
+    def product_id(self):
+        """产品目录名：默认区域沿用日期目录，其他区域加区域前缀"""
+        date_str = self.end_date.strftime('%Y%m%d')
+        return date_str if self.default_region else f"{self.region}_{date_str}"
+
+    def product_name(self):
+        return f"{self.region}_ndvi_{self.end_date.strftime('%Y%m%d')}"
+
+    def window_metadata(self):
+        return {
+            'region': self.region,
+            'window': [self.start_date.isoformat(), self.end_date.isoformat()],
+        }
+
+    def ensure_lease_held(self):
+        """心跳线程已判定租约丢失时抛出LeaseLost（本地检查，不访问Redis）"""
+        lost = getattr(self, 'lease_lost', None)
+        if lost is not None and lost.is_set():
+            raise LeaseLost(f"租约已丢失，停止处理: {self.lease}")
+
+    def check_lease(self):
+        """写入前校验租约令牌（未由任务调度时不校验）"""
+        self.ensure_lease_held()
+        if not getattr(self, 'lease', None) or getattr(self, 'fencing_token', None) is None:
+            return
+        check_fencing_token(self.lease, self.fencing_token)
 
     def _init_gee(self):
         """显式服务账户初始化"""
@@ -100,15 +369,20 @@ class Command(BaseCommand):
             raise
 
     def get_sentinel2_data(self):
+        """获取NDVI中值合成（同一次运行内只构建一次）"""
+        return self.session.cached('composite', self._build_composite)
+
+    def _build_composite(self):
         """修复后的Sentinel-2 NDVI逻辑"""
         dataset_path = 'COPERNICUS/S2_SR_HARMONIZED'
-        bei_jing = ee.FeatureCollection("projects/ee-brucepengyuan/assets/bei_jing")
-        valid_geometry = bei_jing.geometry().bounds()
+        valid_geometry = self.session.cached(
+            'valid_geometry',
+            lambda: ee.FeatureCollection(self.region_config['asset']).geometry().bounds()
+        )
 
-        # 时间范围调整为滚动窗口（确保数据新鲜）
-        today = datetime.now()
-        start_date = (today - timedelta(days=7)).strftime('%Y-%m-%d')  # 延长至45天
-        end_date = today.strftime('%Y-%m-%d')
+        # 时间窗口（默认为最近7天滚动窗口，回填时由参数指定）
+        start_date = self.start_date.strftime('%Y-%m-%d')
+        end_date = self.end_date.strftime('%Y-%m-%d')
 
         # 数据加载与过滤
         s2_collection = ee.ImageCollection(dataset_path) \
@@ -157,7 +431,7 @@ class Command(BaseCommand):
             )
         ).select(['NDVI'])  # 仅保留NDVI波段
         # 空集合检查
-        if ndvi_collection.size().getInfo() == 0:
+        if self.session.get_info('collection_size', ndvi_collection.size()) == 0:
             raise ValueError(f"{start_date}至{end_date}无有效数据")
 
         return ndvi_collection.median().clip(valid_geometry)
@@ -165,41 +439,46 @@ class Command(BaseCommand):
     def export_ndvi(self, image, output_dir):
         """增强导出稳定性"""
 
+        # 波段列表只请求一次，同时用于空图像检查和元数据
+        bands = self.session.get_info('band_names', image.bandNames())
         # 若为空图像则抛出异常
-        if not image.bandNames().size().gt(0).getInfo():
+        if not bands:
             raise ValueError("生成图像为空，请检查输入数据")
         # filename = f"beijing_ndvi_{datetime.now().strftime('%Y%m%d')}"
         # output_path = output_dir / filename
         # output_path.mkdir(parents=True, exist_ok=True)
 
-        # 从get_sentinel2_data获取边界
-        valid_geometry = self.get_sentinel2_data().geometry()
+        # 复用构建合成时缓存的边界，避免重建整个计算图
+        valid_geometry = self.session.get('valid_geometry')
 
         # 创建日期子目录
-        date_str = datetime.now().strftime('%Y%m%d')
-        output_path = output_dir / date_str
+        output_path = output_dir / self.product_id()
         output_path.mkdir(parents=True, exist_ok=True)
+        self.output_path = output_path
 
         # 生成元数据文件
         metadata = {
             'generated_at': datetime.now().isoformat(),
             'data_source': 'Sentinel-2',
-            'bands': image.bandNames().getInfo(),
+            'bands': bands,
             'crs': 'EPSG:4526',
-            'resolution': '10m'
+            'resolution': '10m',
+            **self.window_metadata(),
         }
         with open(output_path / 'metadata.json', 'w') as f:
             json.dump(metadata, f)
 
         self.log("开始下载分块数据...")
         # 下载分块
-        full_fishnet = geemap.fishnet(
-            valid_geometry,
-            rows=8,
-            cols=6,
-            delta=0.5,
-            crs='EPSG:4526'  # 显式指定坐标系
-        )
+        # geemap.fishnet内部会对范围做一次getInfo，不经过会话缓存，单独计入往返次数
+        with self.session.external('fishnet_bounds'):
+            full_fishnet = geemap.fishnet(
+                valid_geometry,
+                rows=8,
+                cols=6,
+                delta=0.5,
+                crs='EPSG:4526'  # 显式指定坐标系
+            )
         fishnet_features = full_fishnet.toList(2)  # 仅获取前两个特征
         partial_fishnet = ee.FeatureCollection(fishnet_features)
         image = image.setDefaultProjection(crs='EPSG:4526', scale=10)
@@ -207,11 +486,12 @@ class Command(BaseCommand):
         if not output_path.exists():
             output_path.mkdir(parents=True, exist_ok=True)
         # 执行下载并验证结果
-        download_result = self.download_and_validate_tiles(
-            image=image.clip(valid_geometry),
-            output_path=output_path,
-            fishnet=partial_fishnet
-        )
+        with self.stage('download'):
+            download_result = self.download_and_validate_tiles(
+                image=image.clip(valid_geometry),
+                output_path=output_path,
+                fishnet=partial_fishnet
+            )
 
         if not download_result:
             raise RuntimeError("分块下载验证失败")
@@ -221,51 +501,203 @@ class Command(BaseCommand):
 
         return output_path
 
-    def download_and_validate_tiles(self, image, output_path, fishnet):
-        """改进后的下载和验证方法"""
+    def process_local(self, scene_dirs, output_dir):
+        """离线处理本地Sentinel-2 L2A场景，产出与EE路径相同的分块布局与NDVIData记录"""
+        for scene_dir in scene_dirs:
+            if not scene_dir.is_dir():
+                raise FileNotFoundError(f"本地场景目录不存在: {scene_dir}")
+
+        output_path = output_dir / self.product_id()
+        work_dir = output_path / '_work'
+        work_dir.mkdir(parents=True, exist_ok=True)
+        self.output_path = output_path
+
+        metadata = {
+            'generated_at': datetime.now().isoformat(),
+            'data_source': 'Sentinel-2 L2A (local)',
+            'bands': ['NDVI'],
+            'crs': 'EPSG:4526',
+            'resolution': '10m',
+            'scenes': [d.name for d in scene_dirs],
+            **self.window_metadata(),
+        }
+
         try:
-            # 清理输出目录
-            for f in output_path.glob('*.tif'):
-                try:
-                    f.unlink()
-                except:
-                    pass
-
-            # 获取预期分块数
-            expected_tiles = fishnet.size().getInfo() if hasattr(fishnet, 'size') else 2
-
-            # 使用更可靠的下载方法
-            self.log(f"开始下载{expected_tiles}个分块...")
-
-
-            self.log(f"geemap下载")
-            # 方法2：逐个分块下载
-            for i, feature in enumerate(fishnet.getInfo()['features']):
-                region = ee.Feature(feature).geometry()
-                filename = f"tile_{i + 1}.tif"
-                self.log(f"下载分块 {i + 1}/{expected_tiles}...")
-
-                try:
-                    geemap.download_ee_image(
-                        image=image.clip(region),
-                        filename=str(output_path / filename),
-                        scale=10,
-                        crs='EPSG:4526',
-                        region=region,
-                    )
-                except Exception as e:
-                    self.log(f"分块 {i + 1} 下载失败: {str(e)}")
-                    raise
+            scene_ndvis = []
+            for i, scene_dir in enumerate(scene_dirs):
+                self.log(f"本地云掩膜与NDVI计算 ({i + 1}/{len(scene_dirs)}): {scene_dir.name}")
+                scene_ndvi = work_dir / f'scene_{i}.tif'
+                with self.stage('local_ndvi'):
+                    process_scene(scene_dir, scene_ndvi, workers=self.workers, boa_offset=self.boa_offset)
+                scene_ndvis.append(scene_ndvi)
+
+            if len(scene_ndvis) > 1:
+                ndvi_path = self.composite_local(scene_ndvis, work_dir, output_path, metadata)
+            else:
+                ndvi_path = scene_ndvis[0]
+
+            with open(output_path / 'metadata.json', 'w') as f:
+                json.dump(metadata, f)
+
+            self.log("切分分块...")
+            with self.stage('split_tiles'):
+                self.tile_files = self.split_local_tiles(ndvi_path, output_path)
+            self.save_to_database(None, output_path, metadata)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return output_path
 
-            # 验证下载的文件
-            tile_files = sorted(output_path.glob('*.tif'))
-            if len(tile_files) != expected_tiles:
-                raise RuntimeError(f"下载文件数量不匹配: 期望 {expected_tiles}, 实际 {len(tile_files)}")
+    def composite_local(self, scene_ndvis, work_dir, output_path, metadata):
+        """多期掩膜NDVI对齐到公共网格后逐块中值合成，额外统计量保存在产品目录"""
+        self.log(f"时间中值合成: {len(scene_ndvis)} 期")
+        grid = common_grid(scene_ndvis)
+        aligned = [warp_to_grid(p, grid) for p in scene_ndvis]
+        outputs = {'median': work_dir / 'composite_median.tif'}
+        for name in self.composite_extras:
+            outputs[name] = output_path / f'composite_{name}.tif'
+        try:
+            with self.stage('composite'):
+                composite_rasters(aligned, outputs, workers=self.workers, memory_budget=self.memory_budget)
+        finally:
+            for vrt in aligned:
+                gdal.Unlink(vrt)
+
+        metadata['composite'] = {
+            'method': 'median',
+            'inputs': len(scene_ndvis),
+            'extras': {name: outputs[name].name for name in self.composite_extras},
+        }
+        return outputs['median']
+
+    def split_local_tiles(self, ndvi_path, output_path, rows=8, cols=6):
+        """按EPSG:4526网格把场景NDVI切成tile_N.tif并写入下载清单"""
+        cells = fishnet_cells(ndvi_path, rows=rows, cols=cols)
+        manifest = TileManifest.load(output_path)
+        manifest.prune(len(cells))
+        self.report('tiles_planned', len(cells))
+
+        def build(index, cell):
+            tile_path = manifest.tile_path(index)
+            self.report('tile_started', index, 1)
+            started = time.monotonic()
+            warp_tile(ndvi_path, tile_path, cell)
+            manifest.mark_done(index, cell_region(cell), tile_path)
+            self.report('tile_done', index, tile_path.stat().st_size, time.monotonic() - started)
+            return tile_path
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in executor.map(lambda args: build(*args), enumerate(cells)):
+                pass
+
+        manifest.save()
+        self.manifest = manifest
+        return manifest.done_paths()
+
+    def build_tile_source(self, image):
+        """根据参数创建分块数据源"""
+        if self.tile_source_name == 'local':
+            if not self.local_tiles:
+                raise ValueError("local数据源需要指定--local-tiles")
+            return LocalTileSource(Path(self.local_tiles).resolve())
+        return EarthEngineTileSource(image, scale=10, crs='EPSG:4526')
+
+    def download_tile_with_retry(self, source, manifest, index, region, total):
+        """下载单个分块（先写.part再原子替换），失败或校验不通过时按指数退避重试"""
+        dest_path = manifest.tile_path(index)
+        part_path = dest_path.with_name(dest_path.name + '.part')
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self.log(f"下载分块 {index + 1}/{total}（第{attempt}次）...")
+                self.report('tile_started', index, attempt)
+                started = time.monotonic()
+                source.download(index, region, part_path)
+                elapsed = time.monotonic() - started
+                os.replace(part_path, dest_path)
+                with self.timed('validate'):
+                    valid = self._validate_tile_completely(dest_path)
+                if not valid:
+                    dest_path.unlink(missing_ok=True)
+                    raise RuntimeError(f"文件验证失败: {dest_path.name}")
+                size = dest_path.stat().st_size
+                self.report('tile_done', index, size, elapsed)
+                if getattr(self, 'timings', None):
+                    mbps = self.timings.tile_downloaded(index, size, elapsed)
+                    self.log(f"分块 {index + 1} 下载完成: {size / 1024 / 1024:.1f}MB，"
+                             f"{elapsed:.1f}s，{mbps:.2f}MB/s")
+                manifest.mark_done(index, region, dest_path)
+                manifest.save()
+                return dest_path
+            except Exception as e:
+                part_path.unlink(missing_ok=True)
+                if attempt > self.max_retries:
+                    self.log(f"分块 {index + 1} 下载失败，已重试{self.max_retries}次: {str(e)}",
+                             logging.ERROR)
+                    manifest.mark_failed(index, region, e)
+                    increment('ndvi_pipeline_tiles_total', status='failed')
+                    self.report('tile_failed', index, e)
+                    manifest.save()
+                    raise
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                delay += random.uniform(0, self.retry_backoff)
+                self.log(f"分块 {index + 1} 下载失败: {str(e)}，{delay:.1f}秒后重试",
+                         logging.WARNING)
+                increment('ndvi_pipeline_tiles_total', status='retry')
+                time.sleep(delay)
 
-            # 详细验证每个文件
-            for tile in tile_files:
-                if not self._validate_tile_completely(tile):
-                    raise RuntimeError(f"文件验证失败: {tile.name}")
+    def download_and_validate_tiles(self, image, output_path, fishnet):
+        """基于清单的可续传下载：已完成且校验一致的分块直接跳过"""
+        try:
+            # 一次性获取全部分块几何
+            fishnet_info = self.session.get_info('fishnet', fishnet)
+            regions = [feature['geometry'] for feature in fishnet_info['features']]
+            expected_tiles = len(regions)
+
+            manifest = TileManifest.load(output_path)
+            self.manifest = manifest
+            stale = manifest.prune(expected_tiles)
+            if stale:
+                self.log(f"清理超出当前网格的旧分块: {[i + 1 for i in stale]}")
+
+            valid = self.revalidate_manifest(manifest, regions)
+            # 复核是下载阶段内的子阶段，结束后切回下载
+            self.report('set_stage', 'download')
+            pending = [(i, region) for i, region in enumerate(regions) if i not in valid]
+            skipped = expected_tiles - len(pending)
+            if skipped:
+                self.log(f"清单中已有{skipped}个有效分块，跳过下载")
+            pending_indices = {i for i, _ in pending}
+            self.report('tiles_planned', expected_tiles,
+                        [i for i in range(expected_tiles) if i not in pending_indices])
+
+            if pending:
+                source = self.build_tile_source(image)
+                self.log(f"开始下载{len(pending)}/{expected_tiles}个分块"
+                         f"（数据源: {source.name}，并发: {self.workers}）...")
+
+                failed = []
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    futures = {
+                        executor.submit(
+                            self.download_tile_with_retry,
+                            source, manifest, i, region, expected_tiles
+                        ): i
+                        for i, region in pending
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception:
+                            failed.append(futures[future] + 1)
+
+                if failed:
+                    raise RuntimeError(f"以下分块下载失败: {sorted(failed)}")
+
+            # 以清单为准确定分块列表（不再依赖目录通配）
+            self.tile_files = manifest.done_paths()
+            if len(self.tile_files) != expected_tiles:
+                raise RuntimeError(f"下载文件数量不匹配: 期望 {expected_tiles}, 实际 {len(self.tile_files)}")
 
             return True
 
@@ -276,47 +708,31 @@ class Command(BaseCommand):
             return False
 
     def _validate_tile_completely(self, tile_path):
-        """更全面的文件验证"""
-        try:
-            # 检查文件基本属性
-            if not tile_path.exists() or tile_path.stat().st_size < 1024:  # 至少1KB
-                return False
-
-            # 检查GDAL是否能打开
-            ds = gdal.Open(str(tile_path))
-            if ds is None:
-                return False
-
-            # 检查波段
-            band = ds.GetRasterBand(1)
-            if band is None:
-                ds = None
-                return False
-
-            # 检查统计数据
-            try:
-                stats = band.GetStatistics(True, True)
-                if stats is None or len(stats) != 4:
-                    ds = None
-                    return False
-            except:
-                ds = None
-                return False
-
-            # 尝试读取少量数据
-            try:
-                sample = band.ReadAsArray(0, 0, 10, 10)
-                if sample is None:
-                    ds = None
-                    return False
-            except:
-                ds = None
-                return False
-
-            ds = None
-            return True
-        except:
-            return False
+        """分块校验：TIFF结构与块偏移 + 抽样解码（不做整幅统计，不写.aux.xml）"""
+        result = validate_tile(tile_path)
+        if not result['ok']:
+            self.log(f"分块校验失败 {Path(tile_path).name}: {result['error']}", logging.WARNING)
+        return result['ok']
+
+    def revalidate_manifest(self, manifest, regions):
+        """并行复核清单中已完成的分块（结构 + 大小/校验和 + 抽样），返回仍有效的序号"""
+        entries = {i: manifest.done_entry(i, region) for i, region in enumerate(regions)}
+        entries = {i: entry for i, entry in entries.items() if entry}
+        if not entries:
+            return set()
+        indices = sorted(entries)
+        with self.stage('revalidate'):
+            results = validate_tiles(
+                [(manifest.output_path / entries[i]['filename'], entries[i]) for i in indices],
+                workers=getattr(self, 'validation_workers', None),
+            )
+        valid = set()
+        for i, result in zip(indices, results):
+            if result['ok']:
+                valid.add(i)
+            else:
+                self.log(f"清单中的分块 {i + 1} 已失效，将重新下载: {result['error']}", logging.WARNING)
+        return valid
 
     def _debug_download_status(self, output_path):
         """输出下载状态调试信息"""
@@ -337,99 +753,217 @@ class Command(BaseCommand):
     def save_to_database(self, ee_image, output_path, metadata):
         """将NDVI数据保存到数据库"""
         from django.conf import settings
-        from django.db import transaction
-        from django.core.exceptions import ObjectDoesNotExist
 
         try:
             self.log("分块下载完成，开始合并...")
-            temp_tif = output_path / 'merged.tif'
-            self.merge_tiles(output_path, temp_tif)
+            keep_product = getattr(self, 'product_format', 'gtiff') in ('cog', 'vrt')
+            temp_tif = output_path / self._product_filename()
+            with self.stage('merge'):
+                self.merge_tiles(output_path, temp_tif, getattr(self, 'tile_files', None))
+            if keep_product:
+                metadata = {**metadata, 'product': temp_tif.name}
 
             self.log("合并完成，计算统计数据...")
-            stats, coverage = self.calculate_stats(temp_tif)
+            with self.stage('stats'):
+                stats, coverage = self.calculate_stats(temp_tif)
+            metadata = {**metadata, 'stats': stats}
 
-            # 修正特殊值
-            def fix_float(value):
-                return None if value in (float('-inf'), float('inf'), float('nan')) else value
             self.log("生成缩略图...")
             thumbnail_path = output_path / 'thumbnail.png'
-            self.generate_thumbnail(temp_tif, thumbnail_path)
+            with self.stage('thumbnail'):
+                self.generate_thumbnail(temp_tif, thumbnail_path)
+
+            self.log("建立分块索引...")
+            with self.stage('tile_index'):
+                tile_records = self.build_tile_records(output_path)
 
             self.log("保存到数据库...")
-            date_str = output_path.name
+            date_str = self.end_date.strftime('%Y%m%d')
+            product_name = self.product_name()
             rel_path = output_path.relative_to(settings.BASE_DIR)
+            self.check_lease()
+            if getattr(self, 'lease', None):
+                metadata = {**metadata, 'lease': {'key': self.lease, 'token': self.fencing_token}}
+            if getattr(self, 'timings', None):
+                metadata = {**metadata, 'timings': self.timings.summary()['stages']}
+
+            with self.stage('db_save'):
+                ndvi_data = self.upsert_product(
+                    NDVIData(
+                        name=product_name,
+                        acquisition_date=datetime.strptime(date_str, '%Y%m%d').date(),
+                        resolution=10.0,
+                        data_dir=str(rel_path),
+                        min_value=stats['min'],
+                        max_value=stats['max'],
+                        mean_value=stats['mean'],
+                        coverage=coverage,
+                        metadata=metadata,
+                    ),
+                    tile_records,
+                    thumbnail_path,
+                )
 
-            # 使用事务确保数据一致性
-            with transaction.atomic():
-                # 检查是否已存在相同日期的记录
-                try:
-                    existing_data = NDVIData.objects.get(name=f"beijing_ndvi_{date_str}")
-                    self.log(self.style.WARNING(f"数据已存在，将更新记录: {existing_data.id}"))
-
-                    # 更新现有记录
-                    with open(thumbnail_path, 'rb') as thumb_file:
-                        existing_data.acquisition_date = datetime.strptime(date_str, '%Y%m%d').date()
-                        existing_data.resolution = 10.0
-                        existing_data.data_dir = str(rel_path)
-                        existing_data.min_value = stats['min']
-                        existing_data.max_value = stats['max']
-                        existing_data.mean_value = stats['mean']
-                        existing_data.coverage = coverage
-                        existing_data.metadata = metadata
-
-                        # 删除旧的缩略图
-                        if existing_data.thumbnail:
-                            existing_data.thumbnail.delete()
-
-                        # 保存新缩略图
-                        existing_data.thumbnail.save(
-                            f"ndvi_thumb_{date_str}.png",
-                            File(thumb_file)
-                        )
-
-                        existing_data.save()
-                        ndvi_data = existing_data
-
-                except NDVIData.DoesNotExist:
-                    # 创建新记录
-                    with open(thumbnail_path, 'rb') as thumb_file:
-                        ndvi_data = NDVIData(
-                            name=f"beijing_ndvi_{date_str}",
-                            acquisition_date=datetime.strptime(date_str, '%Y%m%d').date(),
-                            resolution=10.0,
-                            data_dir=str(rel_path),
-                            min_value=fix_float(stats['min']),
-                            max_value=fix_float(stats['max']),
-                            mean_value=fix_float(stats['mean']),
-                            coverage=coverage,
-                            metadata=metadata
-                        )
-                        ndvi_data.thumbnail.save(
-                            f"ndvi_thumb_{date_str}.png",
-                            File(thumb_file)
-                        )
-                        ndvi_data.save()
-
-            # 清理临时文件
-            temp_tif.unlink()
+            # 追加到时间序列立方体（失败不影响本期产品入库）；立方体与栅格表写入同样需要栅栏校验
+            self.check_lease()
+            with self.stage('cube'):
+                self.ingest_cube(temp_tif, ndvi_data.acquisition_date)
+
+            # 写入PostGIS栅格表（失败不影响本期产品入库）
+            if getattr(self, 'raster_db', False):
+                self.check_lease()
+                with self.stage('raster_db'):
+                    self.load_raster_db(ndvi_data)
+
+            # COG/VRT为正式产品需保留（并清理切换格式前的旧产品），旧版GTiff仅为临时文件
+            if keep_product:
+                for stale in {PRODUCT_FILENAME, MOSAIC_FILENAME} - {temp_tif.name}:
+                    (output_path / stale).unlink(missing_ok=True)
+            else:
+                temp_tif.unlink()
             self.log(self.style.SUCCESS("保存成功！"))
 
+            self.ndvi_data = ndvi_data
             return ndvi_data
 
         except Exception as e:
             self.log(self.style.ERROR(f"保存到数据库失败: {str(e)}"))
             raise RuntimeError(f"Database save failed: {str(e)}")
 
-    def merge_tiles(self, tile_dir, output_path):
+    def upsert_product(self, ndvi_data, tile_records, thumbnail_path):
+        """按产品名单条upsert产品记录并批量重建分块索引
+
+        缩略图在事务外以新文件名上传，提交后再删除旧缩略图（回滚时删除新上传的），
+        事务内只有加锁读取、upsert与分块索引的批量写入，不做对象存储的网络IO。
+        bulk_create不触发post_save信号，列表缓存版本在提交后手动更新。
+        """
+        from django.db import transaction
+        from geodata.cache import bump_list_cache_version
+
+        thumbnail_field = NDVIData._meta.get_field('thumbnail')
+        storage = thumbnail_field.storage
+        with open(thumbnail_path, 'rb') as thumb_file:
+            new_thumbnail = storage.save(
+                thumbnail_field.generate_filename(
+                    ndvi_data, f"ndvi_thumb_{self.product_id()}_{uuid.uuid4().hex[:8]}.png"
+                ),
+                File(thumb_file),
+            )
+        ndvi_data.thumbnail = new_thumbnail
+        ndvi_data.clean_stats()
+        update_fields = ['acquisition_date', 'resolution', 'data_dir', 'min_value', 'max_value',
+                         'mean_value', 'coverage', 'thumbnail', 'metadata']
+
+        try:
+            with transaction.atomic():
+                # 只锁定并读取令牌与旧缩略图名，供防护令牌检查与提交后清理
+                existing = NDVIData.objects.select_for_update().filter(name=ndvi_data.name) \
+                    .values('id', 'metadata', 'thumbnail').first()
+                if existing:
+                    self.log(self.style.WARNING(f"数据已存在，将更新记录: {existing['id']}"))
+                    self.check_stale_write(existing['metadata'])
+
+                NDVIData.objects.bulk_create(
+                    [ndvi_data], update_conflicts=True, unique_fields=['name'], update_fields=update_fields
+                )
+                # 冲突更新时bulk_create不回填主键
+                ndvi_data.pk = existing['id'] if existing else \
+                    NDVIData.objects.values_list('id', flat=True).get(name=ndvi_data.name)
+                ndvi_data._state.adding = False
+
+                NDVITile.objects.filter(ndvi_id=ndvi_data.pk).delete()
+                NDVITile.objects.bulk_create(
+                    [NDVITile(ndvi_id=ndvi_data.pk, **record) for record in tile_records], batch_size=500
+                )
+
+                old_thumbnail = existing['thumbnail'] if existing else None
+                if old_thumbnail and old_thumbnail != new_thumbnail:
+                    transaction.on_commit(lambda: self.delete_thumbnail(storage, old_thumbnail))
+                transaction.on_commit(bump_list_cache_version)
+        except Exception:
+            self.delete_thumbnail(storage, new_thumbnail)
+            raise
+        return ndvi_data
+
+    def delete_thumbnail(self, storage, name):
+        try:
+            storage.delete(name)
+        except Exception as e:
+            self.log(self.style.WARNING(f"删除缩略图失败 {name}: {str(e)}"), logging.WARNING)
+
+    def check_stale_write(self, existing_metadata):
+        """同一租约下已有更新令牌写入的记录时拒绝覆盖"""
+        lease = (existing_metadata or {}).get('lease') or {}
+        if not getattr(self, 'lease', None) or lease.get('key') != self.lease:
+            return
+        if (lease.get('token') or 0) > self.fencing_token:
+            raise LeaseLost(f"记录已由令牌 {lease['token']} 写入，放弃令牌 {self.fencing_token} 的结果")
+
+    def build_tile_records(self, output_path):
+        """根据下载清单计算每个分块的覆盖范围、大小、校验和与块布局"""
+        from django.conf import settings
+        from django.contrib.gis.geos import Polygon
+
+        manifest = getattr(self, 'manifest', None) or TileManifest.load(output_path)
+        records = []
+        for index in sorted(manifest.tiles):
+            entry = manifest.tiles[index]
+            if entry.get('status') != 'done':
+                continue
+            path = output_path / entry['filename']
+            ring, layout = raster_footprint(path)
+            records.append({
+                'index': index,
+                'path': str(path.relative_to(settings.BASE_DIR)),
+                'footprint': Polygon(ring, srid=4326),
+                'size': entry['size'],
+                'checksum': entry['checksum'],
+                **layout,
+            })
+        return records
+
+    def ingest_cube(self, tif_path, acquisition_date):
+        """把本期产品追加到NDVI时间序列立方体"""
+        cube_dir = getattr(self, 'cube_dir', None)
+        if not cube_dir:
+            return None
+        try:
+            self.log("追加到时间序列立方体...")
+            t = NDVICube(cube_dir).append(tif_path, acquisition_date)
+            self.log(f"立方体时间片 {t} 写入完成: {acquisition_date}")
+            return t
+        except Exception as e:
+            self.log(self.style.WARNING(f"时间序列立方体写入失败: {str(e)}"), logging.WARNING)
+            return None
+
+    def load_raster_db(self, ndvi_data):
+        """把本期产品切块写入SatelliteRaster（COPY批量写入，含概视图）"""
+        from geodata.raster_db import load_ndvi_raster
+
+        try:
+            self.log("写入PostGIS栅格表...")
+            result = load_ndvi_raster(ndvi_data, workers=getattr(self, 'stats_workers', 4))
+            self.log(f"栅格表写入完成: {result['rows']} 行 {result['overviews']}")
+            return result
+        except Exception as e:
+            self.log(self.style.WARNING(f"PostGIS栅格表写入失败: {str(e)}"), logging.WARNING)
+            return None
+
+    def merge_tiles(self, tile_dir, output_path, tile_files=None):
         """修正后的合并分块方法"""
         from osgeo import gdal
-        import glob
 
-        # 获取所有分块文件
-        tile_files = sorted(tile_dir.glob('*.tif'))
+        # 优先使用清单中的分块列表
+        if not tile_files:
+            tile_files = sorted(tile_dir.glob('tile_*.tif'))
         if not tile_files:
             raise ValueError("未找到分块文件")
 
+        # 虚拟镶嵌：VRT即产品，统计/缩略图/切片都经VRT按窗口读取分块
+        if self._product_driver() == 'VRT':
+            build_mosaic_vrt(tile_files, output_path)
+            return True
+
         # 准备文件列表
         file_list = [str(f) for f in tile_files]
 
@@ -446,15 +980,17 @@ class Command(BaseCommand):
             if vrt is None:
                 raise RuntimeError("无法构建VRT文件")
 
-            # 转换为实际TIFF
+            # 转换为实际TIFF（COG含内部概视图，多线程压缩）
             dataset = gdal.Translate(
                 destName=str(output_path),
                 srcDS=vrt,
                 options=gdal.TranslateOptions(
-                    format='GTiff',
-                    creationOptions=['COMPRESS=LZW', 'TILED=YES']
+                    format=self._product_driver(),
+                    creationOptions=self._product_options()
                 )
             )
+            if dataset is None:
+                raise RuntimeError("无法生成合并文件")
 
             # 清理资源
             vrt = None
@@ -467,123 +1003,77 @@ class Command(BaseCommand):
         except Exception as e:
             # 方法1失败时尝试方法2
             self.log(f"VRT方法失败，尝试直接合并: {str(e)}")
-            return self.merge_tiles_direct(tile_files, output_path)
+            if self._product_driver() != 'COG':
+                return self.merge_tiles_direct(tile_files, output_path)
 
-    def merge_tiles_direct(self, tile_files, output_path):
-        """直接合并方法（备用方案）"""
-        from osgeo import gdal
-
-        # 使用第一个分块作为模板
-        src_ds = gdal.Open(str(tile_files[0]))
-        driver = gdal.GetDriverByName('GTiff')
-
-        # 创建输出文件
-        dst_ds = driver.CreateCopy(
-            str(output_path),
-            src_ds,
-            0,
-            options=['COMPRESS=LZW', 'TILED=YES']
-        )
-
-        # 合并所有分块
-        for tile in tile_files[1:]:
-            temp_ds = gdal.Open(str(tile))
-            if temp_ds is None:
-                continue
-
-            # 计算偏移量（确保不越界）
-            src_transform = temp_ds.GetGeoTransform()
-            dst_transform = dst_ds.GetGeoTransform()
-
-            xoff = int((src_transform[0] - dst_transform[0]) / dst_transform[1])
-            yoff = int((dst_transform[3] - src_transform[3]) / abs(dst_transform[5]))
-
-            # 确保偏移量有效
-            if xoff < 0 or yoff < 0:
-                continue
+            # COG驱动不支持原地写入，先直接合并为临时GTiff再转换
+            staging = output_path.with_name(output_path.stem + '.staging.tif')
+            try:
+                self.merge_tiles_direct(tile_files, staging)
+                dataset = gdal.Translate(
+                    destName=str(output_path),
+                    srcDS=str(staging),
+                    options=gdal.TranslateOptions(
+                        format='COG',
+                        creationOptions=self._product_options()
+                    )
+                )
+                dataset = None
+            finally:
+                staging.unlink(missing_ok=True)
+            return True
 
-            # 确保读取范围不超过目标范围
-            xsize = min(temp_ds.RasterXSize, dst_ds.RasterXSize - xoff)
-            ysize = min(temp_ds.RasterYSize, dst_ds.RasterYSize - yoff)
+    def _product_driver(self):
+        return {'cog': 'COG', 'vrt': 'VRT'}.get(getattr(self, 'product_format', 'gtiff'), 'GTiff')
 
-            if xsize <= 0 or ysize <= 0:
-                continue
+    def _product_filename(self):
+        return {'COG': PRODUCT_FILENAME, 'VRT': MOSAIC_FILENAME}.get(self._product_driver(), 'merged.tif')
 
-            # 执行合并
-            data = temp_ds.GetRasterBand(1).ReadAsArray()
-            dst_ds.GetRasterBand(1).WriteArray(data, xoff, yoff)
-            temp_ds = None
+    def _product_options(self):
+        """合并产品创建参数（压缩算法、预测器、线程数）"""
+        return product_creation_options(
+            fmt=self._product_driver(),
+            compress=getattr(self, 'compress', 'ZSTD'),
+            predictor=getattr(self, 'predictor', 3),
+            num_threads=getattr(self, 'num_threads', 'ALL_CPUS'),
+        )
 
-        dst_ds.FlushCache()
-        dst_ds = None
-        src_ds = None
+    def merge_tiles_direct(self, tile_files, output_path):
+        """直接合并方法（备用方案，不依赖VRT驱动）
+
+        按输出块镶嵌：输出为全部分块的并集范围，重叠处nodata不覆盖有效值，内存只与块大小相关。
+        """
+        mosaic_tiles(
+            tile_files, output_path,
+            workers=getattr(self, 'stats_workers', 4),
+            creation_options=product_creation_options(
+                fmt='GTiff',
+                compress=getattr(self, 'compress', 'ZSTD'),
+                predictor=getattr(self, 'predictor', 3),
+                num_threads=getattr(self, 'num_threads', 'ALL_CPUS'),
+            ),
+        )
         return True
 
     def calculate_stats(self, tif_path):
-        """添加边界安全检查的计算方法"""
-        ds = gdal.Open(str(tif_path))
-        if ds is None:
-            raise ValueError(f"无法打开文件: {tif_path}")
-
-        # 获取栅格尺寸
-        width = ds.RasterXSize
-        height = ds.RasterYSize
-
-        # 限制读取范围不超过实际尺寸
-        read_width = min(3000, width)  # 示例值，根据实际情况调整
-        read_height = min(3000, height)
-
-        band = ds.GetRasterBand(1)
-
-        # 安全读取数据
+        """分块流式计算整幅栅格统计量（忽略nodata）"""
         try:
-            array = band.ReadAsArray(
-                xoff=0,
-                yoff=0,
-                win_xsize=read_width,
-                win_ysize=read_height
-            )
+            stats = compute_raster_stats(
+                tif_path, workers=getattr(self, 'stats_workers', 1)
+            ).as_dict()
         except Exception as e:
             raise RuntimeError(f"读取栅格数据失败: {str(e)}")
 
-        # 计算统计信息
-        stats = {
-            'min': float(np.nanmin(array)),
-            'max': float(np.nanmax(array)),
-            'mean': float(np.nanmean(array)),
-            'stddev': float(np.nanstd(array))
-        }
-
-        # 获取空间范围（修正负值问题）
-        transform = ds.GetGeoTransform()
-        x_min = max(transform[0], 0)  # 确保不小于0
-        y_max = max(transform[3], 0)
-        x_max = x_min + transform[1] * width
-        y_min = y_max + transform[5] * height
-
+        # 覆盖范围投影到EPSG:4326（与分块索引一致，供bbox过滤使用）
         from django.contrib.gis.geos import Polygon
-        coverage = Polygon.from_bbox((
-            max(x_min, 0),
-            max(y_min, 0),
-            max(x_max, 0),
-            max(y_max, 0)
-        ))
-
-        ds = None  # 关闭数据集
+        ring, _ = raster_footprint(tif_path)
+        coverage = Polygon(ring, srid=4326)
 
         return stats, coverage
 
     def generate_thumbnail(self, tif_path, output_path, size=(256, 256)):
-        """生成缩略图"""
-        ds = gdal.Open(str(tif_path))
-        band = ds.GetRasterBand(1)
-        array = band.ReadAsArray()
-
-        # 归一化处理
-        array = (array - array.min()) / (array.max() - array.min()) * 255
-        array = array.astype(np.uint8)
-
-        # 创建缩略图
-        im = Image.fromarray(array)
-        im.thumbnail(size)
-        im.save(output_path)
+        """抽稀读取生成缩略图，额外尺寸输出为thumbnail_<尺寸>.png"""
+        outputs = {max(size): output_path}
+        for extra in getattr(self, 'thumbnail_sizes', []):
+            outputs.setdefault(extra, output_path.with_name(f"thumbnail_{extra}.png"))
+        return generate_thumbnails(tif_path, outputs)
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = '把已入库的NDVI产品切块写入PostGIS栅格表（SatelliteRaster）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='产品名（默认最近一期）')
+        parser.add_argument('--all', action='store_true', help='处理全部产品')
+        parser.add_argument('--tile-size', type=int, default=None, help='栅格行的分块边长（像元）')
+        parser.add_argument('--overviews', type=str, default=None, help='概视图抽稀倍数，逗号分隔（空字符串为不生成）')
+        parser.add_argument('--outdb-root', type=str, default=None,
+                            help='数据库服务器上对应BASE_DIR的路径，指定时使用out-db模式')
+        parser.add_argument('--workers', type=int, default=4, help='读取分块的线程数')
+
+    def handle(self, *args, **options):
+        from geodata.models import NDVIData
+        from geodata.raster_db import load_ndvi_raster
+
+        queryset = NDVIData.objects.order_by('-acquisition_date')
+        if options['names']:
+            queryset = queryset.filter(name__in=options['names'])
+        elif not options['all']:
+            queryset = queryset[:1]
+        products = list(queryset)
+        if not products:
+            raise CommandError("没有匹配的NDVI产品")
+
+        overviews = None
+        if options['overviews'] is not None:
+            try:
+                overviews = [int(v) for v in options['overviews'].split(',') if v.strip()]
+            except ValueError:
+                raise CommandError("概视图倍数须为整数")
+
+        for ndvi_data in products:
+            try:
+                result = load_ndvi_raster(ndvi_data, tile_size=options['tile_size'], overviews=overviews,
+                                          outdb_root=options['outdb_root'], workers=options['workers'])
+            except Exception as e:
+                raise CommandError(f"{ndvi_data.name} 入库失败: {str(e)}")
+            self.stdout.write(self.style.SUCCESS(
+                f"{ndvi_data.name}: {result['rows']} 行 {result['overviews']} 用时 {result['seconds']}s"
+            ))
@@ -0,0 +1,67 @@
+# Generated by Django 4.2 on 2026-10-18 14:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('geodata', '0003_ndvitile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='产品标识，如beijing_ndvi_20240101', max_length=100)),
+                ('region', models.CharField(max_length=50)),
+                ('start_date', models.DateField(help_text='时间窗口起始日期（含）')),
+                ('end_date', models.DateField(help_text='时间窗口结束日期（不含）')),
+                ('source', models.CharField(default='gee', help_text='数据来源：gee/local', max_length=20)),
+                ('status', models.CharField(choices=[('running', '运行中'), ('success', '成功'), ('failed', '失败')], default='running', max_length=20)),
+                ('stage', models.CharField(blank=True, default='', help_text='当前阶段', max_length=50)),
+                ('tiles_total', models.PositiveIntegerField(default=0)),
+                ('tiles_done', models.PositiveIntegerField(default=0)),
+                ('tiles_failed', models.PositiveIntegerField(default=0)),
+                ('bytes_downloaded', models.BigIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('download_started_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('timings', models.JSONField(default=dict, help_text='分阶段耗时汇总')),
+                ('ndvi', models.ForeignKey(blank=True, help_text='本次运行产出的NDVI产品', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pipeline_runs', to='geodata.ndvidata')),
+            ],
+            options={
+                'verbose_name': '管道运行',
+                'verbose_name_plural': '管道运行',
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['status', '-started_at'], name='pipeline_run_status_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TileJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(help_text='分块序号（从0开始）')),
+                ('status', models.CharField(choices=[('pending', '等待'), ('downloading', '下载中'), ('done', '完成'), ('skipped', '已存在'), ('failed', '失败')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('size', models.BigIntegerField(default=0, help_text='文件大小(字节)')),
+                ('seconds', models.FloatField(blank=True, help_text='下载耗时(秒)', null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tile_jobs', to='data_pipeline.pipelinerun')),
+            ],
+            options={
+                'verbose_name': '分块作业',
+                'verbose_name_plural': '分块作业',
+                'ordering': ['run', 'index'],
+                'constraints': [models.UniqueConstraint(fields=('run', 'index'), name='tile_job_unique_index')],
+            },
+        ),
+    ]
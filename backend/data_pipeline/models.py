@@ -0,0 +1,148 @@
+from django.db import models
+from django.utils import timezone
+
+
+class PipelineRun(models.Model):
+    """一次fetch_sentinel2运行：记录状态变化、当前阶段与下载进度"""
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCESS = 'success'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, '运行中'),
+        (STATUS_SUCCESS, '成功'),
+        (STATUS_FAILED, '失败'),
+    ]
+
+    name = models.CharField(
+        max_length=100,
+        help_text="产品标识，如beijing_ndvi_20240101"
+    )
+    region = models.CharField(max_length=50)
+    start_date = models.DateField(help_text="时间窗口起始日期（含）")
+    end_date = models.DateField(help_text="时间窗口结束日期（不含）")
+    source = models.CharField(
+        max_length=20,
+        default='gee',
+        help_text="数据来源：gee/local"
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_RUNNING
+    )
+    stage = models.CharField(
+        max_length=50,
+        blank=True,
+        default='',
+        help_text="当前阶段"
+    )
+    tiles_total = models.PositiveIntegerField(default=0)
+    tiles_done = models.PositiveIntegerField(default=0)
+    tiles_failed = models.PositiveIntegerField(default=0)
+    bytes_downloaded = models.BigIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    download_started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    timings = models.JSONField(
+        default=dict,
+        help_text="分阶段耗时汇总"
+    )
+    ndvi = models.ForeignKey(
+        'geodata.NDVIData',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='pipeline_runs',
+        help_text="本次运行产出的NDVI产品"
+    )
+
+    class Meta:
+        verbose_name = "管道运行"
+        verbose_name_plural = "管道运行"
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['status', '-started_at'], name='pipeline_run_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} [{self.status}]"
+
+    @property
+    def finished(self):
+        return self.status != self.STATUS_RUNNING
+
+    def eta_seconds(self):
+        """按已完成分块的平均耗时估算剩余下载时间"""
+        remaining = self.tiles_total - self.tiles_done - self.tiles_failed
+        if self.finished or not self.download_started_at or self.tiles_done == 0 or remaining <= 0:
+            return None
+        elapsed = (timezone.now() - self.download_started_at).total_seconds()
+        return round(elapsed / self.tiles_done * remaining, 1)
+
+    def progress(self):
+        """供进度接口与SSE推送的快照"""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'region': self.region,
+            'window': [self.start_date.isoformat(), self.end_date.isoformat()],
+            'source': self.source,
+            'status': self.status,
+            'stage': self.stage,
+            'tiles_total': self.tiles_total,
+            'tiles_done': self.tiles_done,
+            'tiles_failed': self.tiles_failed,
+            'bytes_downloaded': self.bytes_downloaded,
+            'elapsed_seconds': round(((self.finished_at or timezone.now()) - self.started_at).total_seconds(), 1),
+            'eta_seconds': self.eta_seconds(),
+            'started_at': self.started_at.isoformat(),
+            'updated_at': self.updated_at.isoformat(),
+            'error': self.error,
+            'ndvi_id': self.ndvi_id,
+        }
+
+
+class TileJob(models.Model):
+    """运行中单个分块的下载作业"""
+    STATUS_PENDING = 'pending'
+    STATUS_DOWNLOADING = 'downloading'
+    STATUS_DONE = 'done'
+    STATUS_SKIPPED = 'skipped'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '等待'),
+        (STATUS_DOWNLOADING, '下载中'),
+        (STATUS_DONE, '完成'),
+        (STATUS_SKIPPED, '已存在'),
+        (STATUS_FAILED, '失败'),
+    ]
+
+    run = models.ForeignKey(
+        PipelineRun,
+        on_delete=models.CASCADE,
+        related_name='tile_jobs'
+    )
+    index = models.PositiveIntegerField(help_text="分块序号（从0开始）")
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    size = models.BigIntegerField(default=0, help_text="文件大小(字节)")
+    seconds = models.FloatField(null=True, blank=True, help_text="下载耗时(秒)")
+    error = models.TextField(blank=True, default='')
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "分块作业"
+        verbose_name_plural = "分块作业"
+        ordering = ['run', 'index']
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'index'], name='tile_job_unique_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.run_id}#{self.index} [{self.status}]"
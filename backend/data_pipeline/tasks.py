@@ -1,31 +1,48 @@
+from datetime import timedelta
+
 from celery import shared_task
+from django.conf import settings
 from django.core.cache import cache
 from django.utils import timezone
-import fasteners
-from pathlib import Path
+
+from data_pipeline.utils.lease_lock import LeaseLock, lease_name
+
+
+def run_fetch_with_lease(region, start_date, end_date):
+    """在 (区域, 时间窗口) 租约下执行fetch_sentinel2，租约被占用时返回None"""
+    from django.core.management import call_command
+
+    lock = LeaseLock(lease_name(region, start_date, end_date))
+    token = lock.acquire()
+    if token is None:
+        return None
+    try:
+        call_command('fetch_sentinel2', region=region, start_date=start_date, end_date=end_date,
+                     lease=lock.name, fencing_token=token, lease_lost=lock.lost)
+        return token
+    finally:
+        lock.release()
 
 
 @shared_task(bind=True)
 def monthly_satellite_sync(self, first_run=False):
     """卫星数据同步任务"""
 
-    # 分布式文件锁（防止多实例同时运行）
-    lock_path = Path('/tmp/satellite_sync.lock')
-    lock = fasteners.InterProcessLock(str(lock_path))
+    # 如果不是首次强制运行，则检查冷却期
+    if not first_run:
+        last_run = cache.get('last_sync_time')
+        if last_run and (timezone.now() - last_run).total_seconds() < 604700:  # 7天-100秒缓冲
+            return f"Skip: Last run at {last_run.strftime('%Y-%m-%d %H:%M')}"
 
-    if not lock.acquire(blocking=False):
-        return "Another sync is already running"
+    region = getattr(settings, 'NDVI_DEFAULT_REGION', 'beijing')
+    end_date = timezone.localdate()
+    start_date = (end_date - timedelta(days=7)).isoformat()
+    end_date = end_date.isoformat()
 
     try:
-        # 如果不是首次强制运行，则检查冷却期
-        if not first_run:
-            last_run = cache.get('last_sync_time')
-            if last_run and (timezone.now() - last_run).total_seconds() < 604700:  # 7天-100秒缓冲
-                return f"Skip: Last run at {last_run.strftime('%Y-%m-%d %H:%M')}"
-
-        # 执行核心逻辑
-        from django.core.management import call_command
-        call_command('fetch_sentinel2')
+        # 执行核心逻辑（租约只锁定本区域本窗口，其他区域/窗口的作业可同时运行）
+        if run_fetch_with_lease(region, start_date, end_date) is None:
+            return "Another sync is already running"
 
         # 记录成功执行时间（永久存储）
         cache.set('last_sync_time', timezone.now(), timeout=None)
@@ -35,5 +52,64 @@ def monthly_satellite_sync(self, first_run=False):
         # 指数退避重试（最多3次）
         countdown = min(60 * (2 ** self.request.retries), 3600)
         raise self.retry(exc=e, countdown=countdown, max_retries=3)
-    finally:
-        lock.release()
+
+
+@shared_task(bind=True, acks_late=True)
+def fetch_ndvi_window(self, region, start_date, end_date, force=False, max_retries=3):
+    """回填作业：处理单个 (区域, 时间窗口)，成功后记录为已完成"""
+    from data_pipeline.utils.backfill import is_window_done, mark_window_done
+
+    job = {'region': region, 'start_date': start_date, 'end_date': end_date}
+    if not force and is_window_done(region, start_date, end_date):
+        return {**job, 'status': 'skipped'}
+
+    try:
+        token = run_fetch_with_lease(region, start_date, end_date)
+    except Exception as e:
+        if self.request.retries < max_retries:
+            countdown = min(60 * (2 ** self.request.retries), 3600)
+            raise self.retry(exc=e, countdown=countdown, max_retries=max_retries)
+        # 重试耗尽后返回失败结果而不是抛出，避免中断同批其他作业；未标记完成，重跑时会再次处理
+        return {**job, 'status': 'failed', 'error': str(e)}
+
+    if token is None:
+        # 同一作业正由其他worker处理
+        return {**job, 'status': 'locked'}
+
+    mark_window_done(region, start_date, end_date, task_id=self.request.id, fencing_token=token)
+    return {**job, 'status': 'done'}
+
+
+@shared_task
+def backfill_batch_done(results, batch, total):
+    """一批回填作业结束后的汇总（chord回调）"""
+    counts = {}
+    for result in results or []:
+        status = (result or {}).get('status', 'unknown')
+        counts[status] = counts.get(status, 0) + 1
+    return {'batch': batch + 1, 'total': total, 'counts': counts}
+
+
+@shared_task
+def backfill_ndvi(start_date, end_date, regions=None, window_days=None, parallelism=None,
+                  force=False, queue='satellite_sync'):
+    """历史回填：按时间窗口 x 区域拆分作业，每批parallelism个作业以chord并行执行，批次之间串行"""
+    from celery import chain, chord
+    from django.conf import settings
+    from data_pipeline.utils.backfill import plan_jobs
+
+    jobs = plan_jobs(start_date, end_date, regions, window_days, force)
+    if not jobs:
+        return {'jobs': 0, 'batches': 0}
+
+    parallelism = max(1, parallelism or getattr(settings, 'NDVI_BACKFILL_PARALLELISM', 4))
+    batches = [jobs[i:i + parallelism] for i in range(0, len(jobs), parallelism)]
+    workflow = chain(*[
+        chord(
+            [fetch_ndvi_window.si(force=force, **job).set(queue=queue) for job in batch],
+            backfill_batch_done.s(index, len(batches)).set(queue=queue),
+        )
+        for index, batch in enumerate(batches)
+    ])
+    result = workflow.apply_async()
+    return {'jobs': len(jobs), 'batches': len(batches), 'workflow_id': result.id}
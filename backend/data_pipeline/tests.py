@@ -0,0 +1,817 @@
+import io
+import json
+import multiprocessing
+import shutil
+import threading
+import unittest
+import warnings
+from datetime import date, datetime
+from unittest import mock
+
+import numpy as np
+from django.contrib.gis.geos import Polygon
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from osgeo import gdal, osr
+
+from geodata.models import NDVIData, NDVITile
+
+from data_pipeline.utils.backfill import date_windows, mark_window_done, parse_date, plan_jobs, window_key
+from data_pipeline.utils.band_math import NDVI_NODATA, calculate_ndvi_blockwise
+from data_pipeline.utils.composite import MIN_BLOCK_SIZE, block_bytes, composite_kernel, composite_rasters, plan_blocks
+from data_pipeline.utils import metrics
+from data_pipeline.utils.gdal_utils import GDALWrapper, product_creation_options
+from data_pipeline.utils.lease_lock import LeaseLost
+from data_pipeline.utils.mosaic import mosaic_grid, mosaic_tiles
+from data_pipeline.utils.ndvi_cube import NODATA as CUBE_NODATA, SCALE as CUBE_SCALE, NDVICube
+from data_pipeline.utils.raster_stats import NDVI_BINS, NDVI_RANGE, RasterStats, compute_raster_stats, valid_values
+from data_pipeline.utils.synthetic import SYNTHETIC_ORIGIN, make_band_pair, make_tile_set, synthetic_ndvi
+from data_pipeline.utils.testing import TempDirMixin
+from data_pipeline.utils.tile_manifest import STATUS_DONE, STATUS_FAILED, TileManifest, file_checksum
+from data_pipeline.utils.tile_source import LocalTileSource
+from data_pipeline.utils.tile_validation import TileValidationError, read_tiff_layout, validate_tile, validate_tiles
+
+
+def read_band(path):
+    ds = gdal.Open(str(path))
+    band = ds.GetRasterBand(1)
+    return band.ReadAsArray(), band.GetNoDataValue()
+
+
+class NDVIEngineTests(TempDirMixin, SimpleTestCase):
+    """进程内NDVI引擎与gdal_calc公式 (B-A)/(B+A+1e-10) 的一致性"""
+
+    def reference_ndvi(self, red_path, nir_path):
+        red, red_nodata = read_band(red_path)
+        nir, nir_nodata = read_band(nir_path)
+        red, nir = red.astype(np.float64), nir.astype(np.float64)
+        ndvi = (nir - red) / (nir + red + 1e-10)
+        ndvi[(red == red_nodata) | (nir == nir_nodata)] = NDVI_NODATA
+        return ndvi, red, nir
+
+    def assert_ndvi_equal(self, actual, expected):
+        nodata = expected == NDVI_NODATA
+        np.testing.assert_array_equal(actual == NDVI_NODATA, nodata)
+        np.testing.assert_allclose(actual[~nodata], expected[~nodata], atol=1e-6)
+
+    def test_numpy_engine_matches_reference(self):
+        red_path, nir_path = make_band_pair(self.tmp, 300, 200, nodata=65535,
+                                            nodata_fraction=0.1, zero_fraction=0.01)
+        output = self.tmp / 'ndvi.tif'
+        # 小块+多线程，覆盖窗口边界
+        calculate_ndvi_blockwise(red_path, nir_path, output, workers=2, block_size=128)
+
+        actual, nodata = read_band(output)
+        expected, red, nir = self.reference_ndvi(red_path, nir_path)
+        self.assertEqual(nodata, NDVI_NODATA)
+        self.assertTrue((expected == NDVI_NODATA).any())
+        self.assert_ndvi_equal(actual, expected)
+
+        # 分母为0（red=nir=0且不是nodata）的像元输出0，而不是nan或nodata
+        zeros = (red == 0) & (nir == 0)
+        self.assertTrue(zeros.any())
+        np.testing.assert_array_equal(actual[zeros], 0.0)
+
+    @unittest.skipUnless(shutil.which('gdal_calc.py'), "未安装gdal_calc.py")
+    def test_numpy_engine_matches_gdal_calc(self):
+        # Float32输入，避免gdal_calc对UInt16做减法时回绕
+        red_path, nir_path = make_band_pair(self.tmp, 256, 256, nodata=-1, zero_fraction=0.01,
+                                            data_type=gdal.GDT_Float32)
+        wrapper = GDALWrapper()
+        numpy_out = self.tmp / 'numpy.tif'
+        calc_out = self.tmp / 'gdal_calc.tif'
+        wrapper.calculate_ndvi(str(red_path), str(nir_path), str(numpy_out), 6)
+        wrapper.calculate_ndvi(str(red_path), str(nir_path), str(calc_out), 6, engine='gdal_calc')
+
+        actual, _ = read_band(numpy_out)
+        expected, _ = read_band(calc_out)
+        self.assert_ndvi_equal(actual, expected)
+
+
+class TileDownloadTests(TempDirMixin, SimpleTestCase):
+    """用LocalTileSource代替Earth Engine，覆盖重试退避与清单续传"""
+
+    def setUp(self):
+        super().setUp()
+        self.source_dir = self.tmp / 'source'
+        self.output = self.tmp / 'output'
+        self.output.mkdir()
+        make_tile_set(self.source_dir, 3, tile_size=64, cols=3)
+        source_manifest = TileManifest.load(self.source_dir)
+        self.regions = [source_manifest.tiles[i]['region'] for i in range(3)]
+
+        patchers = [
+            mock.patch('data_pipeline.management.commands.fetch_sentinel2.increment'),
+            mock.patch('data_pipeline.management.commands.fetch_sentinel2.random.uniform', return_value=0.0),
+            mock.patch('data_pipeline.management.commands.fetch_sentinel2.time.sleep'),
+        ]
+        _, _, self.sleep = [p.start() for p in patchers]
+        for p in patchers:
+            self.addCleanup(p.stop)
+
+    def make_command(self, source):
+        from data_pipeline.management.commands.fetch_sentinel2 import Command
+
+        command = Command(stdout=io.StringIO())
+        command.max_retries = 2
+        command.retry_backoff = 0.5
+        command.workers = 2
+        command.validation_workers = 1
+        command.build_tile_source = lambda image: source
+        command.session = mock.Mock(get_info=lambda key, obj: {
+            'features': [{'geometry': region} for region in self.regions]
+        })
+        return command
+
+    def test_retry_with_exponential_backoff(self):
+        source = LocalTileSource(self.source_dir, fail_times=2)
+        command = self.make_command(source)
+        manifest = TileManifest.load(self.output)
+
+        path = command.download_tile_with_retry(source, manifest, 0, self.regions[0], 3)
+
+        self.assertEqual(source._attempts[0], 3)
+        self.assertEqual([c.args[0] for c in self.sleep.call_args_list], [0.5, 1.0])
+        self.assertFalse(path.with_name(path.name + '.part').exists())
+        entry = TileManifest.load(self.output).tiles[0]
+        self.assertEqual(entry['status'], STATUS_DONE)
+        self.assertEqual(entry['checksum'], file_checksum(self.source_dir / 'tile_1.tif'))
+
+    def test_gives_up_after_max_retries(self):
+        source = LocalTileSource(self.source_dir, fail_times=3)
+        command = self.make_command(source)
+        manifest = TileManifest.load(self.output)
+
+        with self.assertRaises(ConnectionError):
+            command.download_tile_with_retry(source, manifest, 1, self.regions[1], 3)
+
+        self.assertEqual(source._attempts[1], 3)
+        self.assertEqual(TileManifest.load(self.output).tiles[1]['status'], STATUS_FAILED)
+        self.assertFalse(manifest.tile_path(1).exists())
+
+    def test_resume_skips_valid_tiles_and_redownloads_corrupt_ones(self):
+        # 上次运行已完成分块1和2，其中分块2随后被截断
+        manifest = TileManifest.load(self.output)
+        for index in (0, 1):
+            shutil.copyfile(self.source_dir / f'tile_{index + 1}.tif', manifest.tile_path(index))
+            manifest.mark_done(index, self.regions[index], manifest.tile_path(index))
+        manifest.save()
+        with open(manifest.tile_path(1), 'r+b') as f:
+            f.truncate(256)
+
+        source = LocalTileSource(self.source_dir)
+        command = self.make_command(source)
+        self.assertTrue(command.download_and_validate_tiles(image=None, output_path=self.output, fishnet=None))
+
+        self.assertNotIn(0, source._attempts)
+        self.assertEqual(source._attempts, {1: 1, 2: 1})
+        self.assertEqual([p.name for p in command.tile_files], ['tile_1.tif', 'tile_2.tif', 'tile_3.tif'])
+        for index in range(3):
+            self.assertEqual(file_checksum(command.tile_files[index]),
+                             file_checksum(self.source_dir / f'tile_{index + 1}.tif'))
+
+
+class RasterStatsTests(TempDirMixin, SimpleTestCase):
+    """流式统计（Welford/Chan合并、直方图百分位、nodata剔除）与numpy直接计算的一致性"""
+
+    percentiles = (2, 25, 50, 75, 98)
+
+    def assert_matches_numpy(self, stats, values):
+        width = (NDVI_RANGE[1] - NDVI_RANGE[0]) / NDVI_BINS
+        values = values.astype(np.float64)
+        self.assertEqual(stats.count, values.size)
+        self.assertEqual(stats.min, values.min())
+        self.assertEqual(stats.max, values.max())
+        self.assertAlmostEqual(stats.sum, values.sum(), delta=1e-6 * values.size)
+        self.assertAlmostEqual(stats.mean, values.mean(), places=9)
+        self.assertAlmostEqual(stats.stddev, values.std(), places=9)
+        # 直方图近似：误差不超过两个分箱宽度
+        for q in self.percentiles:
+            self.assertAlmostEqual(stats.percentile(q), np.percentile(values, q), delta=2 * width)
+
+    def test_merge_of_partials_matches_single_pass(self):
+        rng = np.random.default_rng(0)
+        values = np.clip(rng.normal(0.3, 0.2, 10000), -1, 1)
+        total = RasterStats()
+        # 大小悬殊的分块，覆盖Chan公式中count差异很大的情况
+        for chunk in np.split(values, [1, 7, 500, 4000]):
+            partial = RasterStats()
+            partial.update(chunk)
+            total.merge(partial)
+        self.assert_matches_numpy(total, values)
+
+        single = RasterStats()
+        single.update(values)
+        self.assertEqual(total.count, single.count)
+        np.testing.assert_array_equal(total.histogram, single.histogram)
+        self.assertAlmostEqual(total.m2, single.m2, places=6)
+
+    def test_merge_rejects_mismatched_bins(self):
+        other = RasterStats(bins=100)
+        other.update(np.array([0.5]))
+        with self.assertRaises(ValueError):
+            RasterStats().merge(other)
+
+    def test_values_outside_histogram_range(self):
+        stats = RasterStats()
+        stats.update(np.array([-3.0, -2.0, 0.0, 0.5, 4.0]))
+        self.assertEqual((stats.below, stats.above), (2, 1))
+        self.assertEqual(stats.percentile(0), -3.0)
+        self.assertEqual(stats.percentile(100), 4.0)
+
+    def test_valid_values_drops_nodata_and_non_finite(self):
+        array = np.array([[0.1, NDVI_NODATA, np.nan], [np.inf, -0.2, 0.3]], dtype=np.float32)
+        np.testing.assert_array_equal(valid_values(array, NDVI_NODATA), np.float32([0.1, -0.2, 0.3]))
+        self.assertEqual(valid_values(array, float('nan')).size, 4)
+        self.assertEqual(valid_values(np.array([0, 5, 0, 7], dtype=np.uint16), 0).tolist(), [5, 7])
+        self.assertEqual(RasterStats().as_dict()['count'], 0)
+
+    def test_compute_raster_stats_matches_numpy(self):
+        # 64x64内部分块 + 小窗口，使整幅栅格被切成多个窗口
+        tile, = make_tile_set(self.tmp, 1, tile_size=300, nodata_fraction=0.1, creation_options=[
+            'TILED=YES', 'BLOCKXSIZE=64', 'BLOCKYSIZE=64', 'COMPRESS=DEFLATE',
+        ])
+        array, nodata = read_band(tile)
+        expected = array[array != nodata]
+        self.assertLess(expected.size, array.size)
+
+        serial = compute_raster_stats(tile, workers=1, target=64)
+        parallel = compute_raster_stats(tile, workers=2, target=64)
+        self.assert_matches_numpy(serial, expected)
+        self.assert_matches_numpy(parallel, expected)
+        np.testing.assert_array_equal(serial.histogram, parallel.histogram)
+
+
+class CompositeTests(TempDirMixin, SimpleTestCase):
+    """逐像元时间合成与numpy nan*函数的一致性（nodata不参与计算）"""
+
+    def reference(self, stack):
+        stack = np.where(stack == NDVI_NODATA, np.nan, stack)
+        count = np.isfinite(stack).sum(axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            expected = {
+                'median': np.nanmedian(stack, axis=0),
+                'mean': np.nanmean(stack, axis=0),
+                'max': np.nanmax(stack, axis=0),
+            }
+        for values in expected.values():
+            values[count == 0] = NDVI_NODATA
+        expected['count'] = count.astype(np.float32)
+        return expected
+
+    def assert_composite_equal(self, actual, expected):
+        for name, values in expected.items():
+            with self.subTest(statistic=name):
+                np.testing.assert_allclose(actual[name], values, atol=1e-6)
+
+    def test_kernel_odd_even_and_empty_pixels(self):
+        # 每列一个像元：4期有效、3期有效、1期有效、全部nodata
+        stack = np.array([
+            [0.1, 0.5, NDVI_NODATA, NDVI_NODATA],
+            [0.4, NDVI_NODATA, NDVI_NODATA, NDVI_NODATA],
+            [0.2, 0.3, 0.7, NDVI_NODATA],
+            [0.3, 0.9, np.nan, NDVI_NODATA],
+        ], dtype=np.float32)[:, np.newaxis, :]
+        expected = self.reference(stack.copy())
+        results = composite_kernel(('median', 'mean', 'max', 'count'))(stack, [NDVI_NODATA] * 4)
+        actual = dict(zip(('median', 'mean', 'max', 'count'), (r[0] for r in results)))
+
+        np.testing.assert_allclose(actual['median'], [0.25, 0.5, 0.7, NDVI_NODATA], atol=1e-6)
+        self.assertEqual(actual['count'].tolist(), [4, 3, 1, 0])
+        self.assert_composite_equal(actual, {k: v[0] for k, v in expected.items()})
+
+        with self.assertRaises(ValueError):
+            composite_kernel(('mode',))(stack, [NDVI_NODATA] * 4)
+
+    def test_composite_rasters_matches_numpy(self):
+        inputs = [make_tile_set(self.tmp / f'period_{seed}', 1, tile_size=150, seed=seed,
+                                nodata_fraction=0.3)[0] for seed in range(3)]
+        outputs = {name: self.tmp / f'{name}.tif' for name in ('median', 'mean', 'max', 'count')}
+        # 内存预算只够两个64像元的块，覆盖块大小回退与多线程
+        composite_rasters(inputs, outputs, workers=2, memory_budget=1 << 20, block_size=128)
+
+        stack = np.stack([read_band(path)[0] for path in inputs])
+        expected = self.reference(stack)
+        actual = {name: read_band(path)[0] for name, path in outputs.items()}
+        self.assertEqual(read_band(outputs['median'])[1], NDVI_NODATA)
+        self.assertTrue((expected['count'] < 3).any())
+        self.assert_composite_equal(actual, expected)
+
+    def test_composite_rasters_rejects_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            composite_rasters([], {'median': self.tmp / 'median.tif'})
+        with self.assertRaises(ValueError):
+            composite_rasters([self.tmp / 'a.tif'], {'mode': self.tmp / 'mode.tif'})
+
+    def test_plan_blocks_fits_memory_budget(self):
+        block_size, workers = plan_blocks(3, 4, memory_budget=1 << 20, workers=2, block_size=128)
+        self.assertEqual((block_size, workers), (64, 2))
+        self.assertLessEqual(workers * block_bytes(3, 4, block_size), 1 << 20)
+
+        # 最小块仍超出预算时减少线程，但至少保留一个
+        block_size, workers = plan_blocks(100, 1, memory_budget=1, workers=8)
+        self.assertEqual((block_size, workers), (MIN_BLOCK_SIZE, 1))
+
+
+def _validate_in_child(items, conn):
+    try:
+        conn.send(('ok', validate_tiles(items, workers=2)))
+    except Exception as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+class TileValidationTests(TempDirMixin, SimpleTestCase):
+    """IFD解析得到的块布局与GDAL一致，截断/非TIFF/内容异常的分块被拒绝"""
+
+    def make_tile(self, name, *options, values=None):
+        path = self.tmp / name
+        ds = gdal.GetDriverByName('GTiff').Create(str(path), 150, 100, 1, gdal.GDT_Float32,
+                                                  options=list(options))
+        band = ds.GetRasterBand(1)
+        band.SetNoDataValue(NDVI_NODATA)
+        if values is not None:
+            band.WriteArray(values)
+        ds = None
+        return path
+
+    def assert_layout_matches_gdal(self, path, bigtiff=False):
+        layout = read_tiff_layout(path)
+        ds = gdal.Open(str(path))
+        block_x, block_y = ds.GetRasterBand(1).GetBlockSize()
+        self.assertEqual((layout['width'], layout['height']), (ds.RasterXSize, ds.RasterYSize))
+        self.assertEqual((layout['block_x'], layout['block_y']), (block_x, block_y))
+        self.assertEqual(layout['blocks'], -(-ds.RasterXSize // block_x) * -(-ds.RasterYSize // block_y))
+        self.assertEqual(layout['bigtiff'], bigtiff)
+        self.assertEqual(layout['size'], path.stat().st_size)
+        return layout
+
+    def test_layouts(self):
+        values = synthetic_ndvi(150, 100)
+        tiled = self.make_tile('tiled.tif', 'TILED=YES', 'BLOCKXSIZE=64', 'BLOCKYSIZE=32',
+                               'COMPRESS=DEFLATE', values=values)
+        self.assertEqual(self.assert_layout_matches_gdal(tiled)['blocks'], 12)
+        striped = self.make_tile('striped.tif', 'COMPRESS=DEFLATE', 'BLOCKYSIZE=16', values=values)
+        self.assertEqual(self.assert_layout_matches_gdal(striped)['blocks'], 7)
+        big = self.make_tile('big.tif', 'BIGTIFF=YES', 'ENDIANNESS=BIG', 'TILED=YES', values=values)
+        self.assert_layout_matches_gdal(big, bigtiff=True)
+        # 未写出的稀疏块偏移与长度都为0，不算截断
+        sparse = self.make_tile('sparse.tif', 'TILED=YES', 'SPARSE_OK=TRUE')
+        self.assert_layout_matches_gdal(sparse)
+
+    def test_rejects_truncated_and_non_tiff_files(self):
+        path = self.make_tile('tile.tif', 'TILED=YES', 'BLOCKXSIZE=64', 'BLOCKYSIZE=64',
+                              values=synthetic_ndvi(150, 100))
+        data = path.read_bytes()
+        cases = {
+            'truncated.tif': data[:len(data) - 100],
+            'header_only.tif': data[:6],
+            'not_tiff.tif': b'PK\x03\x04' + data[4:],
+            'bad_version.tif': data[:2] + b'\x00\x00' + data[4:],
+        }
+        for name, content in cases.items():
+            with self.subTest(name=name):
+                bad = self.tmp / name
+                bad.write_bytes(content)
+                with self.assertRaises(TileValidationError):
+                    read_tiff_layout(bad)
+
+    def test_validate_tile(self):
+        tile, = make_tile_set(self.tmp / 'tiles', 1, tile_size=128)
+        entry = TileManifest.load(self.tmp / 'tiles').tiles[0]
+        result = validate_tile(tile, entry)
+        self.assertTrue(result['ok'], result['error'])
+        self.assertGreater(result['sampled'], 0)
+        self.assertEqual(list(self.tmp.glob('tiles/*.aux.xml')), [])
+
+        result = validate_tile(tile, dict(entry, checksum='0' * 64))
+        self.assertFalse(result['ok'])
+        self.assertIn('校验和', result['error'])
+
+        with open(tile, 'r+b') as f:
+            f.truncate(entry['size'] // 2)
+        result = validate_tile(tile)
+        self.assertFalse(result['ok'])
+        self.assertIsNotNone(result['error'])
+
+    def test_validate_tiles_inside_daemon_process(self):
+        # Celery prefork worker是守护进程，不能再创建进程池
+        tiles = make_tile_set(self.tmp / 'tiles', 3, tile_size=64)
+        manifest = TileManifest.load(self.tmp / 'tiles')
+        items = [(path, manifest.tiles[i]) for i, path in enumerate(tiles)]
+
+        context = multiprocessing.get_context('fork')
+        parent, child = context.Pipe(duplex=False)
+        process = context.Process(target=_validate_in_child, args=(items, child), daemon=True)
+        process.start()
+        child.close()
+        status, results = parent.recv()
+        process.join()
+
+        self.assertEqual(status, 'ok', results)
+        self.assertEqual([r['path'] for r in results], [str(p) for p in tiles])
+        self.assertTrue(all(r['ok'] for r in results))
+
+    def test_validate_tile_rejects_out_of_range_values(self):
+        values = synthetic_ndvi(150, 100)
+        values[:5, :5] = 5.0
+        path = self.make_tile('range.tif', values=values)
+        result = validate_tile(path, samples=1)
+        self.assertFalse(result['ok'])
+        self.assertIn('超出范围', result['error'])
+        self.assertTrue(validate_tile(path, value_range=None)['ok'])
+
+
+@override_settings(NDVI_REGIONS={'beijing': {}, 'tianjin': {}}, NDVI_BACKFILL_WINDOW_DAYS=7)
+class BackfillPlanTests(SimpleTestCase):
+    """回填日期窗口切分与已完成窗口跳过"""
+
+    def setUp(self):
+        super().setUp()
+        self.cache = LocMemCache('backfill-tests', {})
+        self.cache.clear()
+        patcher = mock.patch('data_pipeline.utils.backfill._persistent', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parse_date(self):
+        self.assertEqual(parse_date('2024-02-29'), date(2024, 2, 29))
+        self.assertEqual(parse_date(datetime(2024, 3, 1, 12, 30)), date(2024, 3, 1))
+        self.assertEqual(parse_date(date(2024, 3, 1)), date(2024, 3, 1))
+        for value in ('2023-02-29', '2024/03/01', ''):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parse_date(value)
+
+    def test_date_windows(self):
+        windows = date_windows('2024-01-01', '2024-01-20')
+        self.assertEqual([(s.isoformat(), e.isoformat()) for s, e in windows], [
+            ('2024-01-01', '2024-01-08'),
+            ('2024-01-08', '2024-01-15'),
+            ('2024-01-15', '2024-01-20'),
+        ])
+        # 跨月/闰年，窗口首尾相接且覆盖整个区间
+        windows = date_windows(date(2024, 2, 20), date(2024, 3, 5), days=5)
+        self.assertEqual(windows[0][0], date(2024, 2, 20))
+        self.assertEqual(windows[-1], (date(2024, 3, 1), date(2024, 3, 5)))
+        self.assertTrue(all(a[1] == b[0] for a, b in zip(windows, windows[1:])))
+        self.assertEqual(date_windows('2024-01-01', '2024-01-01'), [])
+        self.assertEqual(date_windows('2024-01-10', '2024-01-01'), [])
+
+    def test_window_key(self):
+        self.assertEqual(window_key('beijing', '2024-01-01', date(2024, 1, 8)),
+                         'ndvi_backfill_done:beijing:2024-01-01:2024-01-08')
+
+    def test_plan_jobs_skips_done_windows(self):
+        self.assertEqual(len(plan_jobs('2024-01-01', '2024-01-20')), 6)
+        mark_window_done('beijing', '2024-01-08', '2024-01-15', ndvi_id=1)
+
+        jobs = plan_jobs('2024-01-01', '2024-01-20', regions=['beijing'])
+        self.assertEqual([(j['start_date'], j['end_date']) for j in jobs],
+                         [('2024-01-01', '2024-01-08'), ('2024-01-15', '2024-01-20')])
+        self.assertEqual(len(plan_jobs('2024-01-01', '2024-01-20', regions=['beijing'], force=True)), 3)
+        with self.assertRaises(ValueError):
+            plan_jobs('2024-01-01', '2024-01-20', regions=['shanghai'])
+
+    def test_plan_jobs_without_cache_plans_everything(self):
+        with mock.patch.object(self.cache, 'get', side_effect=ConnectionError('redis down')):
+            self.assertEqual(len(plan_jobs('2024-01-01', '2024-01-20', regions=['tianjin'])), 3)
+
+
+class MetricsBufferTests(SimpleTestCase):
+    """指标在进程内累加，flush时一次批量写入，Redis异常不外抛"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(metrics, '_client')
+        self.client = patcher.start()
+        self.addCleanup(patcher.stop)
+        # 丢弃其他测试残留的观测
+        metrics.flush()
+        self.client.reset_mock()
+        self.pipe = self.client.return_value.pipeline.return_value
+
+    def test_observations_are_buffered_until_flush(self):
+        metrics.observe('ndvi_pipeline_stage_seconds', 0.3, stage='validate')
+        metrics.observe('ndvi_pipeline_stage_seconds', 0.7, stage='validate')
+        metrics.increment('ndvi_pipeline_tiles_total', status='done')
+        metrics.increment('ndvi_pipeline_tiles_total', status='done')
+        self.client.assert_not_called()
+
+        metrics.flush()
+        self.pipe.execute.assert_called_once()
+        key = 'ndvi_metrics:ndvi_pipeline_stage_seconds'
+        calls = {(c.args[0], c.args[1]): c.args[2]
+                 for c in self.pipe.hincrby.call_args_list + self.pipe.hincrbyfloat.call_args_list}
+        self.assertNotIn((key, 'stage="validate"|0.25'), calls)
+        self.assertEqual(calls[(key, 'stage="validate"|0.5')], 1)
+        self.assertEqual(calls[(key, 'stage="validate"|1')], 2)
+        self.assertEqual(calls[(key, 'stage="validate"|count')], 2)
+        self.assertAlmostEqual(calls[(key, 'stage="validate"|sum')], 1.0)
+        self.assertEqual(calls[('ndvi_metrics:ndvi_pipeline_tiles_total', 'status="done"|value')], 2.0)
+
+        # 已写出的观测不会重复写入
+        metrics.flush()
+        self.pipe.execute.assert_called_once()
+
+    def test_flush_swallows_redis_errors(self):
+        self.pipe.execute.side_effect = ConnectionError('redis timeout')
+        metrics.increment('ndvi_pipeline_runs_total', status='success')
+        metrics.flush()
+        with self.assertRaises(ValueError):
+            metrics.observe('ndvi_pipeline_tiles_total', 1)
+
+
+class LeaseStageTests(SimpleTestCase):
+    """租约丢失后在阶段边界停止，写入前做栅栏校验"""
+
+    def make_command(self):
+        from data_pipeline.management.commands.fetch_sentinel2 import Command
+
+        command = Command(stdout=io.StringIO())
+        command.lease = 'ndvi_lease:beijing:2024-01-01:2024-01-08'
+        command.fencing_token = 3
+        command.lease_lost = threading.Event()
+        return command
+
+    def test_stage_stops_after_lease_lost(self):
+        command = self.make_command()
+        with command.stage('merge'):
+            pass
+        command.lease_lost.set()
+        with self.assertRaises(LeaseLost):
+            with command.stage('stats'):
+                self.fail("租约丢失后不应进入下一阶段")
+
+    @mock.patch('data_pipeline.management.commands.fetch_sentinel2.check_fencing_token')
+    def test_check_lease(self, check):
+        command = self.make_command()
+        command.check_lease()
+        check.assert_called_once_with(command.lease, 3)
+
+        command.lease_lost.set()
+        with self.assertRaises(LeaseLost):
+            command.check_lease()
+        check.assert_called_once()
+
+
+class CreationOptionsTests(TempDirMixin, SimpleTestCase):
+    """压缩级别参数名与驱动一致，GDAL不应报告不支持的创建参数"""
+
+    def create_with(self, driver_name, options):
+        messages = []
+        gdal.PushErrorHandler(lambda cls, num, msg: messages.append(msg))
+        self.addCleanup(gdal.PopErrorHandler)
+        source = gdal.GetDriverByName('MEM').Create('', 64, 64, 1, gdal.GDT_Float32)
+        source.GetRasterBand(1).WriteArray(synthetic_ndvi(64, 64))
+        output = self.tmp / f'{driver_name.lower()}.tif'
+        ds = gdal.GetDriverByName(driver_name).CreateCopy(str(output), source, options=options)
+        self.assertIsNotNone(ds)
+        ds = None
+        return messages
+
+    def test_gtiff_level_option_names(self):
+        self.assertIn('ZLEVEL=6', product_creation_options('GTiff', 'DEFLATE', level=6))
+        self.assertIn('ZSTD_LEVEL=9', product_creation_options('GTiff', 'ZSTD', level=9))
+        self.assertFalse([o for o in product_creation_options('GTiff', 'LZW', level=6) if 'LEVEL' in o])
+        supported = gdal.GetDriverByName('GTiff').GetMetadataItem('DMD_CREATIONOPTIONLIST')
+        for compress in ('DEFLATE', 'ZSTD'):
+            with self.subTest(compress=compress):
+                if compress not in supported:
+                    self.skipTest(f"GDAL未编译{compress}支持")
+                options = product_creation_options('GTiff', compress, level=5, blocksize=64)
+                self.assertEqual(self.create_with('GTiff', options), [])
+
+    def test_cog_level_option(self):
+        options = product_creation_options('COG', 'DEFLATE', level=6, blocksize=64)
+        self.assertIn('LEVEL=6', options)
+        self.assertEqual(self.create_with('COG', options), [])
+
+
+class NDVICubeTests(TempDirMixin, SimpleTestCase):
+    """立方体的块布局、扩容拷贝与点/多边形时间序列"""
+
+    width, height, resolution = 70, 50, 10
+
+    def write_ndvi(self, name, seed):
+        values = synthetic_ndvi(self.width, self.height, seed=seed, nodata_fraction=0.2)
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4526)
+        path = self.tmp / name
+        ds = gdal.GetDriverByName('GTiff').Create(str(path), self.width, self.height, 1, gdal.GDT_Float32)
+        ds.SetGeoTransform((SYNTHETIC_ORIGIN[0], self.resolution, 0.0, SYNTHETIC_ORIGIN[1], 0.0, -self.resolution))
+        ds.SetProjection(srs.ExportToWkt())
+        ds.GetRasterBand(1).SetNoDataValue(NDVI_NODATA)
+        ds.GetRasterBand(1).WriteArray(values)
+        ds = None
+        return path, values
+
+    def scaled(self, values):
+        return np.where(values == NDVI_NODATA, CUBE_NODATA, np.rint(values * CUBE_SCALE)).astype(np.int16)
+
+    def to_lonlat(self, x, y):
+        src = osr.SpatialReference()
+        src.ImportFromEPSG(4526)
+        src.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        dst = osr.SpatialReference()
+        dst.ImportFromEPSG(4326)
+        dst.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        lon, lat, _ = osr.CoordinateTransformation(src, dst).TransformPoint(x, y)
+        return lon, lat
+
+    def build_cube(self):
+        # 日期乱序写入，容量2在第三期时翻倍
+        self.periods = {}
+        cube = NDVICube(self.tmp / 'cube')
+        for seed, day in enumerate(('2024-01-15', '2024-01-01', '2024-01-08')):
+            path, values = self.write_ndvi(f'{day}.tif', seed)
+            self.periods[day] = values
+            self.assertEqual(cube.append(path, date.fromisoformat(day), chunk=32, capacity=2), seed)
+        return cube
+
+    def test_layout_and_grow(self):
+        cube = self.build_cube()
+        self.assertEqual(cube.meta['capacity'], 4)
+        self.assertEqual(cube.dates, ['2024-01-15', '2024-01-01', '2024-01-08'])
+
+        data = cube._memmap('r')
+        self.assertEqual(data.shape, (2, 3, 4, 32, 32))
+        for t, day in enumerate(cube.dates):
+            expected = self.scaled(self.periods[day])
+            # 按块还原整幅时间片，块外填充为nodata
+            full = data[:, :, t].transpose(0, 2, 1, 3).reshape(64, 96)
+            np.testing.assert_array_equal(full[:self.height, :self.width], expected)
+            self.assertTrue((full[self.height:] == CUBE_NODATA).all())
+            self.assertTrue((full[:, self.width:] == CUBE_NODATA).all())
+        self.assertFalse((self.tmp / 'cube' / 'cube.tmp').exists())
+
+        # 同一日期重复写入覆盖原时间片
+        path, values = self.write_ndvi('again.tif', 9)
+        self.assertEqual(cube.append(path, '2024-01-01'), 1)
+        self.assertEqual(len(cube.dates), 3)
+        self.assertEqual(cube._memmap('r')[0, 0, 1, 0, 0], self.scaled(values)[0, 0])
+
+    def test_point_series(self):
+        cube = self.build_cube()
+        row, col = 40, 45
+        lon, lat = self.to_lonlat(SYNTHETIC_ORIGIN[0] + (col + 0.5) * self.resolution,
+                                  SYNTHETIC_ORIGIN[1] - (row + 0.5) * self.resolution)
+        series = cube.point_series(lon, lat)
+        self.assertEqual([p['date'] for p in series], ['2024-01-01', '2024-01-08', '2024-01-15'])
+        for point in series:
+            raw = self.scaled(self.periods[point['date']])[row, col]
+            self.assertEqual(point['value'], None if raw == CUBE_NODATA else float(raw) / CUBE_SCALE)
+
+        filtered = cube.point_series(lon, lat, start=date(2024, 1, 2), end='2024-01-08')
+        self.assertEqual([p['date'] for p in filtered], ['2024-01-08'])
+        with self.assertRaises(ValueError):
+            cube.point_series(lon, lat, start='2024-1-5')
+        self.assertEqual(cube.point_series(*self.to_lonlat(SYNTHETIC_ORIGIN[0] - 100, SYNTHETIC_ORIGIN[1])), [])
+
+    def test_polygon_series_covering_raster(self):
+        cube = self.build_cube()
+        margin = 5 * self.resolution
+        minx, maxy = SYNTHETIC_ORIGIN[0] - margin, SYNTHETIC_ORIGIN[1] + margin
+        maxx = SYNTHETIC_ORIGIN[0] + self.width * self.resolution + margin
+        miny = SYNTHETIC_ORIGIN[1] - self.height * self.resolution - margin
+        ring = [self.to_lonlat(x, y) for x, y in ((minx, miny), (maxx, miny), (maxx, maxy), (minx, maxy))]
+        geojson = json.dumps({'type': 'Polygon', 'coordinates': [ring + ring[:1]]})
+
+        for point in cube.polygon_mean_series(geojson):
+            scaled = self.scaled(self.periods[point['date']])
+            expected = scaled[scaled != CUBE_NODATA].astype(np.int64).mean() / CUBE_SCALE
+            self.assertAlmostEqual(point['value'], expected, places=9)
+
+
+class MosaicTests(TempDirMixin, SimpleTestCase):
+    """分块镶嵌与gdal.Warp结果一致：并集范围、重叠区nodata不覆盖有效值、空白区为稀疏块"""
+
+    def test_matches_gdal_warp(self):
+        # 3列2行缺右下角一块，相邻分块重叠10像元
+        tiles = make_tile_set(self.tmp / 'tiles', 5, tile_size=100, cols=3, overlap=10, nodata_fraction=0.2)
+        # 第一列与第二列的重叠区：前一块有效、后一块为nodata
+        for path, value, xoff in ((tiles[0], 0.5, 90), (tiles[1], NDVI_NODATA, 0)):
+            ds = gdal.Open(str(path), gdal.GA_Update)
+            ds.GetRasterBand(1).WriteArray(np.full((10, 10), value, dtype=np.float32), xoff, 10)
+            ds = None
+        output = self.tmp / 'mosaic.tif'
+        mosaic_tiles(tiles, output, workers=2, block_size=64)
+
+        ds = gdal.Open(str(output))
+        self.assertEqual((ds.RasterXSize, ds.RasterYSize), (280, 190))
+        self.assertEqual(ds.GetGeoTransform(), (SYNTHETIC_ORIGIN[0], 10.0, 0.0, SYNTHETIC_ORIGIN[1], 0.0, -10.0))
+        band = ds.GetRasterBand(1)
+        self.assertEqual(band.GetNoDataValue(), NDVI_NODATA)
+        actual = band.ReadAsArray()
+
+        minx, res, _, maxy, _, _ = ds.GetGeoTransform()
+        expected = gdal.Warp('', [str(t) for t in tiles], options=gdal.WarpOptions(
+            format='MEM', outputBounds=(minx, maxy - 190 * res, minx + 280 * res, maxy),
+            xRes=res, yRes=res, srcNodata=NDVI_NODATA, dstNodata=NDVI_NODATA, resampleAlg='near',
+        )).GetRasterBand(1).ReadAsArray()
+        np.testing.assert_array_equal(actual, expected)
+
+        # 重叠区中后一块为nodata、前一块有效的像元保留前一块的值
+        first, second = read_band(tiles[0])[0], read_band(tiles[1])[0]
+        # （只看前90行，再往下与第二行分块重叠）
+        keep = (second[:90, :10] == NDVI_NODATA) & (first[:90, 90:] != NDVI_NODATA)
+        self.assertTrue(keep[10:20].all())
+        np.testing.assert_array_equal(actual[:90, 90:100][keep], first[:90, 90:][keep])
+
+        # 缺失分块处的输出块不写出
+        self.assertIsNone(band.GetMetadataItem('BLOCK_OFFSET_3_2', 'TIFF'))
+        self.assertIsNotNone(band.GetMetadataItem('BLOCK_OFFSET_0_0', 'TIFF'))
+        self.assertTrue((actual[128:, 192:] == NDVI_NODATA).all())
+        ds = None
+
+    def test_rejects_mismatched_resolution(self):
+        first = make_tile_set(self.tmp / 'a', 1, tile_size=32)
+        second = make_tile_set(self.tmp / 'b', 1, tile_size=32, resolution=20)
+        with self.assertRaises(ValueError):
+            mosaic_grid(first + second)
+        with self.assertRaises(ValueError):
+            mosaic_grid([])
+
+
+class ProductUpsertTests(TempDirMixin, TransactionTestCase):
+    """NDVIData按name upsert：插入、更新、过期令牌拒绝写入、提交后清理旧缩略图"""
+
+    def setUp(self):
+        super().setUp()
+        self.storage = FileSystemStorage(location=str(self.tmp / 'media'))
+        patchers = [
+            mock.patch.object(NDVIData._meta.get_field('thumbnail'), 'storage', self.storage),
+            mock.patch('geodata.cache.bump_list_cache_version'),
+        ]
+        _, self.bump = [p.start() for p in patchers]
+        for p in patchers:
+            self.addCleanup(p.stop)
+
+    def make_command(self, token=None):
+        from data_pipeline.management.commands.fetch_sentinel2 import Command
+
+        command = Command(stdout=io.StringIO())
+        command.region = 'beijing'
+        command.default_region = True
+        command.end_date = date(2024, 1, 8)
+        command.lease = 'ndvi_lease:beijing:2024-01-01:2024-01-08' if token else None
+        command.fencing_token = token
+        return command
+
+    def upsert(self, command, mean, n_tiles):
+        thumbnail = self.tmp / 'thumbnail.png'
+        thumbnail.write_bytes(b'png' + bytes([n_tiles]))
+        coverage = Polygon(((116.0, 39.0), (117.0, 39.0), (117.0, 40.0), (116.0, 40.0), (116.0, 39.0)), srid=4326)
+        metadata = {'lease': {'key': command.lease, 'token': command.fencing_token}} if command.lease else {}
+        records = [{
+            'index': i, 'path': f'tiles/tile_{i + 1}.tif', 'footprint': coverage, 'size': 100,
+            'checksum': '0' * 64, 'width': 64, 'height': 64, 'block_x': 64, 'block_y': 64,
+        } for i in range(n_tiles)]
+        return command.upsert_product(NDVIData(
+            name=command.product_name(), acquisition_date=command.end_date, resolution=10.0,
+            data_dir='ndvi/20240108', min_value=-0.2, max_value=0.9, mean_value=mean,
+            coverage=coverage, metadata=metadata,
+        ), records, thumbnail)
+
+    def test_insert_then_update(self):
+        first = self.upsert(self.make_command(), 0.3, 2)
+        row = NDVIData.objects.get(name='beijing_ndvi_20240108')
+        self.assertEqual(first.pk, row.pk)
+        self.assertEqual(NDVITile.objects.filter(ndvi=row).count(), 2)
+        self.assertTrue(self.storage.exists(row.thumbnail.name))
+        self.assertEqual(self.bump.call_count, 1)
+
+        second = self.upsert(self.make_command(), 0.4, 1)
+        self.assertEqual(second.pk, row.pk)
+        self.assertEqual(NDVIData.objects.count(), 1)
+        updated = NDVIData.objects.get(pk=row.pk)
+        self.assertAlmostEqual(updated.mean_value, 0.4)
+        self.assertEqual(list(NDVITile.objects.filter(ndvi=updated).values_list('index', flat=True)), [0])
+        # 提交后删除旧缩略图，只保留新的
+        self.assertNotEqual(updated.thumbnail.name, row.thumbnail.name)
+        self.assertFalse(self.storage.exists(row.thumbnail.name))
+        self.assertTrue(self.storage.exists(updated.thumbnail.name))
+        self.assertEqual(self.bump.call_count, 2)
+
+    def test_stale_token_is_rejected(self):
+        self.upsert(self.make_command(token=5), 0.3, 2)
+        row = NDVIData.objects.get(name='beijing_ndvi_20240108')
+
+        with self.assertRaises(LeaseLost):
+            self.upsert(self.make_command(token=4), 0.9, 1)
+
+        current = NDVIData.objects.get(pk=row.pk)
+        self.assertAlmostEqual(current.mean_value, 0.3)
+        self.assertEqual(current.metadata['lease']['token'], 5)
+        self.assertEqual(NDVITile.objects.filter(ndvi=current).count(), 2)
+        # 回滚时删除本次上传的缩略图，原缩略图保留
+        self.assertTrue(self.storage.exists(current.thumbnail.name))
+        self.assertEqual(self.storage.listdir('ndvi_thumbnails')[1], [current.thumbnail.name.rsplit('/', 1)[1]])
+        self.assertEqual(self.bump.call_count, 1)
+
+        # 更新的令牌可以覆盖
+        self.upsert(self.make_command(token=6), 0.5, 1)
+        self.assertEqual(NDVIData.objects.get(pk=row.pk).metadata['lease']['token'], 6)
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from .views import PipelineMetricsAPI, PipelineRunDetailAPI, PipelineRunEventsAPI, PipelineRunListAPI
+
+urlpatterns = [
+    path('metrics/', PipelineMetricsAPI.as_view(), name='pipeline-metrics'),
+    path('runs/', PipelineRunListAPI.as_view(), name='pipeline-runs'),
+    path('runs/<int:pk>/', PipelineRunDetailAPI.as_view(), name='pipeline-run-detail'),
+    path('runs/<int:pk>/events/', PipelineRunEventsAPI.as_view(), name='pipeline-run-events'),
+]
@@ -0,0 +1,78 @@
+import logging
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DONE_KEY_PREFIX = 'ndvi_backfill_done'
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def date_windows(start, end, days=None):
+    """把[start, end)切成连续的days天窗口，最后一个窗口截断到end"""
+    start, end = parse_date(start), parse_date(end)
+    days = days or getattr(settings, 'NDVI_BACKFILL_WINDOW_DAYS', 7)
+    windows = []
+    current = start
+    while current < end:
+        window_end = min(current + timedelta(days=days), end)
+        windows.append((current, window_end))
+        current = window_end
+    return windows
+
+
+def window_key(region, start, end):
+    return f"{DONE_KEY_PREFIX}:{region}:{parse_date(start).isoformat()}:{parse_date(end).isoformat()}"
+
+
+def _persistent():
+    return caches['persistent']
+
+
+def is_window_done(region, start, end):
+    try:
+        return _persistent().get(window_key(region, start, end)) is not None
+    except Exception as e:
+        # Redis不可用时按未完成处理，最多重复处理一次
+        logger.warning(f"回填记录读取失败: {str(e)}")
+        return False
+
+
+def mark_window_done(region, start, end, **info):
+    record = {'finished_at': timezone.now().isoformat(), **info}
+    try:
+        _persistent().set(window_key(region, start, end), record, timeout=None)
+    except Exception as e:
+        logger.warning(f"回填记录写入失败: {str(e)}")
+    return record
+
+
+def plan_jobs(start, end, regions=None, window_days=None, force=False):
+    """日期范围 x 区域 拆分为相互独立的作业，已完成的窗口默认跳过"""
+    configured = getattr(settings, 'NDVI_REGIONS', {})
+    regions = list(regions or configured)
+    unknown = [r for r in regions if r not in configured]
+    if unknown:
+        raise ValueError(f"未配置的区域: {unknown}")
+
+    jobs = []
+    for region in regions:
+        for window_start, window_end in date_windows(start, end, window_days):
+            if not force and is_window_done(region, window_start, window_end):
+                continue
+            jobs.append({
+                'region': region,
+                'start_date': window_start.isoformat(),
+                'end_date': window_end.isoformat(),
+            })
+    return jobs
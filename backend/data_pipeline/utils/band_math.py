@@ -0,0 +1,119 @@
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal
+
+from data_pipeline.utils.raster_stats import iter_windows
+
+NDVI_NODATA = -9999.0
+
+
+def invalid_mask(array, nodata):
+    invalid = ~np.isfinite(array)
+    if nodata is not None and not math.isnan(nodata):
+        invalid |= array == nodata
+    return invalid
+
+
+def ndvi_inplace(red, nir, red_nodata=None, nir_nodata=None, nodata=NDVI_NODATA):
+    """原地计算 (NIR-RED)/(NIR+RED+1e-10)，结果写回nir，不产生中间数组
+
+    red/nir须为float32且可写；red在计算后被用作分母缓冲区。
+    """
+    invalid = invalid_mask(red, red_nodata)
+    invalid |= invalid_mask(nir, nir_nodata)
+
+    np.subtract(nir, red, out=nir)          # nir <- nir - red
+    np.multiply(red, 2.0, out=red)          # red <- 2*red
+    np.add(red, nir, out=red)               # red <- nir + red
+    np.add(red, 1e-10, out=red)
+    np.divide(nir, red, out=nir)
+    nir[invalid] = nodata
+    return nir
+
+
+def run_blockwise(input_paths, output_path, kernel, workers=4, block_size=512,
+                  nodata=NDVI_NODATA, creation_options=None, reference=0):
+    """通用分块栅格运算
+
+    按输出块对齐读取全部输入的同一窗口，堆叠为 (输入数, 高, 宽) 的float32数组，
+    kernel(stack, nodatas)返回结果块，块计算分配到线程池（每个线程独立打开输入，写出时加锁）。
+    output_path可为路径列表，此时kernel按相同顺序返回多个结果块，各写入一个单波段文件。
+    输入须与第reference个输入网格一致（可先用VRT对齐）。
+    """
+    input_paths = [str(p) for p in input_paths]
+    multiple = isinstance(output_path, (list, tuple))
+    output_paths = list(output_path) if multiple else [output_path]
+    datasets = [gdal.Open(p) for p in input_paths]
+    if any(ds is None for ds in datasets):
+        raise ValueError(f"无法打开输入: {input_paths}")
+    ref = datasets[reference]
+    width, height = ref.RasterXSize, ref.RasterYSize
+    for path, ds in zip(input_paths, datasets):
+        if (ds.RasterXSize, ds.RasterYSize) != (width, height):
+            raise ValueError(f"输入尺寸不一致: {path}")
+        if not np.allclose(ds.GetGeoTransform(), ref.GetGeoTransform()):
+            raise ValueError(f"输入地理变换不一致: {path}")
+    nodatas = [ds.GetRasterBand(1).GetNoDataValue() for ds in datasets]
+
+    options = creation_options or [
+        'TILED=YES', f'BLOCKXSIZE={block_size}', f'BLOCKYSIZE={block_size}',
+        'COMPRESS=ZSTD', 'PREDICTOR=3', 'BIGTIFF=IF_SAFER',
+    ]
+    driver = gdal.GetDriverByName('GTiff')
+    out_datasets = []
+    for path in output_paths:
+        out_ds = driver.Create(str(path), width, height, 1, gdal.GDT_Float32, options=options)
+        out_ds.SetGeoTransform(ref.GetGeoTransform())
+        out_ds.SetProjection(ref.GetProjection())
+        out_ds.GetRasterBand(1).SetNoDataValue(nodata)
+        out_datasets.append(out_ds)
+    out_bands = [ds.GetRasterBand(1) for ds in out_datasets]
+    datasets = ref = None
+
+    local = threading.local()
+    write_lock = threading.Lock()
+
+    def process(window):
+        if getattr(local, 'bands', None) is None:
+            local.datasets = [gdal.Open(p) for p in input_paths]
+            local.bands = [ds.GetRasterBand(1) for ds in local.datasets]
+        xoff, yoff, xsize, ysize = window
+        # 直接读入预分配的堆叠缓冲区，不产生逐输入的临时数组
+        stack = np.empty((len(local.bands), ysize, xsize), dtype=np.float32)
+        for i, band in enumerate(local.bands):
+            band.ReadAsArray(xoff, yoff, xsize, ysize, buf_obj=stack[i])
+        results = kernel(stack, nodatas)
+        if not multiple:
+            results = [results]
+        with write_lock:
+            for band, result in zip(out_bands, results):
+                band.WriteArray(result, xoff, yoff)
+
+    # 窗口与输出块一一对齐
+    windows = iter_windows(width, height, block_size, block_size, block_size)
+    if workers <= 1:
+        for window in windows:
+            process(window)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(process, windows):
+                pass
+
+    for band in out_bands:
+        band.FlushCache()
+    out_bands = out_datasets = None
+    return output_path
+
+
+def calculate_ndvi_blockwise(red_path, nir_path, output_path, workers=4, block_size=512,
+                             nodata=NDVI_NODATA, creation_options=None):
+    """进程内分块计算NDVI（B04为red，B08为nir）"""
+    def kernel(arrays, nodatas):
+        red, nir = arrays
+        return ndvi_inplace(red, nir, nodatas[0], nodatas[1], nodata)
+
+    return run_blockwise([red_path, nir_path], output_path, kernel, workers=workers,
+                         block_size=block_size, nodata=nodata, creation_options=creation_options)
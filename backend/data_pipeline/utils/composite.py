@@ -0,0 +1,85 @@
+import numpy as np
+
+from data_pipeline.utils.band_math import NDVI_NODATA, invalid_mask, run_blockwise
+
+COMPOSITE_STATISTICS = ('median', 'mean', 'max', 'count')
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+MIN_BLOCK_SIZE = 64
+
+
+def block_bytes(n_inputs, n_outputs, block_size):
+    """单个块在计算期间的峰值内存：输入堆叠 + 结果块 + 排序取值用的索引"""
+    pixels = block_size * block_size
+    return pixels * (4 * n_inputs + 4 * n_outputs + 16)
+
+
+def plan_blocks(n_inputs, n_outputs, memory_budget=DEFAULT_MEMORY_BUDGET, workers=4, block_size=512):
+    """按内存预算确定块大小与并发数：先减小块，块已最小时再减少线程"""
+    while block_size > MIN_BLOCK_SIZE and workers * block_bytes(n_inputs, n_outputs, block_size) > memory_budget:
+        block_size //= 2
+    per_block = block_bytes(n_inputs, n_outputs, block_size)
+    workers = max(1, min(workers, memory_budget // per_block))
+    return block_size, workers
+
+
+def composite_kernel(statistics=('median',), nodata=NDVI_NODATA):
+    """逐像元时间合成，对应EE中ndvi_collection.median()（nodata不参与计算）"""
+    def kernel(stack, nodatas):
+        for i, band_nodata in enumerate(nodatas):
+            stack[i][invalid_mask(stack[i], band_nodata)] = np.nan
+
+        # 原地排序，NaN排在末尾，前count个即有效值
+        stack.sort(axis=0)
+        count = np.isfinite(stack).sum(axis=0)
+        has_data = count > 0
+
+        results = []
+        for name in statistics:
+            if name == 'median':
+                lower = np.maximum(count - 1, 0) // 2
+                upper = count // 2
+                low = np.take_along_axis(stack, lower[np.newaxis], axis=0)[0]
+                high = np.take_along_axis(stack, upper[np.newaxis], axis=0)[0]
+                result = (low + high) * 0.5
+            elif name == 'mean':
+                total = np.nansum(stack, axis=0)
+                result = np.divide(total, count, out=np.zeros_like(total), where=has_data)
+            elif name == 'max':
+                # 排序后最大有效值位于count-1处
+                index = np.maximum(count - 1, 0)[np.newaxis]
+                result = np.take_along_axis(stack, index, axis=0)[0]
+            elif name == 'count':
+                result = count.astype(np.float32)
+                results.append(result)
+                continue
+            else:
+                raise ValueError(f"不支持的合成统计量: {name}")
+            result[~has_data] = nodata
+            results.append(result.astype(np.float32, copy=False))
+        return results
+    return kernel
+
+
+def composite_rasters(input_paths, outputs, workers=4, memory_budget=DEFAULT_MEMORY_BUDGET,
+                      block_size=512, nodata=NDVI_NODATA):
+    """N期已配准的掩膜NDVI逐块合成
+
+    outputs为 {统计量: 输出路径}，统计量取自COMPOSITE_STATISTICS。
+    每个块同时读取全部输入的同一窗口，内存占用只与块大小、输入数和并发数有关。
+    """
+    input_paths = list(input_paths)
+    if not input_paths:
+        raise ValueError("没有可合成的输入")
+    statistics = list(outputs)
+    unknown = set(statistics) - set(COMPOSITE_STATISTICS)
+    if unknown:
+        raise ValueError(f"不支持的合成统计量: {sorted(unknown)}")
+
+    block_size, workers = plan_blocks(len(input_paths), len(statistics),
+                                      memory_budget, workers, block_size)
+    run_blockwise(
+        input_paths, [outputs[name] for name in statistics],
+        composite_kernel(statistics, nodata), workers=workers,
+        block_size=block_size, nodata=nodata,
+    )
+    return outputs
@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from data_pipeline.utils.metrics import observe
+
+logger = logging.getLogger(__name__)
+
+
+class EESession:
+    """单次管道运行内的Earth Engine缓存
+
+    cached() 记住构建好的EE对象（join、云掩膜、中值合成等计算图），
+    get_info() 记住getInfo结果并统计服务端往返次数，
+    同一个键在一次运行内只会构建/请求一次；
+    external() 计入第三方库内部发起、无法缓存的往返。
+    """
+
+    def __init__(self):
+        self._objects = {}
+        self._info = {}
+        self._lock = threading.RLock()
+        self.round_trips = 0
+        self.round_trip_seconds = 0.0
+
+    def cached(self, key, builder):
+        """返回缓存的EE对象，不存在时调用builder构建"""
+        with self._lock:
+            if key not in self._objects:
+                self._objects[key] = builder()
+            return self._objects[key]
+
+    def get(self, key):
+        return self._objects[key]
+
+    def get_info(self, key, ee_object):
+        """带缓存的getInfo，每次真实请求计一次往返"""
+        with self._lock:
+            if key in self._info:
+                return self._info[key]
+
+            start = time.monotonic()
+            result = ee_object.getInfo()
+            elapsed = time.monotonic() - start
+
+            self.round_trips += 1
+            self.round_trip_seconds += elapsed
+            observe('ndvi_pipeline_ee_getinfo_seconds', elapsed, key=key)
+            logger.info(f"EE getInfo[{key}] 耗时 {elapsed:.2f}s")
+            self._info[key] = result
+            return result
+
+    @contextmanager
+    def external(self, key, round_trips=1):
+        """第三方库内部发起的getInfo（如geemap.fishnet取范围）无法缓存，只计入往返次数与耗时"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.round_trips += round_trips
+                self.round_trip_seconds += elapsed
+            observe('ndvi_pipeline_ee_getinfo_seconds', elapsed, key=key)
+            logger.info(f"EE {key}（外部调用）耗时 {elapsed:.2f}s")
+
+    def summary(self):
+        return {
+            'round_trips': self.round_trips,
+            'round_trip_seconds': round(self.round_trip_seconds, 3),
+            'cached_objects': len(self._objects),
+        }
@@ -1,18 +1,36 @@
 from django.conf import settings
+import os
 import subprocess
+from pathlib import Path
+
+from data_pipeline.utils.band_math import calculate_ndvi_blockwise
 
 
 class GDALWrapper:
     def __init__(self):
-        self.gdal_path = settings.GDAL_LIBRARY_PATH
+        self.gdal_path = getattr(settings, 'GDAL_LIBRARY_PATH', None)
+
+    def calculate_ndvi(self, b04_path, b08_path, output_path, compress_level, workers=4, engine='numpy'):
+        """计算NDVI，默认使用进程内分块引擎；engine='gdal_calc'时调用外部gdal_calc.py"""
+        if engine == 'gdal_calc':
+            return self.calculate_ndvi_subprocess(b04_path, b08_path, output_path, compress_level)
+
+        return calculate_ndvi_blockwise(
+            b04_path, b08_path, output_path,
+            workers=workers,
+            creation_options=[
+                'TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                'COMPRESS=LZW', 'PREDICTOR=3', 'BIGTIFF=IF_SAFER',
+            ],
+        )
 
-    def calculate_ndvi(self, b04_path, b08_path, output_path, compress_level):
+    def calculate_ndvi_subprocess(self, b04_path, b08_path, output_path, compress_level):
         """调用GDAL计算NDVI"""
         cmd = [
             'gdal_calc.py',
             '-A', b04_path,
             '-B', b08_path,
-            '--calc="(B-A)/(B+A+1e-10)*1.0"',
+            '--calc=(B-A)/(B+A+1e-10)*1.0',  # 参数列表不经过shell，不能再加引号
             '--outfile', output_path,
             '--NoDataValue=-9999',
             '--type=Float32',
@@ -22,4 +40,105 @@ class GDALWrapper:
         ]
         proc = subprocess.run(cmd, capture_output=True)
         if proc.returncode != 0:
-            raise RuntimeError(f"GDAL执行失败: {proc.stderr.decode()}")
\ No newline at end of file
+            raise RuntimeError(f"GDAL执行失败: {proc.stderr.decode()}")
+        return output_path
+
+
+# 合并产品（COG）文件名，与tile_*.tif区分
+PRODUCT_FILENAME = 'ndvi_cog.tif'
+# 虚拟镶嵌产品文件名（只引用分块，不复制像元）
+MOSAIC_FILENAME = 'mosaic.vrt'
+
+# GTiff的PREDICTOR取值与COG驱动的写法对照
+_COG_PREDICTORS = {0: 'NO', 1: 'NO', 2: 'STANDARD', 3: 'FLOATING_POINT'}
+# GTiff驱动的压缩级别参数名因编码而异（COG驱动统一为LEVEL）
+_GTIFF_LEVEL_OPTIONS = {'DEFLATE': 'ZLEVEL', 'ZSTD': 'ZSTD_LEVEL', 'LZMA': 'LZMA_PRESET'}
+
+
+def product_creation_options(fmt='COG', compress='ZSTD', predictor=3, level=None,
+                             num_threads='ALL_CPUS', blocksize=512):
+    """合并产品的创建参数
+
+    COG: 内部分块 + 自动概视图，便于按范围/多分辨率读取；
+    GTiff: 旧版普通分块TIFF，不含概视图。
+    """
+    compress = compress.upper()
+    options = [f'COMPRESS={compress}', f'NUM_THREADS={num_threads}', 'BIGTIFF=IF_SAFER']
+    if fmt.upper() == 'COG':
+        options += [
+            f'BLOCKSIZE={blocksize}',
+            'OVERVIEWS=AUTO',
+            'OVERVIEW_RESAMPLING=AVERAGE',
+        ]
+        if compress in ('ZSTD', 'DEFLATE', 'LZW', 'LZMA'):
+            options.append(f'PREDICTOR={_COG_PREDICTORS.get(predictor, "NO")}')
+        if level is not None and compress in ('ZSTD', 'DEFLATE'):
+            options.append(f'LEVEL={level}')
+    else:
+        options += ['TILED=YES', f'BLOCKXSIZE={blocksize}', f'BLOCKYSIZE={blocksize}']
+        if compress in ('ZSTD', 'DEFLATE', 'LZW', 'LZMA') and predictor:
+            options.append(f'PREDICTOR={predictor}')
+        if level is not None and compress in _GTIFF_LEVEL_OPTIONS:
+            options.append(f'{_GTIFF_LEVEL_OPTIONS[compress]}={level}')
+    return options
+
+
+def raster_footprint(path, densify=8):
+    """计算栅格在EPSG:4326下的外轮廓，同时返回尺寸与块大小
+
+    四条边各加密densify个点后再投影，避免投影变形导致轮廓偏小。
+    返回 (坐标环[(lon, lat), ...], {'width', 'height', 'block_x', 'block_y'})
+    """
+    from osgeo import gdal, osr
+
+    ds = gdal.Open(str(path))
+    if ds is None:
+        raise ValueError(f"无法打开文件: {path}")
+    gt = ds.GetGeoTransform()
+    width, height = ds.RasterXSize, ds.RasterYSize
+    block_x, block_y = ds.GetRasterBand(1).GetBlockSize()
+
+    src = osr.SpatialReference()
+    src.ImportFromWkt(ds.GetProjection())
+    src.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    dst = osr.SpatialReference()
+    dst.ImportFromEPSG(4326)
+    dst.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    transform = osr.CoordinateTransformation(src, dst)
+    ds = None
+
+    # 沿像元边界顺时针取点：上边 -> 右边 -> 下边 -> 左边
+    steps = [i / densify for i in range(densify)]
+    pixels = ([(width * s, 0) for s in steps] + [(width, height * s) for s in steps]
+              + [(width * (1 - s), height) for s in steps] + [(0, height * (1 - s)) for s in steps])
+    ring = []
+    for px, py in pixels:
+        x = gt[0] + px * gt[1] + py * gt[2]
+        y = gt[3] + px * gt[4] + py * gt[5]
+        lon, lat, _ = transform.TransformPoint(x, y)
+        ring.append((lon, lat))
+    ring.append(ring[0])
+    return ring, {'width': width, 'height': height, 'block_x': block_x, 'block_y': block_y}
+
+
+def build_mosaic_vrt(tile_files, vrt_path):
+    """把分块持久化为虚拟镶嵌（VRT），不写出合并后的像元
+
+    分块与VRT同目录时GDAL以相对路径（relativeToVRT）记录数据源，
+    产品目录整体移动或打包后仍可打开。先写临时文件再原子替换，读取方不会看到半个VRT。
+    """
+    from osgeo import gdal
+
+    vrt_path = Path(vrt_path)
+    tmp = vrt_path.with_name(vrt_path.name + '.tmp')
+    vrt = gdal.BuildVRT(
+        destName=str(tmp),
+        srcDSOrSrcDSTab=[str(f) for f in tile_files],
+        options=gdal.BuildVRTOptions(resampleAlg='near', addAlpha=False)
+    )
+    if vrt is None:
+        raise RuntimeError("无法构建VRT文件")
+    vrt.FlushCache()
+    vrt = None
+    os.replace(tmp, vrt_path)
+    return vrt_path
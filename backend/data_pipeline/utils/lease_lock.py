@@ -0,0 +1,140 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+LEASE_PREFIX = 'ndvi_lease'
+DEFAULT_TTL = 600
+
+# 键不存在时才加锁：递增栅栏计数并以 owner:token 作为锁值
+_ACQUIRE = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return nil
+end
+local token = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], ARGV[1] .. ':' .. token, 'PX', ARGV[2])
+return token
+"""
+
+# 仍由自己持有时才续期/释放
+_RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaseLost(RuntimeError):
+    """租约已过期或被他人接管"""
+
+
+def redis_client(alias='default'):
+    from django_redis import get_redis_connection
+    return get_redis_connection(alias)
+
+
+def lease_name(region, start_date, end_date):
+    return f"{LEASE_PREFIX}:{region}:{start_date}:{end_date}"
+
+
+class LeaseLock:
+    """基于Redis的租约锁
+
+    SET NX PX加锁并带过期时间，进程崩溃后租约自动失效；持有期间由后台线程定期续期。
+    每次加锁得到单调递增的栅栏令牌，写入前校验令牌，过期后被接管的旧持有者无法覆盖新结果。
+    """
+
+    def __init__(self, name, ttl=None, client=None):
+        from django.conf import settings
+
+        self.name = name
+        self.fence_key = f"{name}:fence"
+        self.ttl = ttl or getattr(settings, 'NDVI_LEASE_TTL', DEFAULT_TTL)
+        self.client = client or redis_client()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.token = None
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._heartbeat = None
+        self._acquire = self.client.register_script(_ACQUIRE)
+        self._renew = self.client.register_script(_RENEW)
+        self._release = self.client.register_script(_RELEASE)
+
+    @property
+    def value(self):
+        return f"{self.owner}:{self.token}"
+
+    def acquire(self):
+        """非阻塞加锁，成功返回栅栏令牌，已被占用返回None"""
+        token = self._acquire(keys=[self.name, self.fence_key], args=[self.owner, int(self.ttl * 1000)])
+        if token is None:
+            return None
+        self.token = int(token)
+        self.lost.clear()
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._beat, name=f"lease-{self.name}", daemon=True)
+        self._heartbeat.start()
+        return self.token
+
+    def renew(self):
+        return bool(self._renew(keys=[self.name], args=[self.value, int(self.ttl * 1000)]))
+
+    def _beat(self):
+        # 每1/3租期续期一次，连续两次失败前租约仍然有效
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                if not self.renew():
+                    logger.error(f"租约已丢失: {self.name}")
+                    self.lost.set()
+                    return
+            except Exception as e:
+                logger.warning(f"租约续期失败: {self.name}: {str(e)}")
+
+    def release(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout=5)
+            self._heartbeat = None
+        if self.token is None:
+            return False
+        try:
+            return bool(self._release(keys=[self.name], args=[self.value]))
+        except Exception as e:
+            logger.warning(f"租约释放失败: {self.name}: {str(e)}")
+            return False
+        finally:
+            self.token = None
+
+    def __enter__(self):
+        if self.acquire() is None:
+            raise LeaseLost(f"租约已被占用: {self.name}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+def check_fencing_token(name, token, client=None):
+    """校验令牌仍为该租约当前持有者（写入前调用），否则抛出LeaseLost"""
+    client = client or redis_client()
+    value = client.get(name)
+    if value is not None and isinstance(value, bytes):
+        value = value.decode()
+    if value is None or not value.endswith(f":{token}"):
+        raise LeaseLost(f"租约已失效（令牌 {token}）: {name}")
+    latest = int(client.get(f"{name}:fence") or 0)
+    if latest != int(token):
+        raise LeaseLost(f"租约已被接管（令牌 {token} < {latest}）: {name}")
+    return True
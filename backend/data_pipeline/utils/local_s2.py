@@ -0,0 +1,179 @@
+import math
+import uuid
+from pathlib import Path
+
+import numpy as np
+from osgeo import gdal, osr
+
+from data_pipeline.utils.band_math import NDVI_NODATA, invalid_mask, ndvi_inplace, run_blockwise
+
+# 与Earth Engine中cloud_masking保持一致
+QA60_CLOUD_BITS = 0b11 << 10  # 第10位不透明云、第11位卷云
+CLOUD_PROBABILITY_THRESHOLD = 15
+
+# 文件名关键字 -> 波段
+BAND_PATTERNS = {
+    'B04': ('B04', 'B4'),
+    'B08': ('B08', 'B8'),
+    'QA60': ('QA60',),
+    'CLOUD_PROB': ('CLDPRB', 'CLOUD_PROB', 'PROBABILITY', 'CLD'),
+}
+
+
+def find_scene_bands(scene_dir):
+    """在场景目录中按文件名识别B04/B08/QA60/云概率四个波段"""
+    scene_dir = Path(scene_dir)
+    files = sorted(list(scene_dir.glob('*.tif')) + list(scene_dir.glob('*.TIF'))
+                   + list(scene_dir.glob('*.jp2')))
+    bands = {}
+    for band, patterns in BAND_PATTERNS.items():
+        for f in files:
+            stem = f.stem.upper()
+            if f in bands.values():
+                continue
+            # B8A不是B08，避免误匹配
+            if band == 'B08' and 'B8A' in stem:
+                continue
+            if any(p in stem for p in patterns):
+                bands[band] = f
+                break
+    missing = set(BAND_PATTERNS) - set(bands)
+    if missing:
+        raise FileNotFoundError(f"场景 {scene_dir} 缺少波段: {sorted(missing)}")
+    return bands
+
+
+def align_to(path, reference_path):
+    """把60m的QA60、20m的云概率按最近邻对齐到B04网格（内存VRT，可被多线程按路径打开）"""
+    ref = gdal.Open(str(reference_path))
+    gt = ref.GetGeoTransform()
+    bounds = (gt[0], gt[3] + gt[5] * ref.RasterYSize, gt[0] + gt[1] * ref.RasterXSize, gt[3])
+    vrt_path = f"/vsimem/aligned_{uuid.uuid4().hex}.vrt"
+    ds = gdal.Warp(vrt_path, str(path), options=gdal.WarpOptions(
+        format='VRT', dstSRS=ref.GetProjection(), outputBounds=bounds,
+        width=ref.RasterXSize, height=ref.RasterYSize, resampleAlg='near',
+    ))
+    if ds is None:
+        raise RuntimeError(f"波段对齐失败: {path}")
+    ds = None
+    ref = None
+    return vrt_path
+
+
+def masked_ndvi_kernel(boa_offset=0.0, nodata=NDVI_NODATA,
+                       cloud_threshold=CLOUD_PROBABILITY_THRESHOLD):
+    """QA60位掩膜 + 云概率掩膜 + NDVI，对应EE中的cloud_masking与normalizedDifference"""
+    def kernel(arrays, nodatas):
+        red, nir, qa, prob = arrays
+        clear = (qa.astype(np.uint16) & QA60_CLOUD_BITS) == 0
+        clear &= prob < cloud_threshold
+        clear &= ~invalid_mask(qa, nodatas[2])
+        clear &= ~invalid_mask(prob, nodatas[3])
+        # nodata须在加BOA偏移前判断，否则偏移后的nodata（如0-1000）会被当作有效反射率
+        clear &= ~invalid_mask(red, nodatas[0])
+        clear &= ~invalid_mask(nir, nodatas[1])
+        if boa_offset:
+            red += boa_offset
+            nir += boa_offset
+        result = ndvi_inplace(red, nir, None, None, nodata)
+        result[~clear] = nodata
+        return result
+    return kernel
+
+
+def process_scene(scene_dir, output_path, workers=4, block_size=512, boa_offset=0.0):
+    """对单个场景做云掩膜并计算NDVI，输出场景原始网格下的Float32 GeoTIFF"""
+    bands = find_scene_bands(scene_dir)
+    aligned = [align_to(bands['QA60'], bands['B04']), align_to(bands['CLOUD_PROB'], bands['B04'])]
+    try:
+        run_blockwise(
+            [bands['B04'], bands['B08'], *aligned], output_path,
+            masked_ndvi_kernel(boa_offset), workers=workers, block_size=block_size,
+        )
+    finally:
+        for vrt in aligned:
+            gdal.Unlink(vrt)
+    return output_path
+
+
+def common_grid(raster_paths, crs='EPSG:4526', resolution=10):
+    """多个场景在目标坐标系下的并集范围（按分辨率对齐），用于跨MGRS分幅的合成"""
+    dst = osr.SpatialReference()
+    dst.SetFromUserInput(crs)
+    dst.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    bounds = None
+    for path in raster_paths:
+        ds = gdal.Open(str(path))
+        src = osr.SpatialReference()
+        src.ImportFromWkt(ds.GetProjection())
+        src.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        gt = ds.GetGeoTransform()
+        b = osr.CoordinateTransformation(src, dst).TransformBounds(
+            gt[0], gt[3] + gt[5] * ds.RasterYSize, gt[0] + gt[1] * ds.RasterXSize, gt[3], 21
+        )
+        ds = None
+        bounds = b if bounds is None else (min(bounds[0], b[0]), min(bounds[1], b[1]),
+                                           max(bounds[2], b[2]), max(bounds[3], b[3]))
+    minx, miny = (math.floor(v / resolution) * resolution for v in bounds[:2])
+    maxx, maxy = (math.ceil(v / resolution) * resolution for v in bounds[2:])
+    return (minx, miny, maxx, maxy), crs, resolution
+
+
+def warp_to_grid(ndvi_path, grid, nodata=NDVI_NODATA):
+    """把场景NDVI对齐到公共网格（内存VRT，网格外为nodata）"""
+    bounds, crs, resolution = grid
+    vrt_path = f"/vsimem/grid_{uuid.uuid4().hex}.vrt"
+    ds = gdal.Warp(vrt_path, str(ndvi_path), options=gdal.WarpOptions(
+        format='VRT', dstSRS=crs, outputBounds=bounds, xRes=resolution, yRes=resolution,
+        resampleAlg='near', srcNodata=nodata, dstNodata=nodata, outputType=gdal.GDT_Float32,
+    ))
+    if ds is None:
+        raise RuntimeError(f"场景对齐失败: {ndvi_path}")
+    ds = None
+    return vrt_path
+
+
+def fishnet_cells(raster_path, rows=8, cols=6, crs='EPSG:4526'):
+    """按目标坐标系下的栅格范围划分rows x cols网格，顺序与geemap.fishnet一致（逐行）"""
+    ds = gdal.Open(str(raster_path))
+    src = osr.SpatialReference()
+    src.ImportFromWkt(ds.GetProjection())
+    src.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    dst = osr.SpatialReference()
+    dst.SetFromUserInput(crs)
+    dst.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    gt = ds.GetGeoTransform()
+    minx, miny, maxx, maxy = osr.CoordinateTransformation(src, dst).TransformBounds(
+        gt[0], gt[3] + gt[5] * ds.RasterYSize, gt[0] + gt[1] * ds.RasterXSize, gt[3], 21
+    )
+    ds = None
+
+    dx, dy = (maxx - minx) / cols, (maxy - miny) / rows
+    return [
+        (minx + c * dx, maxy - (r + 1) * dy, minx + (c + 1) * dx, maxy - r * dy)
+        for r in range(rows) for c in range(cols)
+    ]
+
+
+def cell_region(cell, crs='EPSG:4526'):
+    """网格单元的GeoJSON描述（写入清单，便于与EE分块对照）"""
+    minx, miny, maxx, maxy = cell
+    return {
+        'type': 'Polygon',
+        'crs': crs,
+        'coordinates': [[[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]]],
+    }
+
+
+def warp_tile(ndvi_path, tile_path, cell, crs='EPSG:4526', resolution=10, nodata=NDVI_NODATA):
+    """把场景NDVI重投影裁剪为一个分块（与EE下载的分块同坐标系与分辨率）"""
+    ds = gdal.Warp(str(tile_path), str(ndvi_path), options=gdal.WarpOptions(
+        format='GTiff', dstSRS=crs, outputBounds=cell, xRes=resolution, yRes=resolution,
+        targetAlignedPixels=True, resampleAlg='near', srcNodata=nodata, dstNodata=nodata,
+        outputType=gdal.GDT_Float32, multithread=True,
+        creationOptions=['TILED=YES', 'COMPRESS=LZW', 'PREDICTOR=3'],
+    ))
+    if ds is None:
+        raise RuntimeError(f"分块生成失败: {tile_path}")
+    ds = None
+    return tile_path
@@ -0,0 +1,217 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'ndvi_metrics'
+# 阶段耗时（秒）的直方图分桶：从单次getInfo到整期下载
+SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+THROUGHPUT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100)
+
+# 指标名 -> (类型, 说明, 分桶)
+METRICS = {
+    'ndvi_pipeline_stage_seconds': ('histogram', '管道各阶段耗时（秒）', SECONDS_BUCKETS),
+    'ndvi_pipeline_ee_getinfo_seconds': ('histogram', 'Earth Engine getInfo往返耗时（秒）', SECONDS_BUCKETS),
+    'ndvi_pipeline_tile_download_seconds': ('histogram', '单个分块下载耗时（秒）', SECONDS_BUCKETS),
+    'ndvi_pipeline_tile_throughput_mbps': ('histogram', '单个分块下载速率（MB/s）', THROUGHPUT_BUCKETS),
+    'ndvi_pipeline_tile_bytes_total': ('counter', '已下载分块字节数', None),
+    'ndvi_pipeline_tiles_total': ('counter', '分块处理次数（按结果）', None),
+    'ndvi_pipeline_runs_total': ('counter', '管道运行次数（按结果）', None),
+}
+
+
+# 观测先在进程内累加，由后台线程定期批量写入Redis，下载/校验线程不做网络往返
+FLUSH_INTERVAL = 5
+
+_pending = {}  # Redis键 -> {字段: 增量}
+_pending_lock = threading.Lock()
+_flusher = None
+
+
+def _client():
+    from django.conf import settings
+    from django_redis import get_redis_connection
+    # 独立的缓存别名，配置了较短的socket超时
+    return get_redis_connection(getattr(settings, 'NDVI_METRICS_CACHE', 'metrics'))
+
+
+def _label_key(labels):
+    return ','.join(f'{k}="{v}"' for k, v in sorted((labels or {}).items()))
+
+
+def _add(key, fields):
+    global _flusher
+    with _pending_lock:
+        pending = _pending.setdefault(key, {})
+        for field, amount in fields:
+            pending[field] = pending.get(field, 0) + amount
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True)
+            _flusher.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def flush():
+    """把进程内累加的观测一次性写入Redis；Redis不可用时丢弃，不影响管道本身"""
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return
+    try:
+        pipe = _client().pipeline(transaction=False)
+        for key, fields in pending.items():
+            for field, amount in fields.items():
+                if isinstance(amount, int):
+                    pipe.hincrby(key, field, amount)
+                else:
+                    pipe.hincrbyfloat(key, field, amount)
+        pipe.execute()
+    except Exception as e:
+        logger.debug(f"指标写入失败: {str(e)}")
+
+
+def _reset_after_fork():
+    # fork时锁可能正被其他线程持有；子进程从空缓冲重新开始
+    global _pending, _pending_lock, _flusher
+    _pending, _pending_lock, _flusher = {}, threading.Lock(), None
+
+
+atexit.register(flush)
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def observe(name, value, **labels):
+    """记录一次直方图观测（分桶、sum、count累加到同一个Redis哈希）"""
+    kind, _, buckets = METRICS[name]
+    if kind != 'histogram':
+        raise ValueError(f"{name} 不是直方图")
+    label_key = _label_key(labels)
+    fields = [(f"{label_key}|{bound}", 1) for bound in buckets if value <= bound]
+    fields += [(f"{label_key}|+Inf", 1), (f"{label_key}|sum", float(value)), (f"{label_key}|count", 1)]
+    _add(f"{METRICS_PREFIX}:{name}", fields)
+
+
+def increment(name, amount=1, **labels):
+    _add(f"{METRICS_PREFIX}:{name}", [(f"{_label_key(labels)}|value", float(amount))])
+
+
+def _format_value(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _series(name, label_key, extra=None):
+    labels = label_key
+    if extra:
+        labels = f"{labels},{extra}" if labels else extra
+    return f"{name}{{{labels}}}" if labels else name
+
+
+def render_prometheus():
+    """导出Prometheus文本格式（0.0.4）"""
+    flush()
+    client = _client()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        raw = client.hgetall(f"{METRICS_PREFIX}:{name}")
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        grouped = {}
+        for field, value in raw.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            value = value.decode() if isinstance(value, bytes) else value
+            label_key, _, part = field.rpartition('|')
+            grouped.setdefault(label_key, {})[part] = value
+
+        for label_key in sorted(grouped):
+            parts = grouped[label_key]
+            if kind == 'counter':
+                lines.append(f"{_series(name, label_key)} {_format_value(parts.get('value', 0))}")
+                continue
+            for bound in [*(str(b) for b in buckets), '+Inf']:
+                le = f'le="{bound}"'
+                lines.append(f"{_series(name + '_bucket', label_key, le)} {_format_value(parts.get(bound, 0))}")
+            lines.append(f"{_series(name + '_sum', label_key)} {_format_value(parts.get('sum', 0))}")
+            lines.append(f"{_series(name + '_count', label_key)} {_format_value(parts.get('count', 0))}")
+    return '\n'.join(lines) + '\n'
+
+
+class RunTimings:
+    """单次运行的分阶段计时
+
+    stage()既写入直方图也汇总到本次运行，结束后保存为产品目录下的timings.json，
+    同一阶段多次进入（例如每个分块的校验）时累加耗时与次数。
+    """
+
+    def __init__(self, run_id=None):
+        self.run_id = run_id
+        self.started = time.monotonic()
+        self.stages = {}
+        self.tiles = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'seconds': 0.0, 'count': 0})
+            entry['seconds'] += seconds
+            entry['count'] += 1
+        observe('ndvi_pipeline_stage_seconds', seconds, stage=stage)
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(stage, time.monotonic() - start)
+
+    def tile_downloaded(self, index, size, seconds):
+        """记录单个分块下载的字节数、耗时与速率"""
+        mbps = size / (1024 * 1024) / seconds if seconds > 0 else 0.0
+        with self._lock:
+            self.tiles.append({'index': index, 'bytes': size, 'seconds': round(seconds, 3),
+                               'mbps': round(mbps, 3)})
+        observe('ndvi_pipeline_tile_download_seconds', seconds)
+        observe('ndvi_pipeline_tile_throughput_mbps', mbps)
+        increment('ndvi_pipeline_tile_bytes_total', size)
+        increment('ndvi_pipeline_tiles_total', status='done')
+        return mbps
+
+    def summary(self):
+        with self._lock:
+            total_bytes = sum(t['bytes'] for t in self.tiles)
+            download_seconds = sum(t['seconds'] for t in self.tiles)
+            return {
+                'run_id': self.run_id,
+                'total_seconds': round(time.monotonic() - self.started, 3),
+                'stages': {k: {'seconds': round(v['seconds'], 3), 'count': v['count']}
+                           for k, v in self.stages.items()},
+                'tiles': {
+                    'count': len(self.tiles),
+                    'bytes': total_bytes,
+                    'download_seconds': round(download_seconds, 3),
+                    'mean_mbps': round(total_bytes / (1024 * 1024) / download_seconds, 3)
+                    if download_seconds else None,
+                },
+            }
+
+    def save(self, output_path, extra=None):
+        """把本次运行的计时汇总写入timings.json（原子替换）"""
+        data = {**self.summary(), **(extra or {}), 'tile_details': list(self.tiles)}
+        target = os.path.join(output_path, 'timings.json')
+        tmp = target + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, target)
+        return data
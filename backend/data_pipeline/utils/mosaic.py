@@ -0,0 +1,161 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal, gdal_array, osr
+
+from data_pipeline.utils.band_math import NDVI_NODATA, invalid_mask
+from data_pipeline.utils.raster_stats import iter_windows
+
+
+def mosaic_grid(tile_files, tolerance=1e-3):
+    """计算分块并集范围的输出网格，以及每个分块在输出网格中的像元偏移
+
+    要求各分块为北向上、分辨率与坐标系一致且像元对齐（下载分块均满足），
+    不满足时抛出ValueError，不做重采样。
+    """
+    sources = []
+    grid = None
+    for path in tile_files:
+        ds = gdal.Open(str(path))
+        if ds is None:
+            raise ValueError(f"无法打开分块: {path}")
+        gt = ds.GetGeoTransform()
+        if gt[2] != 0 or gt[4] != 0:
+            raise ValueError(f"不支持旋转的地理变换: {path}")
+        band = ds.GetRasterBand(1)
+        if grid is None:
+            srs = osr.SpatialReference(wkt=ds.GetProjection()) if ds.GetProjection() else None
+            grid = {
+                'res': (gt[1], gt[5]),
+                'projection': ds.GetProjection(),
+                'srs': srs,
+                'data_type': band.DataType,
+                'nodata': band.GetNoDataValue(),
+            }
+        else:
+            if not np.allclose((gt[1], gt[5]), grid['res'], rtol=tolerance):
+                raise ValueError(f"分块分辨率不一致: {path}")
+            if grid['srs'] is not None and ds.GetProjection() and \
+                    not grid['srs'].IsSame(osr.SpatialReference(wkt=ds.GetProjection())):
+                raise ValueError(f"分块坐标系不一致: {path}")
+            if grid['nodata'] is None:
+                grid['nodata'] = band.GetNoDataValue()
+        sources.append({
+            'path': str(path),
+            'bounds': (gt[0], gt[3] + ds.RasterYSize * gt[5], gt[0] + ds.RasterXSize * gt[1], gt[3]),
+            'width': ds.RasterXSize,
+            'height': ds.RasterYSize,
+            'nodata': band.GetNoDataValue(),
+        })
+        ds = None
+    if not sources:
+        raise ValueError("未找到分块文件")
+
+    res_x, res_y = grid['res']
+    minx = min(s['bounds'][0] for s in sources)
+    maxy = max(s['bounds'][3] for s in sources)
+    maxx = max(s['bounds'][2] for s in sources)
+    miny = min(s['bounds'][1] for s in sources)
+
+    for source in sources:
+        col = (source['bounds'][0] - minx) / res_x
+        row = (source['bounds'][3] - maxy) / res_y
+        if abs(col - round(col)) > tolerance or abs(row - round(row)) > tolerance:
+            raise ValueError(f"分块未与输出网格像元对齐: {source['path']}")
+        source['xoff'], source['yoff'] = int(round(col)), int(round(row))
+
+    grid.update({
+        'geotransform': (minx, res_x, 0.0, maxy, 0.0, res_y),
+        'width': int(round((maxx - minx) / res_x)),
+        'height': int(round((miny - maxy) / res_y)),
+    })
+    if grid['nodata'] is None and gdal.GetDataTypeName(grid['data_type']).startswith('Float'):
+        grid['nodata'] = NDVI_NODATA
+    del grid['srs']
+    return grid, sources
+
+
+def _valid_mask(values, nodata):
+    if np.issubdtype(values.dtype, np.floating):
+        return ~invalid_mask(values, nodata)
+    if nodata is not None:
+        return values != nodata
+    return np.ones(values.shape, dtype=bool)
+
+
+def mosaic_tiles(tile_files, output_path, workers=4, block_size=512, creation_options=None):
+    """按输出块镶嵌分块，内存占用只与块大小和线程数有关
+
+    输出为分块并集范围的分块GTiff；每个输出块只读取与之相交的分块子窗口，
+    重叠处按分块顺序后者覆盖前者，但nodata/非有限值不会覆盖已有的有效像元（与BuildVRT一致）。
+    输出块互不重叠，分配到线程池并行处理（每个线程独立打开分块，写出时加锁）；
+    没有分块覆盖的输出块不写出，以稀疏块表示nodata。
+    """
+    grid, sources = mosaic_grid(tile_files)
+    width, height = grid['width'], grid['height']
+    nodata = grid['nodata']
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(grid['data_type'])
+
+    options = list(creation_options or [
+        'TILED=YES', f'BLOCKXSIZE={block_size}', f'BLOCKYSIZE={block_size}',
+        'COMPRESS=ZSTD', 'PREDICTOR=3', 'BIGTIFF=IF_SAFER',
+    ])
+    if not any(o.upper().startswith('SPARSE_OK=') for o in options):
+        options.append('SPARSE_OK=TRUE')
+    driver = gdal.GetDriverByName('GTiff')
+    out_ds = driver.Create(str(output_path), width, height, 1, grid['data_type'], options=options)
+    if out_ds is None:
+        raise RuntimeError(f"无法创建输出文件: {output_path}")
+    out_ds.SetGeoTransform(grid['geotransform'])
+    out_ds.SetProjection(grid['projection'])
+    out_band = out_ds.GetRasterBand(1)
+    if nodata is not None:
+        out_band.SetNoDataValue(nodata)
+
+    local = threading.local()
+    write_lock = threading.Lock()
+
+    def process(window):
+        xoff, yoff, xsize, ysize = window
+        hits = [
+            i for i, s in enumerate(sources)
+            if s['xoff'] < xoff + xsize and s['xoff'] + s['width'] > xoff
+            and s['yoff'] < yoff + ysize and s['yoff'] + s['height'] > yoff
+        ]
+        if not hits:
+            return
+        if getattr(local, 'bands', None) is None:
+            local.datasets = {}
+            local.bands = {}
+        block = np.full((ysize, xsize), nodata if nodata is not None else 0, dtype=dtype)
+        for i in hits:
+            source = sources[i]
+            if i not in local.bands:
+                local.datasets[i] = gdal.Open(source['path'])
+                local.bands[i] = local.datasets[i].GetRasterBand(1)
+            # 输出块与分块的交集（输出网格坐标）
+            x0, y0 = max(xoff, source['xoff']), max(yoff, source['yoff'])
+            x1 = min(xoff + xsize, source['xoff'] + source['width'])
+            y1 = min(yoff + ysize, source['yoff'] + source['height'])
+            target = block[y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff]
+            values = np.empty(target.shape, dtype=dtype)
+            local.bands[i].ReadAsArray(x0 - source['xoff'], y0 - source['yoff'], x1 - x0, y1 - y0,
+                                       buf_obj=values)
+            np.copyto(target, values, where=_valid_mask(values, source['nodata']))
+        with write_lock:
+            out_band.WriteArray(block, xoff, yoff)
+
+    # 窗口与输出块一一对齐，不同线程不会写同一个块
+    windows = iter_windows(width, height, block_size, block_size, block_size)
+    if workers <= 1:
+        for window in windows:
+            process(window)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(process, windows):
+                pass
+
+    out_band.FlushCache()
+    out_band = out_ds = None
+    return output_path
@@ -0,0 +1,283 @@
+import json
+import math
+import os
+import threading
+from datetime import date as date_type, datetime
+from pathlib import Path
+
+import fasteners
+import numpy as np
+from osgeo import gdal, osr
+
+CUBE_META = 'cube.json'
+CUBE_DATA = 'cube.i2'
+# NDVI按万分之一定点存储为int16，体积只有float32的一半
+SCALE = 10000
+NODATA = -32768
+
+
+class NDVICube:
+    """NDVI时间序列立方体（time x y x x）
+
+    数据以内存映射的int16文件存储，形状为 (块行, 块列, 时间容量, 块高, 块宽)，
+    每个空间块的全部历史连续存放，点/多边形查询只需读取相关块一次。
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.meta_path = self.root / CUBE_META
+        self.data_path = self.root / CUBE_DATA
+        self.meta = self._read_meta()
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self):
+        tmp = self.meta_path.with_suffix('.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.meta_path)
+
+    @property
+    def exists(self):
+        return self.meta is not None
+
+    @property
+    def dates(self):
+        return self.meta['dates'] if self.meta else []
+
+    def _shape(self, capacity=None):
+        m = self.meta
+        chunk = m['chunk']
+        return (math.ceil(m['height'] / chunk), math.ceil(m['width'] / chunk),
+                capacity or m['capacity'], chunk, chunk)
+
+    def _memmap(self, mode='r'):
+        return np.memmap(self.data_path, dtype=np.int16, mode=mode, shape=self._shape())
+
+    # ---------- 写入 ----------
+
+    def append(self, raster_path, acquisition_date, chunk=128, capacity=52):
+        """追加一期产品；同一日期重复写入时覆盖原时间片"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with fasteners.InterProcessLock(str(self.root / '.lock')):
+            self.meta = self._read_meta()
+            if self.meta is None:
+                self._create(raster_path, chunk, capacity)
+
+            key = acquisition_date.isoformat() if isinstance(acquisition_date, date_type) \
+                else str(acquisition_date)
+            dates = self.meta['dates']
+            if key in dates:
+                t = dates.index(key)
+            else:
+                if len(dates) >= self.meta['capacity']:
+                    self._grow()
+                t = len(dates)
+
+            self._write_slice(raster_path, t)
+            if key not in dates:
+                dates.append(key)
+            self._write_meta()
+            return t
+
+    def _create(self, raster_path, chunk, capacity):
+        """以第一期产品的网格初始化立方体"""
+        ds = gdal.Open(str(raster_path))
+        if ds is None:
+            raise ValueError(f"无法打开文件: {raster_path}")
+        self.meta = {
+            'width': ds.RasterXSize,
+            'height': ds.RasterYSize,
+            'geotransform': list(ds.GetGeoTransform()),
+            'wkt': ds.GetProjection(),
+            'chunk': chunk,
+            'capacity': capacity,
+            'scale': SCALE,
+            'nodata': NODATA,
+            'dates': [],
+        }
+        ds = None
+        # w+ 创建稀疏文件，未写入的时间片不会被读取
+        data = np.memmap(self.data_path, dtype=np.int16, mode='w+', shape=self._shape())
+        data.flush()
+        del data
+        self._write_meta()
+
+    def _grow(self):
+        """时间容量翻倍，逐块拷贝到新文件后原子替换"""
+        old_capacity = self.meta['capacity']
+        new_capacity = old_capacity * 2
+        tmp_path = self.data_path.with_suffix('.tmp')
+        old = self._memmap('r')
+        new = np.memmap(tmp_path, dtype=np.int16, mode='w+', shape=self._shape(new_capacity))
+        for iy in range(old.shape[0]):
+            for ix in range(old.shape[1]):
+                new[iy, ix, :old_capacity] = old[iy, ix]
+        new.flush()
+        del old, new
+        os.replace(tmp_path, self.data_path)
+        self.meta['capacity'] = new_capacity
+        self._write_meta()
+
+    def _aligned_source(self, raster_path):
+        """网格不一致时通过VRT重采样到立方体网格"""
+        m = self.meta
+        ds = gdal.Open(str(raster_path))
+        if ds is None:
+            raise ValueError(f"无法打开文件: {raster_path}")
+        same_grid = (ds.RasterXSize == m['width'] and ds.RasterYSize == m['height']
+                     and np.allclose(ds.GetGeoTransform(), m['geotransform'])
+                     and ds.GetProjection() == m['wkt'])
+        if same_grid:
+            return ds
+
+        gt = m['geotransform']
+        bounds = (gt[0], gt[3] + gt[5] * m['height'], gt[0] + gt[1] * m['width'], gt[3])
+        return gdal.Warp('', ds, options=gdal.WarpOptions(
+            format='VRT', dstSRS=m['wkt'], outputBounds=bounds,
+            width=m['width'], height=m['height'], resampleAlg='near',
+        ))
+
+    def _write_slice(self, raster_path, t):
+        ds = self._aligned_source(raster_path)
+        band = ds.GetRasterBand(1)
+        nodata = band.GetNoDataValue()
+        data = self._memmap('r+')
+        chunk = self.meta['chunk']
+        width, height = self.meta['width'], self.meta['height']
+
+        for iy in range(data.shape[0]):
+            for ix in range(data.shape[1]):
+                xoff, yoff = ix * chunk, iy * chunk
+                w, h = min(chunk, width - xoff), min(chunk, height - yoff)
+                values = band.ReadAsArray(xoff, yoff, w, h).astype(np.float32, copy=False)
+                invalid = ~np.isfinite(values)
+                if nodata is not None and not math.isnan(nodata):
+                    invalid |= values == nodata
+                np.clip(values, -1.0, 1.0, out=values)
+                values[invalid] = 0
+                scaled = np.rint(values * SCALE).astype(np.int16)
+                scaled[invalid] = NODATA
+
+                slot = data[iy, ix, t]
+                slot[...] = NODATA
+                slot[:h, :w] = scaled
+        data.flush()
+        del data
+        ds = None
+
+    # ---------- 查询 ----------
+
+    def _to_grid(self):
+        from geodata.raster_query import wgs84
+
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(self.meta['wkt'])
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        return osr.CoordinateTransformation(wgs84(), srs)
+
+    def _series(self, values_per_slot, start=None, end=None):
+        """按日期排序并过滤，values_per_slot与dates一一对应"""
+        start, end = _date_key(start), _date_key(end)
+        items = sorted(zip(self.dates, values_per_slot))
+        return [
+            {'date': d, 'value': v} for d, v in items
+            if (start is None or d >= start) and (end is None or d <= end)
+        ]
+
+    def point_series(self, lon, lat, start=None, end=None):
+        """单点NDVI时间序列（一次连续读取）"""
+        if not self.exists or not self.dates:
+            return []
+        x, y, _ = self._to_grid().TransformPoint(float(lon), float(lat))
+        inv = gdal.InvGeoTransform(self.meta['geotransform'])
+        col, row = (int(math.floor(v)) for v in gdal.ApplyGeoTransform(inv, x, y))
+        if not (0 <= col < self.meta['width'] and 0 <= row < self.meta['height']):
+            return []
+
+        chunk = self.meta['chunk']
+        data = self._memmap('r')
+        raw = np.array(data[row // chunk, col // chunk, :len(self.dates), row % chunk, col % chunk])
+        values = [None if v == NODATA else float(v) / SCALE for v in raw]
+        return self._series(values, start, end)
+
+    def polygon_mean_series(self, geojson, start=None, end=None):
+        """多边形内NDVI均值时间序列，逐块读取相交空间块的全部历史"""
+        from geodata.raster_query import geometry_layer, to_raster_geometry, window_mask
+
+        if not self.exists or not self.dates:
+            return []
+        m = self.meta
+        geometry = to_raster_geometry(geojson, self._to_grid())
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(m['wkt'])
+        layer_ds, layer = geometry_layer(geometry, srs)
+
+        inv = gdal.InvGeoTransform(m['geotransform'])
+        minx, maxx, miny, maxy = geometry.GetEnvelope()
+        col0, row0 = (int(math.floor(v)) for v in gdal.ApplyGeoTransform(inv, minx, maxy))
+        col1, row1 = (int(math.floor(v)) for v in gdal.ApplyGeoTransform(inv, maxx, miny))
+        col0, row0 = max(col0, 0), max(row0, 0)
+        col1, row1 = min(col1, m['width'] - 1), min(row1, m['height'] - 1)
+
+        n_dates = len(self.dates)
+        sums = np.zeros(n_dates, dtype=np.int64)
+        counts = np.zeros(n_dates, dtype=np.int64)
+        if col1 >= col0 and row1 >= row0:
+            chunk = m['chunk']
+            data = self._memmap('r')
+            for iy in range(row0 // chunk, row1 // chunk + 1):
+                for ix in range(col0 // chunk, col1 // chunk + 1):
+                    xoff, yoff = ix * chunk, iy * chunk
+                    w, h = min(chunk, m['width'] - xoff), min(chunk, m['height'] - yoff)
+                    mask = window_mask(layer, m['geotransform'], m['wkt'], xoff, yoff, w, h)
+                    if not mask.any():
+                        continue
+                    values = data[iy, ix, :n_dates, :h, :w][:, mask]
+                    valid = values != NODATA
+                    sums += np.where(valid, values, 0).sum(axis=1, dtype=np.int64)
+                    counts += valid.sum(axis=1)
+
+        means = [float(s) / c / SCALE if c else None for s, c in zip(sums, counts)]
+        return self._series(means, start, end)
+
+
+def _date_key(value):
+    """日期过滤条件规范为ISO字符串；字符串须为YYYY-MM-DD，否则抛出ValueError"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, date_type):
+        return value.isoformat()
+    return datetime.strptime(value, '%Y-%m-%d').date().isoformat()
+
+
+def region_cube_dir(root, region, default_region):
+    """区域立方体目录：各区域网格不同，非默认区域写入根目录下的区域子目录"""
+    root = Path(root)
+    return root if region == default_region else root / region
+
+
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+
+def load_cube(root):
+    """按元数据修改时间缓存立方体对象，供查询接口复用"""
+    root = Path(root)
+    try:
+        mtime = (root / CUBE_META).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _cubes_lock:
+        cached = _cubes.get(root)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    cube = NDVICube(root)
+    with _cubes_lock:
+        _cubes[root] = (mtime, cube)
+    return cube
@@ -0,0 +1,146 @@
+import logging
+import threading
+
+from django.db import close_old_connections, connection
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressTracker:
+    """批量写入的运行进度
+
+    下载线程只修改内存中的计数与分块状态，由单独的刷新线程每flush_interval秒
+    合并写入一次（PipelineRun一次update，TileJob一次bulk_update），
+    下载循环不等待数据库。
+    """
+
+    def __init__(self, run, flush_interval=2.0):
+        self.run = run
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._run_fields = {}
+        self._counters = {}
+        self._tiles = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name=f"progress-{run.pk}", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def start(cls, **fields):
+        from data_pipeline.models import PipelineRun
+        return cls(PipelineRun.objects.create(**fields))
+
+    # ---------- 事件（任意线程调用，只改内存） ----------
+
+    def set_stage(self, stage):
+        with self._lock:
+            self._run_fields['stage'] = stage
+
+    def tiles_planned(self, total, skipped=()):
+        """登记本次运行的全部分块，清单中已有效的分块记为skipped"""
+        from data_pipeline.models import TileJob
+
+        skipped = set(skipped)
+        TileJob.objects.bulk_create([
+            TileJob(run=self.run, index=i,
+                    status=TileJob.STATUS_SKIPPED if i in skipped else TileJob.STATUS_PENDING)
+            for i in range(total)
+        ], ignore_conflicts=True)
+        with self._lock:
+            self._run_fields.update({
+                'tiles_total': total,
+                'tiles_done': len(skipped),
+                'download_started_at': timezone.now(),
+            })
+
+    def tile_started(self, index, attempt):
+        from data_pipeline.models import TileJob
+        self._update_tile(index, status=TileJob.STATUS_DOWNLOADING, attempts=attempt)
+
+    def tile_done(self, index, size, seconds=None):
+        from data_pipeline.models import TileJob
+        self._update_tile(index, status=TileJob.STATUS_DONE, size=size, seconds=seconds, error='')
+        self._count('tiles_done', 1)
+        self._count('bytes_downloaded', size)
+
+    def tile_failed(self, index, error):
+        from data_pipeline.models import TileJob
+        self._update_tile(index, status=TileJob.STATUS_FAILED, error=str(error)[:2000])
+        self._count('tiles_failed', 1)
+
+    def _update_tile(self, index, **fields):
+        with self._lock:
+            self._tiles.setdefault(index, {}).update(fields, updated_at=timezone.now())
+
+    def _count(self, field, amount):
+        with self._lock:
+            self._counters[field] = self._counters.get(field, 0) + amount
+
+    # ---------- 写入 ----------
+
+    def _loop(self):
+        try:
+            while not self._stop.wait(self.flush_interval):
+                self.flush()
+        finally:
+            # 刷新线程持有独立的数据库连接，退出前关闭
+            connection.close()
+
+    def flush(self):
+        from data_pipeline.models import PipelineRun, TileJob
+
+        with self._lock:
+            run_fields, self._run_fields = self._run_fields, {}
+            counters, self._counters = self._counters, {}
+            tiles, self._tiles = self._tiles, {}
+        if not (run_fields or counters or tiles):
+            return
+
+        try:
+            close_old_connections()
+            if tiles:
+                jobs = {job.index: job for job in TileJob.objects.filter(run=self.run, index__in=tiles)}
+                changed = set()
+                for index, fields in tiles.items():
+                    job = jobs.get(index)
+                    if job is None:
+                        continue
+                    for name, value in fields.items():
+                        setattr(job, name, value)
+                    changed.update(fields)
+                TileJob.objects.bulk_update(list(jobs.values()), sorted(changed))
+
+            updates = dict(run_fields)
+            for field, amount in counters.items():
+                # tiles_planned与计数在同一批时，以登记值为基数累加
+                updates[field] = updates[field] + amount if field in updates else F(field) + amount
+            updates['updated_at'] = timezone.now()
+            PipelineRun.objects.filter(pk=self.run.pk).update(**updates)
+        except Exception as e:
+            # 进度写入失败不影响管道，丢弃本批更新
+            logger.warning(f"运行进度写入失败: {str(e)}")
+
+    def finish(self, status, error='', timings=None, ndvi=None):
+        """停止刷新线程，写入剩余进度与最终状态"""
+        from data_pipeline.models import PipelineRun
+
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+        fields = {
+            'status': status,
+            'stage': '',
+            'finished_at': timezone.now(),
+            'updated_at': timezone.now(),
+            'error': str(error or '')[:5000],
+        }
+        if timings is not None:
+            fields['timings'] = timings
+        if ndvi is not None:
+            fields['ndvi'] = ndvi
+        try:
+            PipelineRun.objects.filter(pk=self.run.pk).update(**fields)
+        except Exception as e:
+            logger.warning(f"运行状态写入失败: {str(e)}")
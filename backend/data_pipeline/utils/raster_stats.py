@@ -0,0 +1,193 @@
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal
+
+# NDVI取值范围固定，直方图按0.001分箱即可满足百分位精度
+NDVI_RANGE = (-1.0, 1.0)
+NDVI_BINS = 2000
+
+
+class RasterStats:
+    """可合并的流式统计量
+
+    count/sum/min/max直接累加，方差使用Welford并行合并（Chan公式），
+    百分位数由固定分箱直方图近似，任意分块顺序合并结果一致。
+    """
+
+    def __init__(self, bins=NDVI_BINS, value_range=NDVI_RANGE):
+        self.bins = bins
+        self.value_range = value_range
+        self.count = 0
+        self.sum = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        self.below = 0  # 低于直方图范围的像元数
+        self.above = 0  # 高于直方图范围的像元数
+
+    def update(self, values):
+        """累加一批有效像元（一维数组，已剔除nodata）"""
+        n = values.size
+        if n == 0:
+            return
+
+        values = values.astype(np.float64, copy=False)
+        block_mean = float(values.mean())
+        block_m2 = float(np.square(values - block_mean).sum())
+        self._merge_moments(n, float(values.sum()), block_mean, block_m2)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        low, high = self.value_range
+        hist, _ = np.histogram(values, bins=self.bins, range=self.value_range)
+        self.histogram += hist
+        self.below += int(np.count_nonzero(values < low))
+        self.above += int(np.count_nonzero(values > high))
+
+    def merge(self, other):
+        """合并另一个分块的统计结果"""
+        if other.count == 0:
+            return self
+        if other.bins != self.bins or tuple(other.value_range) != tuple(self.value_range):
+            raise ValueError("直方图分箱不一致，无法合并")
+
+        self._merge_moments(other.count, other.sum, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.histogram += other.histogram
+        self.below += other.below
+        self.above += other.above
+        return self
+
+    def _merge_moments(self, n, total, mean, m2):
+        combined = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / combined
+        self.m2 += m2 + delta * delta * self.count * n / combined
+        self.sum += total
+        self.count = combined
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else None
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance) if self.count else None
+
+    def percentile(self, q):
+        """由直方图线性插值估算百分位数（q取0-100）"""
+        if self.count == 0:
+            return None
+
+        target = self.count * q / 100.0
+        if target <= self.below:
+            return self.min
+
+        low, high = self.value_range
+        width = (high - low) / self.bins
+        cumulative = self.below + np.cumsum(self.histogram)
+        idx = int(np.searchsorted(cumulative, target))
+        if idx >= self.bins:
+            return self.max
+
+        prev = cumulative[idx - 1] if idx > 0 else self.below
+        in_bin = self.histogram[idx]
+        fraction = (target - prev) / in_bin if in_bin else 0.0
+        value = low + (idx + fraction) * width
+        return min(max(value, self.min), self.max)
+
+    def as_dict(self, percentiles=(2, 5, 25, 50, 75, 95, 98)):
+        if self.count == 0:
+            return {'count': 0, 'min': None, 'max': None, 'mean': None,
+                    'stddev': None, 'percentiles': {}}
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'stddev': self.stddev,
+            'percentiles': {f"p{q}": self.percentile(q) for q in percentiles},
+        }
+
+
+def iter_windows(width, height, block_x, block_y, target=512):
+    """按原生块对齐生成读取窗口（xoff, yoff, xsize, ysize）
+
+    窗口边长取块大小的整数倍，条带存储（块宽等于图宽）时按行数凑够约target*target像元。
+    """
+    block_x = max(1, min(block_x, width))
+    block_y = max(1, min(block_y, height))
+    win_x = min(width, block_x * max(1, target // block_x))
+    win_y = min(height, block_y * max(1, (target * target) // (win_x * block_y)))
+
+    for yoff in range(0, height, win_y):
+        ysize = min(win_y, height - yoff)
+        for xoff in range(0, width, win_x):
+            yield xoff, yoff, min(win_x, width - xoff), ysize
+
+
+def valid_values(array, nodata=None):
+    """剔除nodata与非有限值，返回一维有效像元"""
+    if np.issubdtype(array.dtype, np.floating):
+        mask = np.isfinite(array)
+        if nodata is not None and not math.isnan(nodata):
+            mask &= array != nodata
+        return array[mask]
+    if nodata is not None:
+        return array[array != nodata]
+    return array.ravel()
+
+
+def compute_raster_stats(path, band_index=1, workers=1, target=512,
+                         bins=NDVI_BINS, value_range=NDVI_RANGE):
+    """分块流式计算整幅栅格的统计量，内存占用只与窗口大小有关
+
+    workers>1时分块交给线程池，每个线程各自打开数据集（GDAL句柄不可跨线程共享）。
+    """
+    ds = gdal.Open(str(path))
+    if ds is None:
+        raise ValueError(f"无法打开文件: {path}")
+    band = ds.GetRasterBand(band_index)
+    width, height = ds.RasterXSize, ds.RasterYSize
+    block_x, block_y = band.GetBlockSize()
+    nodata = band.GetNoDataValue()
+    windows = iter_windows(width, height, block_x, block_y, target)
+
+    if workers <= 1:
+        total = RasterStats(bins, value_range)
+        for xoff, yoff, xsize, ysize in windows:
+            array = band.ReadAsArray(xoff, yoff, xsize, ysize)
+            total.update(valid_values(array, nodata))
+        ds = None
+        return total
+    ds = None
+
+    # 线程 -> 数据集句柄，结束后统一关闭
+    handles = {}
+
+    def process(window):
+        ident = threading.get_ident()
+        if ident not in handles:
+            handles[ident] = gdal.Open(str(path))
+        partial = RasterStats(bins, value_range)
+        partial.update(valid_values(handles[ident].GetRasterBand(band_index).ReadAsArray(*window), nodata))
+        return partial
+
+    total = RasterStats(bins, value_range)
+    windows = list(windows)
+    # Executor.map会一次性提交全部任务，分批提交使排队中的部分结果不超过一批
+    batch = workers * 4
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(windows), batch):
+                for partial in executor.map(process, windows[start:start + batch]):
+                    total.merge(partial)
+    finally:
+        handles.clear()
+    return total
@@ -0,0 +1,115 @@
+from pathlib import Path
+
+import numpy as np
+from osgeo import gdal, osr
+
+from data_pipeline.utils.band_math import NDVI_NODATA
+from data_pipeline.utils.tile_manifest import TileManifest
+
+# 北京附近的EPSG:4526坐标（3度带39带，带号前缀）
+SYNTHETIC_ORIGIN = (39420000.0, 4480000.0)
+
+
+def synthetic_ndvi(width, height, xoff=0, yoff=0, seed=0, nodata_fraction=0.05, nodata=NDVI_NODATA):
+    """平滑的NDVI场 + 噪声 + 圆形云洞（nodata），相邻分块在接缝处连续"""
+    rng = np.random.default_rng(seed)
+    cols = np.arange(xoff, xoff + width, dtype=np.float32)
+    rows = np.arange(yoff, yoff + height, dtype=np.float32)[:, np.newaxis]
+    values = 0.35 + 0.3 * np.sin(cols / 700.0) * np.cos(rows / 500.0) + 0.15 * np.sin((cols + rows) / 230.0)
+    values = values.astype(np.float32)
+    values += rng.normal(0, 0.03, size=(height, width)).astype(np.float32)
+    np.clip(values, -1.0, 1.0, out=values)
+
+    # 按目标比例挖出若干圆形云洞
+    target = min(nodata_fraction, 0.9) * width * height
+    masked = 0
+    while masked < target:
+        r = rng.uniform(0.02, 0.08) * min(width, height)
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        y0, y1 = int(max(cy - r, 0)), int(min(cy + r + 1, height))
+        x0, x1 = int(max(cx - r, 0)), int(min(cx + r + 1, width))
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        hole = (xx - cx) ** 2 + (yy - cy) ** 2 <= r * r
+        window = values[y0:y1, x0:x1]
+        masked += int((hole & (window != nodata)).sum())
+        window[hole] = nodata
+    return values
+
+
+def make_tile_set(root, n_tiles, tile_size=1024, cols=6, resolution=10, overlap=0,
+                  seed=0, nodata_fraction=0.05, crs='EPSG:4526', creation_options=None):
+    """生成与下载分块同布局的合成NDVI分块集（tile_N.tif + manifest.json）
+
+    分块按每行cols个排列，overlap为相邻分块重叠的像元数。
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    options = creation_options or ['COMPRESS=DEFLATE', 'PREDICTOR=3']
+    driver = gdal.GetDriverByName('GTiff')
+    manifest = TileManifest(root)
+    step = tile_size - overlap
+
+    for index in range(n_tiles):
+        row, col = divmod(index, cols)
+        xoff, yoff = col * step, row * step
+        gt = (SYNTHETIC_ORIGIN[0] + xoff * resolution, resolution, 0.0,
+              SYNTHETIC_ORIGIN[1] - yoff * resolution, 0.0, -resolution)
+        path = manifest.tile_path(index)
+        ds = driver.Create(str(path), tile_size, tile_size, 1, gdal.GDT_Float32, options=options)
+        ds.SetGeoTransform(gt)
+        ds.SetProjection(srs.ExportToWkt())
+        band = ds.GetRasterBand(1)
+        band.SetNoDataValue(NDVI_NODATA)
+        band.WriteArray(synthetic_ndvi(tile_size, tile_size, xoff, yoff, seed + index, nodata_fraction))
+        ds = None
+
+        minx, maxy = gt[0], gt[3]
+        maxx, miny = minx + tile_size * resolution, maxy - tile_size * resolution
+        region = {'type': 'Polygon', 'crs': crs,
+                  'coordinates': [[[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]]]}
+        manifest.mark_done(index, region, path)
+
+    manifest.save()
+    return manifest.done_paths()
+
+
+def make_band_pair(root, width, height, seed=0, nodata_fraction=0.05, nodata=0,
+                   zero_fraction=0.0, data_type=gdal.GDT_UInt16, crs='EPSG:4526', resolution=10):
+    """生成与合成NDVI场一致的B04/B08反射率波段（L2A量纲，0~10000）
+
+    云洞处两个波段都写为nodata；zero_fraction为额外置零（red=nir=0，分母为0）的像元比例，
+    nodata不为0时这些像元是有效像元。返回(B04路径, B08路径)。
+    """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    ndvi = synthetic_ndvi(width, height, seed=seed, nodata_fraction=nodata_fraction)
+    holes = ndvi == NDVI_NODATA
+    ndvi = np.clip(np.where(holes, 0.0, ndvi), -0.95, 0.95)
+    nir = rng.uniform(1500, 4500, size=(height, width)).astype(np.float32)
+    red = np.clip(nir * (1 - ndvi) / (1 + ndvi), 1, 10000)
+    zeros = rng.random((height, width)) < zero_fraction
+    red[zeros] = 0
+    nir[zeros] = 0
+    red[holes] = nodata
+    nir[holes] = nodata
+
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    gt = (SYNTHETIC_ORIGIN[0], resolution, 0.0, SYNTHETIC_ORIGIN[1], 0.0, -resolution)
+    driver = gdal.GetDriverByName('GTiff')
+    paths = []
+    for name, values in (('B04', red), ('B08', nir)):
+        path = root / f"{name}.tif"
+        ds = driver.Create(str(path), width, height, 1, data_type,
+                           options=['TILED=YES', 'COMPRESS=DEFLATE'])
+        ds.SetGeoTransform(gt)
+        ds.SetProjection(srs.ExportToWkt())
+        band = ds.GetRasterBand(1)
+        band.SetNoDataValue(nodata)
+        band.WriteArray(np.rint(values) if data_type != gdal.GDT_Float32 else values)
+        ds = None
+        paths.append(path)
+    return tuple(paths)
@@ -0,0 +1,13 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+
+class TempDirMixin:
+    """测试用临时目录（self.tmp），测试结束后删除"""
+    tmp_prefix = 'ndvi_test_'
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = Path(tempfile.mkdtemp(prefix=self.tmp_prefix))
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
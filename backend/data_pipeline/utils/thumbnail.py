@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+from osgeo import gdal
+from PIL import Image
+
+
+def thumbnail_shape(width, height, max_size):
+    """按长边缩放到max_size，保持宽高比"""
+    scale = min(1.0, max_size / max(width, height))
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def read_decimated(path, max_size, band_index=1):
+    """按缩略图尺寸抽稀读取，存在概视图时GDAL会自动从概视图读取
+
+    返回 (float32数组, 有效像元掩膜)，内存只与输出尺寸有关。
+    """
+    ds = gdal.Open(str(path))
+    if ds is None:
+        raise ValueError(f"无法打开文件: {path}")
+    band = ds.GetRasterBand(band_index)
+    out_x, out_y = thumbnail_shape(ds.RasterXSize, ds.RasterYSize, max_size)
+
+    array = band.ReadAsArray(
+        0, 0, ds.RasterXSize, ds.RasterYSize,
+        buf_xsize=out_x, buf_ysize=out_y,
+        resample_alg=gdal.GRIORA_Average,
+    ).astype(np.float32, copy=False)
+
+    valid = np.isfinite(array)
+    nodata = band.GetNoDataValue()
+    if nodata is not None and not math.isnan(nodata):
+        valid &= array != nodata
+    ds = None
+    return array, valid
+
+
+def percentile_stretch(array, valid, low=2, high=98):
+    """忽略nodata的百分位拉伸，返回uint8灰度与alpha通道"""
+    gray = np.zeros(array.shape, dtype=np.uint8)
+    alpha = np.where(valid, 255, 0).astype(np.uint8)
+    if not valid.any():
+        return gray, alpha
+
+    vmin, vmax = np.percentile(array[valid], [low, high])
+    if vmax <= vmin:
+        vmax = vmin + 1e-6
+
+    np.subtract(array, vmin, out=array)
+    np.multiply(array, 255.0 / (vmax - vmin), out=array)
+    np.clip(array, 0, 255, out=array)
+    gray[valid] = array[valid].astype(np.uint8)
+    return gray, alpha
+
+
+def generate_thumbnails(tif_path, outputs, low=2, high=98):
+    """一次读取生成多种尺寸的缩略图
+
+    outputs: {长边像素: 输出路径}，按最大尺寸抽稀读取一次，较小尺寸由其缩小得到。
+    """
+    sizes = sorted(outputs, reverse=True)
+    array, valid = read_decimated(tif_path, sizes[0])
+    gray, alpha = percentile_stretch(array, valid, low, high)
+    del array
+
+    image = Image.merge('LA', (Image.fromarray(gray), Image.fromarray(alpha)))
+    for size in sizes:
+        thumb = image.copy()
+        thumb.thumbnail((size, size))
+        thumb.save(outputs[size])
+    return outputs
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+MANIFEST_NAME = 'manifest.json'
+
+STATUS_PENDING = 'pending'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    """分块计算文件sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TileManifest:
+    """分块下载清单（与metadata.json同目录）
+
+    每个分块记录 index / filename / region / size / checksum / status，
+    重新运行时已完成且校验一致的分块会被跳过。
+    """
+
+    def __init__(self, output_path, tiles=None, created_at=None):
+        self.output_path = Path(output_path)
+        self.path = self.output_path / MANIFEST_NAME
+        self.tiles = tiles or {}
+        self.created_at = created_at or datetime.now().isoformat()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, output_path):
+        """读取清单，不存在或损坏时返回空清单"""
+        path = Path(output_path) / MANIFEST_NAME
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            tiles = {int(t['index']): t for t in data.get('tiles', [])}
+            return cls(output_path, tiles=tiles, created_at=data.get('created_at'))
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return cls(output_path)
+
+    def save(self):
+        """原子写入清单，避免中途崩溃留下半个文件"""
+        with self._lock:
+            data = {
+                'created_at': self.created_at,
+                'updated_at': datetime.now().isoformat(),
+                'tiles': [self.tiles[i] for i in sorted(self.tiles)],
+            }
+            tmp_path = self.path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def tile_path(self, index):
+        return self.output_path / f"tile_{index + 1}.tif"
+
+    def done_entry(self, index, region=None):
+        """已完成且网格几何一致的清单条目，否则返回None"""
+        entry = self.tiles.get(index)
+        if not entry or entry.get('status') != STATUS_DONE:
+            return None
+        if region is not None and entry.get('region') != region:
+            return None
+        return entry
+
+    def is_valid(self, index, region=None):
+        """分块是否已完成且文件大小、校验和与清单一致"""
+        entry = self.done_entry(index, region)
+        if entry is None:
+            return False
+
+        path = self.output_path / entry['filename']
+        try:
+            if path.stat().st_size != entry.get('size'):
+                return False
+        except FileNotFoundError:
+            return False
+        return file_checksum(path) == entry.get('checksum')
+
+    def mark_done(self, index, region, path):
+        path = Path(path)
+        self._update(index, {
+            'index': index,
+            'filename': path.name,
+            'region': region,
+            'size': path.stat().st_size,
+            'checksum': file_checksum(path),
+            'status': STATUS_DONE,
+            'updated_at': datetime.now().isoformat(),
+        })
+
+    def mark_failed(self, index, region, error):
+        self._update(index, {
+            'index': index,
+            'filename': self.tile_path(index).name,
+            'region': region,
+            'size': None,
+            'checksum': None,
+            'status': STATUS_FAILED,
+            'error': str(error),
+            'updated_at': datetime.now().isoformat(),
+        })
+
+    def _update(self, index, entry):
+        with self._lock:
+            self.tiles[index] = entry
+
+    def prune(self, expected):
+        """移除超出当前网格的旧分块记录及文件"""
+        with self._lock:
+            stale = [i for i in self.tiles if i >= expected]
+            for i in stale:
+                entry = self.tiles.pop(i)
+                (self.output_path / entry['filename']).unlink(missing_ok=True)
+        return stale
+
+    def done_paths(self):
+        """按分块序号返回已完成的分块路径"""
+        return [
+            self.output_path / self.tiles[i]['filename']
+            for i in sorted(self.tiles)
+            if self.tiles[i].get('status') == STATUS_DONE
+        ]
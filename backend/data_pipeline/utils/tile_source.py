@@ -0,0 +1,66 @@
+import shutil
+import time
+from pathlib import Path
+
+
+class TileSource:
+    """分块数据源接口
+
+    download() 负责把第index个分块（region为GeoJSON几何）写入dest_path，
+    失败时直接抛出异常，由调用方负责重试。
+    """
+    name = 'base'
+
+    def download(self, index, region, dest_path):
+        raise NotImplementedError
+
+
+class EarthEngineTileSource(TileSource):
+    """通过geemap从Earth Engine下载分块"""
+    name = 'gee'
+
+    def __init__(self, image, scale=10, crs='EPSG:4526'):
+        self.image = image
+        self.scale = scale
+        self.crs = crs
+
+    def download(self, index, region, dest_path):
+        import ee
+        import geemap
+
+        geometry = ee.Geometry(region)
+        geemap.download_ee_image(
+            image=self.image.clip(geometry),
+            filename=str(dest_path),
+            scale=self.scale,
+            crs=self.crs,
+            region=geometry,
+        )
+
+
+class LocalTileSource(TileSource):
+    """本地假数据源（测试/基准用）
+
+    从source_dir复制tile_{index+1}.tif，可模拟网络延迟和前fail_times次失败。
+    """
+    name = 'local'
+
+    def __init__(self, source_dir, delay=0.0, fail_times=0):
+        self.source_dir = Path(source_dir)
+        self.delay = delay
+        self.fail_times = fail_times
+        self._attempts = {}
+
+    def download(self, index, region, dest_path):
+        attempts = self._attempts.get(index, 0) + 1
+        self._attempts[index] = attempts
+
+        if self.delay:
+            time.sleep(self.delay)
+        if attempts <= self.fail_times:
+            raise ConnectionError(f"模拟下载失败: 分块 {index + 1} 第{attempts}次")
+
+        src = self.source_dir / f"tile_{index + 1}.tif"
+        if not src.exists():
+            raise FileNotFoundError(f"本地分块不存在: {src}")
+        shutil.copyfile(src, dest_path)
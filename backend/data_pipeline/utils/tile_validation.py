@@ -0,0 +1,233 @@
+import math
+import multiprocessing
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal
+
+from data_pipeline.utils.raster_stats import NDVI_RANGE
+from data_pipeline.utils.tile_manifest import file_checksum
+
+# TIFF标签
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_SAMPLES_PER_PIXEL = 277
+TAG_ROWS_PER_STRIP = 278
+TAG_STRIP_OFFSETS = 273
+TAG_STRIP_BYTE_COUNTS = 279
+TAG_PLANAR_CONFIG = 284
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+
+# 字段类型 -> (numpy类型码, 字节数)
+TIFF_TYPES = {
+    1: ('u1', 1), 2: ('u1', 1), 3: ('u2', 2), 4: ('u4', 4), 5: ('u4', 8), 6: ('i1', 1),
+    7: ('u1', 1), 8: ('i2', 2), 9: ('i4', 4), 10: ('i4', 8), 11: ('f4', 4), 12: ('f8', 8),
+    16: ('u8', 8), 17: ('i8', 8), 18: ('u8', 8),
+}
+
+
+class TileValidationError(ValueError):
+    """分块文件结构或内容不合法"""
+
+
+def read_tiff_layout(path):
+    """解析TIFF/BigTIFF头与第一个IFD，校验块（tile/strip）偏移与长度都落在文件内
+
+    只读文件头和偏移表，不解码像元，返回宽高与块布局。
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.read(16)
+        if len(header) < 8:
+            raise TileValidationError("文件过小")
+        if header[:2] == b'II':
+            endian = '<'
+        elif header[:2] == b'MM':
+            endian = '>'
+        else:
+            raise TileValidationError("不是TIFF文件")
+
+        version = struct.unpack(endian + 'H', header[2:4])[0]
+        if version == 42:
+            big = False
+            ifd_offset = struct.unpack(endian + 'I', header[4:8])[0]
+        elif version == 43:
+            big = True
+            ifd_offset = struct.unpack(endian + 'Q', header[8:16])[0]
+        else:
+            raise TileValidationError(f"未知TIFF版本: {version}")
+
+        count_size, entry_size, inline_size = (8, 20, 8) if big else (2, 12, 4)
+        if not (8 <= ifd_offset < size - count_size):
+            raise TileValidationError("IFD偏移超出文件范围")
+        f.seek(ifd_offset)
+        n_entries = struct.unpack(endian + ('Q' if big else 'H'), f.read(count_size))[0]
+        raw = f.read(n_entries * entry_size)
+        if len(raw) < n_entries * entry_size:
+            raise TileValidationError("IFD被截断")
+
+        tags = {}
+        for i in range(n_entries):
+            entry = raw[i * entry_size:(i + 1) * entry_size]
+            if big:
+                tag, typ, count = struct.unpack(endian + 'HHQ', entry[:12])
+                value = entry[12:20]
+            else:
+                tag, typ, count = struct.unpack(endian + 'HHI', entry[:8])
+                value = entry[8:12]
+            if typ not in TIFF_TYPES:
+                continue
+            code, width = TIFF_TYPES[typ]
+            nbytes = count * width
+            if nbytes <= inline_size:
+                data = value[:nbytes]
+            else:
+                offset = struct.unpack(endian + ('Q' if big else 'I'), value)[0]
+                if offset + nbytes > size:
+                    raise TileValidationError(f"标签{tag}的数据超出文件范围")
+                f.seek(offset)
+                data = f.read(nbytes)
+            tags[tag] = np.frombuffer(data, dtype=endian + code)
+
+    def scalar(tag, default=None):
+        values = tags.get(tag)
+        return int(values[0]) if values is not None and values.size else default
+
+    width, height = scalar(TAG_IMAGE_WIDTH), scalar(TAG_IMAGE_LENGTH)
+    if not width or not height:
+        raise TileValidationError("缺少图像尺寸")
+    planes = scalar(TAG_SAMPLES_PER_PIXEL, 1) if scalar(TAG_PLANAR_CONFIG, 1) == 2 else 1
+
+    if TAG_TILE_OFFSETS in tags:
+        block_x, block_y = scalar(TAG_TILE_WIDTH), scalar(TAG_TILE_LENGTH)
+        if not block_x or not block_y:
+            raise TileValidationError("缺少块尺寸")
+        offsets, counts = tags[TAG_TILE_OFFSETS], tags.get(TAG_TILE_BYTE_COUNTS)
+        expected = math.ceil(width / block_x) * math.ceil(height / block_y) * planes
+    else:
+        rows = min(scalar(TAG_ROWS_PER_STRIP, height), height)
+        block_x, block_y = width, rows
+        offsets, counts = tags.get(TAG_STRIP_OFFSETS), tags.get(TAG_STRIP_BYTE_COUNTS)
+        if offsets is None:
+            raise TileValidationError("缺少块偏移表")
+        expected = math.ceil(height / rows) * planes
+
+    if counts is None or offsets.size != counts.size:
+        raise TileValidationError("块偏移表与长度表不一致")
+    if offsets.size != expected:
+        raise TileValidationError(f"块数量不符: {offsets.size} != {expected}")
+
+    offsets = offsets.astype(np.uint64)
+    counts = counts.astype(np.uint64)
+    # 稀疏文件允许偏移与长度同时为0（整块为nodata）
+    present = counts > 0
+    if np.any(offsets[present] < 8) or np.any(offsets[present] + counts[present] > size):
+        raise TileValidationError("块数据超出文件范围（文件被截断）")
+
+    return {
+        'width': width,
+        'height': height,
+        'block_x': block_x,
+        'block_y': block_y,
+        'blocks': int(offsets.size),
+        'bigtiff': big,
+        'size': size,
+    }
+
+
+def sample_blocks(path, layout, samples=4, value_range=NDVI_RANGE, tolerance=1e-3):
+    """解码首块、末块与若干均匀分布的块，检查能否读取及有效值范围"""
+    ds = gdal.Open(str(path))
+    if ds is None:
+        raise TileValidationError("GDAL无法打开")
+    band = ds.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    block_x, block_y = band.GetBlockSize()
+    nbx = math.ceil(ds.RasterXSize / block_x)
+    nby = math.ceil(ds.RasterYSize / block_y)
+    total = nbx * nby
+    picks = sorted({0, total - 1, *np.linspace(0, total - 1, max(samples, 2), dtype=int).tolist()})
+
+    for block in picks:
+        by, bx = divmod(block, nbx)
+        xoff, yoff = bx * block_x, by * block_y
+        w, h = min(block_x, ds.RasterXSize - xoff), min(block_y, ds.RasterYSize - yoff)
+        try:
+            values = band.ReadAsArray(xoff, yoff, w, h)
+        except RuntimeError as e:
+            raise TileValidationError(f"块({bx},{by})解码失败: {str(e)}")
+        if values is None:
+            raise TileValidationError(f"块({bx},{by})解码失败")
+        if value_range is not None and np.issubdtype(values.dtype, np.floating):
+            valid = np.isfinite(values)
+            if nodata is not None and not math.isnan(nodata):
+                valid &= values != nodata
+            if valid.any():
+                low, high = float(values[valid].min()), float(values[valid].max())
+                if low < value_range[0] - tolerance or high > value_range[1] + tolerance:
+                    raise TileValidationError(f"块({bx},{by})值超出范围: [{low:.3f}, {high:.3f}]")
+    ds = None
+    return len(picks)
+
+
+def validate_tile(path, expected=None, samples=4, value_range=NDVI_RANGE):
+    """单个分块校验：TIFF结构 -> 清单大小/校验和（如提供）-> 抽样解码
+
+    不计算整幅统计量，也不写.aux.xml等附属文件。返回结果字典，不抛出异常。
+    """
+    # 只读校验不应在数据目录留下PAM附属文件
+    gdal.SetThreadLocalConfigOption('GDAL_PAM_ENABLED', 'NO')
+    path = str(path)
+    start = time.monotonic()
+    result = {'path': path, 'ok': False, 'error': None}
+    try:
+        layout = read_tiff_layout(path)
+        result.update(layout)
+        if expected:
+            if expected.get('size') is not None and layout['size'] != expected['size']:
+                raise TileValidationError(f"文件大小与清单不符: {layout['size']} != {expected['size']}")
+            if expected.get('checksum') and file_checksum(path) != expected['checksum']:
+                raise TileValidationError("校验和与清单不符")
+        result['sampled'] = sample_blocks(path, layout, samples, value_range)
+        result['ok'] = True
+    except (TileValidationError, OSError) as e:
+        result['error'] = str(e)
+    finally:
+        gdal.SetThreadLocalConfigOption('GDAL_PAM_ENABLED', None)
+        result['seconds'] = round(time.monotonic() - start, 4)
+    return result
+
+
+def _init_worker():
+    gdal.SetConfigOption('GDAL_PAM_ENABLED', 'NO')
+
+
+def _validate_item(item):
+    path, expected, samples = item
+    return validate_tile(path, expected, samples)
+
+
+def validate_tiles(items, workers=None, samples=4):
+    """并行校验多个分块，items为[(路径, 清单条目或None)]，结果顺序与输入一致
+
+    结构解析与sha256都是CPU/IO密集的纯本地操作，使用进程池避开GIL；
+    在守护进程（Celery prefork worker）中不能创建子进程，改用线程池
+    （sha256与GDAL解码都会释放GIL）。
+    """
+    items = [(str(path), dict(expected) if expected else None, samples) for path, expected in items]
+    if not items:
+        return []
+    workers = min(workers or os.cpu_count() or 1, len(items))
+    if workers <= 1:
+        return [_validate_item(item) for item in items]
+    if multiprocessing.current_process().daemon:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_validate_item, items))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        return list(executor.map(_validate_item, items))
@@ -0,0 +1,124 @@
+import json
+import time
+
+from django.db import close_old_connections
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from data_pipeline.models import PipelineRun
+from data_pipeline.utils.metrics import render_prometheus
+
+# SSE轮询间隔、心跳间隔与单个连接的最长时长（秒）
+# 连接到时后由EventSource带Last-Event-ID自动重连，避免长期占用同步worker线程
+SSE_POLL_INTERVAL = 1.0
+SSE_KEEPALIVE = 15.0
+SSE_MAX_DURATION = 45
+
+
+class PipelineMetricsAPI(APIView):
+    """管道运行指标（Prometheus文本格式）"""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            body = render_prometheus()
+        except Exception as e:
+            return HttpResponse(f"# 指标读取失败: {str(e)}\n", status=503,
+                                content_type='text/plain; charset=utf-8')
+        return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class PipelineRunListAPI(APIView):
+    """最近的管道运行"""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'limit必须为整数'}, status=400)
+        runs = PipelineRun.objects.all()
+        status = request.query_params.get('status')
+        if status:
+            runs = runs.filter(status=status)
+        return Response([run.progress() for run in runs[:limit]])
+
+
+class PipelineRunDetailAPI(APIView):
+    """单次运行的进度与各分块作业状态"""
+    permission_classes = [AllowAny]
+
+    def get(self, request, pk):
+        try:
+            run = PipelineRun.objects.get(pk=pk)
+        except PipelineRun.DoesNotExist:
+            return Response({'error': '运行记录不存在'}, status=404)
+        tiles = list(run.tile_jobs.values('index', 'status', 'attempts', 'size', 'seconds', 'error'))
+        return Response({**run.progress(), 'timings': run.timings, 'tiles': tiles})
+
+
+class EventStreamRenderer(BaseRenderer):
+    """让EventSource的Accept: text/event-stream通过内容协商（流本身由视图直接生成）"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+def _sse(event, data, event_id=None):
+    prefix = f"id: {event_id}\n" if event_id else ''
+    return f"{prefix}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class PipelineRunEventsAPI(APIView):
+    """运行进度的Server-Sent Events流：进度变化时推送，运行结束后发送end并关闭
+
+    单个连接最长SSE_MAX_DURATION秒，事件id为运行的更新时间，
+    重连时根据Last-Event-ID跳过未变化的进度。
+    """
+    permission_classes = [AllowAny]
+    renderer_classes = [EventStreamRenderer, JSONRenderer]
+
+    def get(self, request, pk):
+        if not PipelineRun.objects.filter(pk=pk).exists():
+            return Response({'error': '运行记录不存在'}, status=404)
+        last_event_id = request.headers.get('Last-Event-ID') or None
+
+        def stream():
+            started = last_sent = time.monotonic()
+            last_updated = last_event_id
+            # 断线重连时提示客户端的重试间隔（毫秒）
+            yield "retry: 3000\n\n"
+            try:
+                while time.monotonic() - started < SSE_MAX_DURATION:
+                    run = PipelineRun.objects.filter(pk=pk).first()
+                    if run is None:
+                        yield _sse('end', {'id': pk, 'status': 'deleted'})
+                        return
+                    updated = run.updated_at.isoformat() if run.updated_at else None
+                    if updated != last_updated:
+                        last_updated = updated
+                        last_sent = time.monotonic()
+                        yield _sse('progress', run.progress(), updated)
+                    if run.finished:
+                        yield _sse('end', run.progress(), updated)
+                        return
+                    if time.monotonic() - last_sent >= SSE_KEEPALIVE:
+                        last_sent = time.monotonic()
+                        yield ": keepalive\n\n"
+                    # 轮询间隙归还数据库连接
+                    close_old_connections()
+                    time.sleep(SSE_POLL_INTERVAL)
+            finally:
+                close_old_connections()
+
+        response = StreamingHttpResponse(stream(), content_type='text/event-stream; charset=utf-8')
+        response['Cache-Control'] = 'no-cache'
+        # 关闭反向代理缓冲，保证事件即时送达
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class GeodataConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "geodata"
+
+    def ready(self):
+        from geodata import signals  # noqa: F401
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import uuid
+import zipfile
+from pathlib import Path
+
+from django.conf import settings
+
+# 已压缩的栅格/图片再deflate几乎没有收益，直接STORED
+STORED_SUFFIXES = {'.tif', '.tiff', '.png', '.jpg', '.zip'}
+CHUNK_SIZE = 1024 * 1024
+
+
+def archive_cache_dir():
+    path = Path(getattr(settings, 'NDVI_ARCHIVE_CACHE_DIR',
+                        Path(settings.BASE_DIR) / 'data_pipeline' / 'cache' / 'archives'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def archive_members(ndvi_data, bbox=None):
+    """压缩包内容，返回[(路径, 包内名称)]
+
+    默认为全部分块 + 合并产品 + metadata.json；指定bbox时只打包与之相交的分块。
+    文件列表来自分块索引，不扫描目录。
+    """
+    if bbox is not None:
+        paths = [tile.get_absolute_path() for tile in ndvi_data.tiles.intersecting(bbox)]
+    else:
+        paths = list(ndvi_data.get_tile_paths())
+        product = ndvi_data.get_product_path()
+        if product is not None:
+            paths.append(product)
+    members = [(path, path.name) for path in paths]
+    metadata_file = ndvi_data.get_absolute_path() / 'metadata.json'
+    if metadata_file.exists():
+        members.append((metadata_file, 'metadata.json'))
+    return members
+
+
+def archive_version(members):
+    """由文件名、大小、修改时间生成版本号，同时作为ETag"""
+    digest = hashlib.sha1()
+    for path, arcname in members:
+        stat = path.stat()
+        digest.update(f"{arcname}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:20]
+
+
+def cached_archive_path(ndvi_data, version):
+    return archive_cache_dir() / f"ndvi_{ndvi_data.pk}_{version}.zip"
+
+
+class _StreamWriter:
+    """只追加的内存缓冲，供zipfile以不可seek模式写入"""
+
+    def __init__(self, tee=None):
+        self._chunks = []
+        self._position = 0
+        self._tee = tee
+
+    def write(self, data):
+        if data:
+            self._chunks.append(bytes(data))
+            self._position += len(data)
+            if self._tee is not None:
+                self._tee.write(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_archive(members, cache_path=None, chunk_size=CHUNK_SIZE):
+    """边压缩边输出的ZIP生成器，内存只占一个读取块
+
+    指定cache_path时同步写入临时文件，完整生成后原子替换为缓存；
+    客户端中途断开（生成器被关闭）则丢弃临时文件。
+    """
+    tmp_path = None
+    tee = None
+    if cache_path is not None:
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex}.tmp")
+        tee = open(tmp_path, 'wb')
+
+    completed = False
+    try:
+        writer = _StreamWriter(tee)
+        with zipfile.ZipFile(writer, 'w', allowZip64=True) as zf:
+            for path, arcname in members:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                info.compress_type = (zipfile.ZIP_STORED if path.suffix.lower() in STORED_SUFFIXES
+                                      else zipfile.ZIP_DEFLATED)
+                with open(path, 'rb') as src, zf.open(info, 'w') as dest:
+                    for chunk in iter(lambda: src.read(chunk_size), b''):
+                        dest.write(chunk)
+                        data = writer.drain()
+                        if data:
+                            yield data
+                data = writer.drain()
+                if data:
+                    yield data
+        data = writer.drain()
+        if data:
+            yield data
+        completed = True
+    finally:
+        if tee is not None:
+            tee.close()
+            if completed:
+                os.replace(tmp_path, cache_path)
+                _remove_stale_versions(cache_path)
+            else:
+                tmp_path.unlink(missing_ok=True)
+
+
+def build_archive(members, cache_path):
+    """完整生成缓存压缩包（Range请求需要已知长度的文件）"""
+    for _ in stream_archive(members, cache_path):
+        pass
+    return cache_path
+
+
+def _remove_stale_versions(cache_path):
+    """同一产品只保留最新版本的缓存"""
+    prefix = cache_path.name.rsplit('_', 1)[0] + '_'
+    for old in cache_path.parent.glob(f"{prefix}*.zip"):
+        if old != cache_path:
+            old.unlink(missing_ok=True)
+
+
+def iter_file_range(path, start, length, chunk_size=CHUNK_SIZE):
+    """按字节区间读取文件"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """解析单段 Range: bytes=start-end，返回(start, end)闭区间
+
+    缺失或无法解析时返回None（按完整响应处理），越界时抛出RangeNotSatisfiable。
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec or '-' not in spec:
+        return None
+    start_s, end_s = spec.split('-', 1)
+    try:
+        if start_s == '':
+            # bytes=-N 表示最后N个字节
+            length = int(end_s)
+            if length <= 0:
+                raise RangeNotSatisfiable(header)
+            return max(0, size - length), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
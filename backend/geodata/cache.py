@@ -0,0 +1,40 @@
+import logging
+import uuid
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+LIST_VERSION_KEY = 'ndvi_list_version'
+LIST_CACHE_TIMEOUT = 300
+
+
+def list_cache_version():
+    """列表缓存版本号，NDVIData变化时更换，旧页面缓存随之失效"""
+    try:
+        return cache.get_or_set(LIST_VERSION_KEY, '0', timeout=None)
+    except Exception as e:
+        logger.warning(f"读取列表缓存版本失败: {str(e)}")
+        return None
+
+
+def bump_list_cache_version():
+    try:
+        cache.set(LIST_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    except Exception as e:
+        logger.warning(f"更新列表缓存版本失败: {str(e)}")
+
+
+def get_cached(key):
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.warning(f"读取列表缓存失败: {str(e)}")
+        return None
+
+
+def set_cached(key, value, timeout=LIST_CACHE_TIMEOUT):
+    try:
+        cache.set(key, value, timeout=timeout)
+    except Exception as e:
+        logger.warning(f"写入列表缓存失败: {str(e)}")
@@ -0,0 +1,66 @@
+# Generated by Django 4.2 on 2026-10-18 10:00
+
+import django.contrib.gis.db.models.fields
+import django.core.validators
+from django.db import migrations, models
+
+
+def create_ndvidata(apps, schema_editor):
+    """已部署的库中该表可能已由启动脚本的makemigrations创建：表不存在时建表，否则只补缺失的索引
+
+    若部署目录中残留本地生成的geodata迁移文件，需先删除，避免与本迁移形成多个叶子节点。
+    """
+    model = apps.get_model('geodata', 'NDVIData')
+    connection = schema_editor.connection
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if table not in connection.introspection.table_names(cursor):
+            schema_editor.create_model(model)
+            return
+        existing = connection.introspection.get_constraints(cursor, table)
+    for index in model._meta.indexes:
+        if index.name not in existing:
+            schema_editor.add_index(model, index)
+
+
+def drop_ndvidata(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model('geodata', 'NDVIData'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geodata', '0001_initial'),
+    ]
+
+    operations = [
+        # 只更新迁移状态，实际建表由create_ndvidata按现有库结构决定
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='NDVIData',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('name', models.CharField(help_text='数据标识，如beijing_ndvi_20240101', max_length=100, unique=True)),
+                        ('acquisition_date', models.DateField(help_text='数据采集日期')),
+                        ('processing_date', models.DateTimeField(auto_now_add=True, help_text='数据处理时间')),
+                        ('resolution', models.FloatField(default=10.0, help_text='分辨率(米)')),
+                        ('data_dir', models.CharField(help_text='数据存储目录(相对路径)', max_length=255)),
+                        ('min_value', models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-1.0), django.core.validators.MaxValueValidator(1.0)])),
+                        ('max_value', models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-1.0), django.core.validators.MaxValueValidator(1.0)])),
+                        ('mean_value', models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-1.0), django.core.validators.MaxValueValidator(1.0)])),
+                        ('coverage', django.contrib.gis.db.models.fields.PolygonField(help_text='数据覆盖范围', srid=4326)),
+                        ('thumbnail', models.ImageField(blank=True, help_text='缩略图预览', null=True, upload_to='ndvi_thumbnails/')),
+                        ('metadata', models.JSONField(default=dict, help_text='原始元数据')),
+                    ],
+                    options={
+                        'verbose_name': 'NDVI数据',
+                        'verbose_name_plural': 'NDVI数据',
+                        'ordering': ['-acquisition_date'],
+                        'indexes': [models.Index(fields=['-acquisition_date', '-id'], name='ndvi_date_id_idx')],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_ndvidata, drop_ndvidata),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 10:30
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geodata', '0002_ndvidata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NDVITile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(help_text='分块序号（从0开始）')),
+                ('path', models.CharField(help_text='分块文件路径(相对路径)', max_length=255)),
+                ('footprint', django.contrib.gis.db.models.fields.PolygonField(help_text='分块覆盖范围', srid=4326)),
+                ('size', models.BigIntegerField(help_text='文件大小(字节)')),
+                ('checksum', models.CharField(help_text='文件sha256', max_length=64)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('block_x', models.PositiveIntegerField(help_text='内部块宽')),
+                ('block_y', models.PositiveIntegerField(help_text='内部块高')),
+                ('ndvi', models.ForeignKey(help_text='所属NDVI产品', on_delete=django.db.models.deletion.CASCADE, related_name='tiles', to='geodata.ndvidata')),
+            ],
+            options={
+                'verbose_name': 'NDVI分块',
+                'verbose_name_plural': 'NDVI分块',
+                'ordering': ['ndvi_id', 'index'],
+                'constraints': [models.UniqueConstraint(fields=('ndvi', 'index'), name='ndvi_tile_unique_index')],
+            },
+        ),
+    ]
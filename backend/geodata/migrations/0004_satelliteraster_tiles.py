@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geodata', '0003_ndvitile'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='satelliteraster',
+            options={'verbose_name': '卫星栅格分块', 'verbose_name_plural': '卫星栅格分块'},
+        ),
+        migrations.AddField(
+            model_name='satelliteraster',
+            name='ndvi',
+            field=models.ForeignKey(blank=True, help_text='来源NDVI产品', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rasters', to='geodata.ndvidata'),
+        ),
+        migrations.AddField(
+            model_name='satelliteraster',
+            name='tile_x',
+            field=models.PositiveIntegerField(default=0, help_text='分块列号'),
+        ),
+        migrations.AddField(
+            model_name='satelliteraster',
+            name='tile_y',
+            field=models.PositiveIntegerField(default=0, help_text='分块行号'),
+        ),
+        migrations.AddField(
+            model_name='satelliteraster',
+            name='overview',
+            field=models.PositiveSmallIntegerField(default=1, help_text='概视图抽稀倍数（1为原始分辨率）'),
+        ),
+        migrations.AddIndex(
+            model_name='satelliteraster',
+            index=models.Index(fields=['ndvi', 'overview'], name='satellite_raster_ndvi_idx'),
+        ),
+    ]
@@ -1,7 +1,9 @@
 # models.py
+import math
 from pathlib import Path
 
 from django.contrib.gis.db import models
+from django.contrib.gis.geos import Polygon
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 class NDVIData(models.Model):
@@ -45,6 +47,7 @@ class NDVIData(models.Model):
     )
     coverage = models.PolygonField(
         srid=4326,
+        spatial_index=True,  # GiST索引，供bbox过滤使用
         help_text="数据覆盖范围"
     )
     thumbnail = models.ImageField(
@@ -62,6 +65,10 @@ class NDVIData(models.Model):
         verbose_name = "NDVI数据"
         verbose_name_plural = "NDVI数据"
         ordering = ['-acquisition_date']
+        indexes = [
+            # 列表接口按日期倒序+游标分页；首列为采集日期，start/end日期过滤也走此B-tree索引
+            models.Index(fields=['-acquisition_date', '-id'], name='ndvi_date_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.acquisition_date})"
@@ -72,18 +79,129 @@ class NDVIData(models.Model):
         return Path(settings.BASE_DIR) / self.data_dir
 
     def get_tile_paths(self):
-        """获取所有分块文件路径"""
+        """获取所有分块文件路径（优先使用分块索引，旧数据退回目录通配）"""
+        tiles = list(self.tiles.all())
+        if tiles:
+            return [tile.get_absolute_path() for tile in tiles]
         data_dir = self.get_absolute_path()
-        return sorted(data_dir.glob('*.tif'))
+        return sorted(data_dir.glob('tile_*.tif'))
 
-    def save(self, *args, **kwargs):
-        # 在保存前清理特殊值
+    def get_product_path(self):
+        """获取合并产品（COG）路径，旧数据没有产品文件时返回None"""
+        name = (self.metadata or {}).get('product')
+        if not name:
+            return None
+        path = self.get_absolute_path() / name
+        return path if path.exists() else None
+
+    def clean_stats(self):
+        """清理统计量中的特殊值（bulk_create不经过save，批量写入前需显式调用）"""
         def clean_value(value):
-            if value in (float('-inf'), float('inf'), float('nan')):
+            # 空数据时统计量为None；nan不等于自身，需用isfinite判断
+            if value is None or not math.isfinite(value):
                 return None
             return max(-1.0, min(1.0, value))  # 确保在有效范围内
 
         self.min_value = clean_value(self.min_value)
         self.max_value = clean_value(self.max_value)
         self.mean_value = clean_value(self.mean_value)
+
+    def save(self, *args, **kwargs):
+        # 在保存前清理特殊值
+        self.clean_stats()
         super().save(*args, **kwargs)
+
+
+class NDVITileQuerySet(models.QuerySet):
+    def intersecting(self, bbox):
+        """与bbox（minx, miny, maxx, maxy，EPSG:4326）相交的分块"""
+        return self.filter(footprint__intersects=Polygon.from_bbox(bbox))
+
+
+class NDVITile(models.Model):
+    """NDVI分块索引：记录每个分块的覆盖范围与文件信息，入库时由管道写入"""
+    ndvi = models.ForeignKey(
+        NDVIData,
+        on_delete=models.CASCADE,
+        related_name='tiles',
+        help_text="所属NDVI产品"
+    )
+    index = models.PositiveIntegerField(
+        help_text="分块序号（从0开始）"
+    )
+    path = models.CharField(
+        max_length=255,
+        help_text="分块文件路径(相对路径)"
+    )
+    footprint = models.PolygonField(
+        srid=4326,
+        spatial_index=True,
+        help_text="分块覆盖范围"
+    )
+    size = models.BigIntegerField(
+        help_text="文件大小(字节)"
+    )
+    checksum = models.CharField(
+        max_length=64,
+        help_text="文件sha256"
+    )
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    block_x = models.PositiveIntegerField(help_text="内部块宽")
+    block_y = models.PositiveIntegerField(help_text="内部块高")
+
+    objects = NDVITileQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "NDVI分块"
+        verbose_name_plural = "NDVI分块"
+        ordering = ['ndvi_id', 'index']
+        constraints = [
+            models.UniqueConstraint(fields=['ndvi', 'index'], name='ndvi_tile_unique_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.ndvi.name}#{self.index}"
+
+    def get_absolute_path(self):
+        from django.conf import settings
+        return Path(settings.BASE_DIR) / self.path
+
+
+class SatelliteRaster(models.Model):
+    """PostGIS栅格分块：产品按固定尺寸切块入库，供SQL端分区统计与裁剪
+
+    overview为抽稀倍数（1为原始分辨率），同一产品的各级概视图存放在同一张表中。
+    """
+    DATA_TYPES = [
+        ('NDVI', '植被指数'),
+        ('LST', '地表温度'),
+        ('NL', '夜间灯光'),
+    ]
+
+    name = models.CharField(max_length=100)
+    rast = models.RasterField(srid=3857)
+    acquisition_date = models.DateField()
+    data_type = models.CharField(max_length=4, choices=DATA_TYPES)
+    metadata = models.JSONField(default=dict)
+    ndvi = models.ForeignKey(
+        NDVIData,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='rasters',
+        help_text="来源NDVI产品"
+    )
+    tile_x = models.PositiveIntegerField(default=0, help_text="分块列号")
+    tile_y = models.PositiveIntegerField(default=0, help_text="分块行号")
+    overview = models.PositiveSmallIntegerField(default=1, help_text="概视图抽稀倍数（1为原始分辨率）")
+
+    class Meta:
+        verbose_name = "卫星栅格分块"
+        verbose_name_plural = "卫星栅格分块"
+        indexes = [
+            models.Index(fields=['ndvi', 'overview'], name='satellite_raster_ndvi_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} o{self.overview} ({self.tile_x}, {self.tile_y})"
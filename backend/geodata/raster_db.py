@@ -0,0 +1,333 @@
+import json
+import math
+import struct
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from osgeo import gdal, gdal_array, osr
+
+from geodata.models import SatelliteRaster
+from geodata.raster_source import product_source
+
+# PostGIS栅格WKB像元类型编码
+PIXEL_TYPES = {
+    np.dtype('int8'): (3, 'b'),
+    np.dtype('uint8'): (4, 'B'),
+    np.dtype('int16'): (5, 'h'),
+    np.dtype('uint16'): (6, 'H'),
+    np.dtype('int32'): (7, 'i'),
+    np.dtype('uint32'): (8, 'I'),
+    np.dtype('float32'): (10, 'f'),
+    np.dtype('float64'): (11, 'd'),
+}
+BAND_OFFLINE = 0x80
+BAND_HAS_NODATA = 0x40
+
+COPY_COLUMNS = ('name', 'rast', 'acquisition_date', 'data_type', 'metadata', 'ndvi', 'tile_x', 'tile_y',
+                'overview')
+
+
+def raster_srid():
+    return SatelliteRaster._meta.get_field('rast').srid
+
+
+def raster_wkb(width, height, geotransform, srid, dtype, nodata=None, data=None, outdb=None):
+    """单波段PostGIS栅格WKB（小端）
+
+    data为块像元（in-db）；outdb为(数据库服务器可访问的文件路径, 波段序号)时只写引用。
+    """
+    pixel_type, fmt = PIXEL_TYPES[np.dtype(dtype)]
+    gt = geotransform
+    header = struct.pack('<BHHddddddiHH', 1, 0, 1, gt[1], gt[5], gt[0], gt[3], gt[2], gt[4],
+                         srid, width, height)
+    flags = pixel_type | (BAND_HAS_NODATA if nodata is not None else 0)
+    if outdb is not None:
+        flags |= BAND_OFFLINE
+    band = struct.pack('<B', flags) + struct.pack('<' + fmt, nodata if nodata is not None else 0)
+    if outdb is not None:
+        path, band_index = outdb
+        band += struct.pack('<B', band_index - 1) + str(path).encode() + b'\0'
+    else:
+        band += np.ascontiguousarray(data, dtype=np.dtype(dtype).newbyteorder('<')).tobytes()
+    return header + band
+
+
+def warped_source(path, srid, resample='near'):
+    """把产品重投影到栅格字段的坐标系（内存VRT，不写出像元），坐标系一致时直接返回原路径"""
+    ds = gdal.Open(str(path))
+    if ds is None:
+        raise FileNotFoundError(f"无法打开栅格: {path}")
+    target = osr.SpatialReference()
+    target.ImportFromEPSG(srid)
+    if ds.GetProjection() and osr.SpatialReference(wkt=ds.GetProjection()).IsSame(target):
+        return str(path)
+    vrt_path = f"/vsimem/raster_db_{uuid.uuid4().hex}.vrt"
+    nodata = ds.GetRasterBand(1).GetNoDataValue()
+    vrt = gdal.Warp(vrt_path, ds, options=gdal.WarpOptions(
+        format='VRT', dstSRS=f'EPSG:{srid}', resampleAlg=resample,
+        srcNodata=nodata, dstNodata=nodata,
+    ))
+    if vrt is None:
+        raise RuntimeError(f"重投影失败: {path}")
+    vrt = None
+    return vrt_path
+
+
+def overview_source(path, factor):
+    """按倍数抽稀（均值重采样）的内存VRT"""
+    ds = gdal.Open(str(path))
+    vrt_path = f"/vsimem/raster_db_o{factor}_{uuid.uuid4().hex}.vrt"
+    vrt = gdal.Translate(vrt_path, ds, options=gdal.TranslateOptions(
+        format='VRT',
+        width=max(1, math.ceil(ds.RasterXSize / factor)),
+        height=max(1, math.ceil(ds.RasterYSize / factor)),
+        resampleAlg='average',
+    ))
+    if vrt is None:
+        raise RuntimeError(f"无法生成{factor}倍概视图: {path}")
+    vrt = None
+    return vrt_path
+
+
+def materialize(path, target):
+    """out-db模式下把VRT写为分块GTiff，供数据库服务器直接读取"""
+    dataset = gdal.Translate(str(target), str(path), options=gdal.TranslateOptions(
+        format='GTiff',
+        creationOptions=['TILED=YES', 'COMPRESS=DEFLATE', 'PREDICTOR=3', 'BIGTIFF=IF_SAFER'],
+    ))
+    if dataset is None:
+        raise RuntimeError(f"无法写出栅格: {target}")
+    dataset = None
+    return target
+
+
+def tile_rasters(path, tile_size=256, srid=None, outdb_path=None, workers=4, skip_empty=True):
+    """按tile_size切块，依次生成(列号, 行号, WKB)
+
+    in-db模式按块读取像元，整块为nodata的块默认跳过；
+    out-db模式只写入块的地理参考与文件引用，不读像元。
+    """
+    srid = srid or raster_srid()
+    ds = gdal.Open(str(path))
+    if ds is None:
+        raise FileNotFoundError(f"无法打开栅格: {path}")
+    band = ds.GetRasterBand(1)
+    width, height = ds.RasterXSize, ds.RasterYSize
+    gt = ds.GetGeoTransform()
+    nodata = band.GetNoDataValue()
+    dtype = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType))
+    ds = band = None
+
+    windows = [
+        (tx, ty, tx * tile_size, ty * tile_size,
+         min(tile_size, width - tx * tile_size), min(tile_size, height - ty * tile_size))
+        for ty in range(math.ceil(height / tile_size))
+        for tx in range(math.ceil(width / tile_size))
+    ]
+
+    def tile_geotransform(xoff, yoff):
+        return (gt[0] + xoff * gt[1] + yoff * gt[2], gt[1], gt[2],
+                gt[3] + xoff * gt[4] + yoff * gt[5], gt[4], gt[5])
+
+    if outdb_path is not None:
+        for tx, ty, xoff, yoff, w, h in windows:
+            yield tx, ty, raster_wkb(w, h, tile_geotransform(xoff, yoff), srid, dtype, nodata,
+                                     outdb=(outdb_path, 1))
+        return
+
+    local = threading.local()
+
+    def process(window):
+        tx, ty, xoff, yoff, w, h = window
+        if getattr(local, 'band', None) is None:
+            local.ds = gdal.Open(str(path))
+            local.band = local.ds.GetRasterBand(1)
+        data = local.band.ReadAsArray(xoff, yoff, w, h)
+        if skip_empty:
+            valid = np.isfinite(data) if np.issubdtype(data.dtype, np.floating) else np.ones(data.shape, bool)
+            if nodata is not None and not math.isnan(nodata):
+                valid &= data != nodata
+            if not valid.any():
+                return None
+        return tx, ty, raster_wkb(w, h, tile_geotransform(xoff, yoff), srid, data.dtype, nodata, data=data)
+
+    # 分批提交，COPY消费速度慢于读取时内存也只保留一批结果
+    batch = max(1, workers) * 4
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for start in range(0, len(windows), batch):
+            for result in executor.map(process, windows[start:start + batch]):
+                if result is not None:
+                    yield result
+
+
+def _copy_text(value):
+    """COPY文本格式的字段转义"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class _CopyReader:
+    """把逐行生成的COPY文本包装为file-like对象，供copy_expert流式读取"""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = bytearray()
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines).encode()
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def copy_rasters(rows):
+    """以COPY批量写入栅格行，rows为字段值元组（顺序同COPY_COLUMNS）"""
+    opts = SatelliteRaster._meta
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(opts.get_field(name).column) for name in COPY_COLUMNS)
+    sql = f"COPY {qn(opts.db_table)} ({columns}) FROM STDIN"
+    lines = ('\t'.join(_copy_text(v) for v in row) + '\n' for row in rows)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, _CopyReader(lines))
+
+
+def load_ndvi_raster(ndvi_data, tile_size=None, overviews=None, outdb_root=None, workers=4):
+    """把NDVI产品切块写入SatelliteRaster（含各级概视图），替换该产品已有的栅格行
+
+    产品先重投影到栅格字段坐标系；outdb_root为数据库服务器上对应BASE_DIR的路径，
+    指定时改为out-db模式（概视图与重投影结果写为产品目录下的GTiff，表中只存引用）。
+    """
+    tile_size = tile_size or getattr(settings, 'NDVI_RASTER_DB_TILE_SIZE', 256)
+    overviews = overviews if overviews is not None else getattr(settings, 'NDVI_RASTER_DB_OVERVIEWS', (4, 16))
+    outdb_root = outdb_root if outdb_root is not None else getattr(settings, 'NDVI_RASTER_DB_OUTDB_ROOT', None)
+    srid = raster_srid()
+    start = time.monotonic()
+
+    source, _ = product_source(ndvi_data.pk)
+    base = warped_source(source, srid)
+    levels = [(1, base)] + [(f, overview_source(base, f)) for f in sorted(set(overviews)) if f > 1]
+    temporary = [path for _, path in levels if path.startswith('/vsimem/')]
+
+    counts = {}
+
+    def rows():
+        for factor, path in levels:
+            outdb_path = None
+            if outdb_root:
+                local = ndvi_data.get_absolute_path() / (
+                    f"raster_{srid}.tif" if factor == 1 else f"raster_{srid}_o{factor}.tif")
+                path = str(materialize(path, local))
+                outdb_path = Path(outdb_root) / local.relative_to(settings.BASE_DIR)
+            metadata = json.dumps({'tile_size': tile_size, 'source': ndvi_data.data_dir})
+            for tx, ty, wkb in tile_rasters(path, tile_size, srid, outdb_path, workers):
+                counts[factor] = counts.get(factor, 0) + 1
+                yield (ndvi_data.name, wkb.hex(), ndvi_data.acquisition_date.isoformat(), 'NDVI',
+                       metadata, ndvi_data.pk, tx, ty, factor)
+
+    try:
+        with transaction.atomic():
+            SatelliteRaster.objects.filter(ndvi=ndvi_data).delete()
+            copy_rasters(rows())
+    finally:
+        for path in temporary:
+            gdal.Unlink(path)
+
+    return {
+        'rows': sum(counts.values()),
+        'overviews': {str(k): v for k, v in sorted(counts.items())},
+        'outdb': bool(outdb_root),
+        'seconds': round(time.monotonic() - start, 3),
+    }
+
+
+# ---------- SQL端分析 ----------
+
+def _table_columns():
+    opts = SatelliteRaster._meta
+    qn = connection.ops.quote_name
+    return qn(opts.db_table), {name: qn(opts.get_field(name).column) for name in ('rast', 'ndvi', 'overview')}
+
+
+def _ewkb(geometry):
+    if geometry.srid is None:
+        geometry = geometry.clone()
+        geometry.srid = 4326
+    return bytes(geometry.ewkb)
+
+
+def _stats_row(row):
+    count, total, mean, stddev, low, high = row if row else (None,) * 6
+    return {
+        'count': count or 0,
+        'sum': total,
+        'mean': mean,
+        'stddev': stddev,
+        'min': low,
+        'max': high,
+    }
+
+
+def zonal_stats_sql(ndvi_id, geometry, overview=1):
+    """在数据库中计算多边形内的NDVI统计（geometry为GEOSGeometry，未设置srid时视为EPSG:4326）"""
+    table, col = _table_columns()
+    sql = f"""
+        SELECT (s.stats).count, (s.stats).sum, (s.stats).mean, (s.stats).stddev, (s.stats).min, (s.stats).max
+        FROM (
+            SELECT ST_SummaryStatsAgg(ST_Clip(r.{col['rast']}, g.geom, true), 1, true) AS stats
+            FROM {table} r, (SELECT ST_Transform(ST_GeomFromEWKB(%s), %s) AS geom) g
+            WHERE r.{col['ndvi']} = %s AND r.{col['overview']} = %s AND ST_Intersects(r.{col['rast']}, g.geom)
+        ) s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [_ewkb(geometry), raster_srid(), ndvi_id, overview])
+        return _stats_row(cursor.fetchone())
+
+
+def zonal_stats_by_feature(ndvi_id, table_name, geom_column='geom', id_column='id', overview=1):
+    """按矢量表逐要素分区统计（如积水点/淹没区），返回{要素id: 统计}"""
+    table, col = _table_columns()
+    qn = connection.ops.quote_name
+    sql = f"""
+        SELECT s.fid, (s.stats).count, (s.stats).sum, (s.stats).mean, (s.stats).stddev,
+               (s.stats).min, (s.stats).max
+        FROM (
+            SELECT v.{qn(id_column)} AS fid,
+                   ST_SummaryStatsAgg(ST_Clip(r.{col['rast']}, v.geom, true), 1, true) AS stats
+            FROM (SELECT {qn(id_column)}, ST_Transform({qn(geom_column)}, %s) AS geom
+                  FROM {qn(table_name)}) v
+            JOIN {table} r ON r.{col['ndvi']} = %s AND r.{col['overview']} = %s
+                 AND ST_Intersects(r.{col['rast']}, v.geom)
+            GROUP BY v.{qn(id_column)}
+        ) s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [raster_srid(), ndvi_id, overview])
+        return {row[0]: _stats_row(row[1:]) for row in cursor.fetchall()}
+
+
+def clip_raster_sql(ndvi_id, geometry, overview=1, driver='GTiff'):
+    """在数据库中按多边形裁剪并拼接，返回GDAL格式的文件字节（无相交分块时返回None）"""
+    table, col = _table_columns()
+    sql = f"""
+        SELECT ST_AsGDALRaster(ST_Union(ST_Clip(r.{col['rast']}, g.geom, true)), %s)
+        FROM {table} r, (SELECT ST_Transform(ST_GeomFromEWKB(%s), %s) AS geom) g
+        WHERE r.{col['ndvi']} = %s AND r.{col['overview']} = %s AND ST_Intersects(r.{col['rast']}, g.geom)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [driver, _ewkb(geometry), raster_srid(), ndvi_id, overview])
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] is not None else None
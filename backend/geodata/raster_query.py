@@ -0,0 +1,229 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from osgeo import gdal, ogr, osr
+
+from data_pipeline.utils.raster_stats import RasterStats
+
+_local = threading.local()
+
+
+def wgs84():
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+class RasterInfo:
+    """栅格基本信息（只读，可跨线程共享）"""
+
+    def __init__(self, path, version):
+        ds = gdal.Open(path)
+        if ds is None:
+            raise FileNotFoundError(f"无法打开栅格: {path}")
+        band = ds.GetRasterBand(1)
+        self.path = path
+        self.version = version
+        self.width = ds.RasterXSize
+        self.height = ds.RasterYSize
+        self.geotransform = ds.GetGeoTransform()
+        self.inv_geotransform = gdal.InvGeoTransform(self.geotransform)
+        self.block_x, self.block_y = band.GetBlockSize()
+        self.nodata = band.GetNoDataValue()
+        self.wkt = ds.GetProjection()
+        ds = None
+
+    def srs(self):
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(self.wkt)
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        return srs
+
+    def to_raster_crs(self):
+        """WGS84 -> 栅格坐标系的转换（坐标转换对象不可跨线程共享，按线程缓存）"""
+        transforms = _thread_cache('transforms')
+        key = self.wkt
+        if key not in transforms:
+            transforms[key] = osr.CoordinateTransformation(wgs84(), self.srs())
+        return transforms[key]
+
+    def band(self):
+        """当前线程的波段句柄
+
+        按(路径, 版本)缓存：产品在同一路径被重写后版本变化，旧句柄可能读到过期或写了一半的块，
+        需关闭后按新版本重新打开。
+        """
+        datasets = _thread_cache('datasets')
+        key = (self.path, self.version)
+        if key not in datasets:
+            for stale in [k for k in datasets if k[0] == self.path]:
+                datasets.pop(stale)
+            datasets[key] = gdal.Open(self.path)
+        return datasets[key].GetRasterBand(1)
+
+    def pixel(self, x, y):
+        col, row = gdal.ApplyGeoTransform(self.inv_geotransform, x, y)
+        return int(math.floor(col)), int(math.floor(row))
+
+    def block_window(self, bx, by):
+        xoff, yoff = bx * self.block_x, by * self.block_y
+        return xoff, yoff, min(self.block_x, self.width - xoff), min(self.block_y, self.height - yoff)
+
+
+def _thread_cache(name):
+    cache = getattr(_local, name, None)
+    if cache is None:
+        cache = {}
+        setattr(_local, name, cache)
+    return cache
+
+
+class BlockCache:
+    """跨请求共享的栅格块缓存（按字节数限制的LRU）"""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or getattr(settings, 'NDVI_BLOCK_CACHE_BYTES', 256 * 1024 * 1024)
+        self._blocks = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, info, bx, by):
+        key = (info.path, info.version, bx, by)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+
+        block = info.band().ReadAsArray(*info.block_window(bx, by)).astype(np.float32, copy=False)
+        if info.nodata is not None and not math.isnan(info.nodata):
+            block[block == info.nodata] = np.nan
+        block.setflags(write=False)
+
+        with self._lock:
+            if key not in self._blocks:
+                self._blocks[key] = block
+                self._bytes += block.nbytes
+                while self._bytes > self.max_bytes and len(self._blocks) > 1:
+                    _, old = self._blocks.popitem(last=False)
+                    self._bytes -= old.nbytes
+        return block
+
+    def discard(self, path, keep_version):
+        """丢弃同一路径下旧版本的块"""
+        with self._lock:
+            for key in [k for k in self._blocks if k[0] == path and k[1] != keep_version]:
+                self._bytes -= self._blocks.pop(key).nbytes
+
+
+block_cache = BlockCache()
+_infos = {}
+_infos_lock = threading.Lock()
+
+
+def raster_info(path, version):
+    key = (path, version)
+    with _infos_lock:
+        info = _infos.get(key)
+    if info is None:
+        info = RasterInfo(path, version)
+        with _infos_lock:
+            _infos[key] = info
+            # 同一路径只保留当前版本，避免重写产品后无限增长
+            for stale in [k for k in _infos if k[0] == path and k[1] != version]:
+                del _infos[stale]
+        block_cache.discard(path, version)
+    return info
+
+
+def sample_points(info, points):
+    """批量查询经纬度处的像元值，同一块内的点只读一次块"""
+    transform = info.to_raster_crs()
+    values = [None] * len(points)
+    by_block = {}
+    for i, (lon, lat) in enumerate(points):
+        x, y, _ = transform.TransformPoint(float(lon), float(lat))
+        col, row = info.pixel(x, y)
+        if 0 <= col < info.width and 0 <= row < info.height:
+            by_block.setdefault((col // info.block_x, row // info.block_y), []).append((i, col, row))
+
+    for (bx, by), items in by_block.items():
+        block = block_cache.get(info, bx, by)
+        for i, col, row in items:
+            value = float(block[row - by * info.block_y, col - bx * info.block_x])
+            values[i] = value if math.isfinite(value) else None
+    return values
+
+
+def zonal_stats(info, geojson, max_pixels=None):
+    """多边形分区统计：只读取与多边形外包框相交的块，逐块栅格化掩膜并合并统计量"""
+    max_pixels = max_pixels or getattr(settings, 'NDVI_ZONAL_MAX_PIXELS', 50_000_000)
+    geometry = to_raster_geometry(geojson, info.to_raster_crs())
+
+    minx, maxx, miny, maxy = geometry.GetEnvelope()
+    col0, row0 = info.pixel(minx, maxy)
+    col1, row1 = info.pixel(maxx, miny)
+    col0, row0 = max(col0, 0), max(row0, 0)
+    col1, row1 = min(col1, info.width - 1), min(row1, info.height - 1)
+
+    stats = RasterStats()
+    if col1 < col0 or row1 < row0:
+        return stats.as_dict()
+    if (col1 - col0 + 1) * (row1 - row0 + 1) > max_pixels:
+        raise ValueError("查询范围过大")
+
+    layer_ds, layer = geometry_layer(geometry, info.srs())
+
+    for by in range(row0 // info.block_y, row1 // info.block_y + 1):
+        for bx in range(col0 // info.block_x, col1 // info.block_x + 1):
+            xoff, yoff, xsize, ysize = info.block_window(bx, by)
+            mask = window_mask(layer, info.geotransform, info.wkt, xoff, yoff, xsize, ysize)
+            if not mask.any():
+                continue
+
+            block = block_cache.get(info, bx, by)
+            values = block[mask]
+            stats.update(values[np.isfinite(values)])
+    return stats.as_dict()
+
+
+def to_raster_geometry(geojson, transform):
+    """GeoJSON（WGS84）转为栅格坐标系下的OGR几何"""
+    geometry = ogr.CreateGeometryFromJson(geojson)
+    if geometry is None:
+        raise ValueError("无效的GeoJSON几何")
+    geometry.AssignSpatialReference(wgs84())
+    if geometry.Transform(transform) != 0:
+        raise ValueError("几何坐标转换失败")
+    return geometry
+
+
+def geometry_layer(geometry, srs):
+    """把几何放入内存图层供栅格化使用（需同时持有返回的数据源）"""
+    layer_ds = ogr.GetDriverByName('Memory').CreateDataSource('zone')
+    layer = layer_ds.CreateLayer('zone', srs=srs)
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(geometry)
+    layer.CreateFeature(feature)
+    return layer_ds, layer
+
+
+def window_mask(layer, geotransform, wkt, xoff, yoff, xsize, ysize):
+    """在指定像元窗口内栅格化多边形，返回布尔掩膜"""
+    gt = geotransform
+    mask_ds = gdal.GetDriverByName('MEM').Create('', xsize, ysize, 1, gdal.GDT_Byte)
+    mask_ds.SetGeoTransform((gt[0] + xoff * gt[1] + yoff * gt[2], gt[1], gt[2],
+                             gt[3] + xoff * gt[4] + yoff * gt[5], gt[4], gt[5]))
+    mask_ds.SetProjection(wkt)
+    gdal.RasterizeLayer(mask_ds, [1], layer, burn_values=[1])
+    mask = mask_ds.GetRasterBand(1).ReadAsArray().astype(bool)
+    mask_ds = None
+    return mask
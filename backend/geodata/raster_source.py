@@ -0,0 +1,48 @@
+import threading
+import time
+
+from osgeo import gdal
+
+from geodata.models import NDVIData
+
+# pk -> (过期时间, 数据源路径, 版本)，避免每个瓦片/查询请求都查库、建VRT
+_SOURCE_TTL = 60
+_sources = {}
+_lock = threading.Lock()
+
+
+def _build_source(ndvi_data):
+    """产品优先使用COG，旧数据退回到内存VRT拼接分块"""
+    product = ndvi_data.get_product_path()
+    if product is not None:
+        return str(product), f"{product.stat().st_mtime_ns:x}"
+
+    tiles = ndvi_data.get_tile_paths()
+    if not tiles:
+        raise FileNotFoundError(f"{ndvi_data.name} 没有可用的栅格文件")
+    version = f"{max(t.stat().st_mtime_ns for t in tiles):x}"
+    vrt_path = f"/vsimem/ndvi_{ndvi_data.pk}_{version}.vrt"
+    vrt = gdal.BuildVRT(vrt_path, [str(t) for t in tiles])
+    if vrt is None:
+        raise RuntimeError(f"无法构建VRT: {ndvi_data.name}")
+    vrt = None
+    return vrt_path, version
+
+
+def product_source(pk):
+    """返回(栅格路径, 版本)，版本随产品文件更新而变化，用作缓存键的一部分"""
+    now = time.monotonic()
+    with _lock:
+        cached = _sources.get(pk)
+        if cached and cached[0] > now:
+            return cached[1], cached[2]
+
+    ndvi_data = NDVIData.objects.get(pk=pk)
+    path, version = _build_source(ndvi_data)
+    with _lock:
+        old = _sources.get(pk)
+        _sources[pk] = (now + _SOURCE_TTL, path, version)
+    # 版本变化后释放旧的内存VRT
+    if old and old[1] != path and old[1].startswith('/vsimem/'):
+        gdal.Unlink(old[1])
+    return path, version
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from geodata.cache import bump_list_cache_version
+from geodata.models import NDVIData
+
+
+@receiver(post_save, sender=NDVIData)
+@receiver(post_delete, sender=NDVIData)
+def invalidate_ndvi_list(sender, **kwargs):
+    """NDVIData保存/删除后使列表缓存失效"""
+    bump_list_cache_version()
@@ -1,3 +1,162 @@
-from django.test import TestCase
+import io
+import os
+import zipfile
 
-# Create your tests here.
+import numpy as np
+from django.test import RequestFactory, SimpleTestCase
+
+from data_pipeline.utils.testing import TempDirMixin
+from geodata.archive import (RangeNotSatisfiable, archive_version, build_archive, iter_file_range,
+                             parse_range, stream_archive)
+from geodata.raster_db import _copy_text, _CopyReader, raster_wkb
+from geodata.views import if_none_match
+
+
+class ParseRangeTests(SimpleTestCase):
+
+    def test_single_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=500-', 1000), (500, 999))
+        # 结束位置超出文件长度时截断
+        self.assertEqual(parse_range('bytes=900-5000', 1000), (900, 999))
+
+    def test_suffix_range(self):
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+
+    def test_unsupported_headers_fall_back_to_full_response(self):
+        for header in (None, '', 'items=0-9', 'bytes=0-9,20-29', 'bytes=abc-', 'bytes=10', 'bytes=9-3'):
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range(header, 1000))
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=1000-', 'bytes=2000-3000', 'bytes=-0'):
+            with self.subTest(header=header):
+                with self.assertRaises(RangeNotSatisfiable):
+                    parse_range(header, 1000)
+
+
+class IfNoneMatchTests(SimpleTestCase):
+
+    def matches(self, header, etag='"abc123"'):
+        headers = {'HTTP_IF_NONE_MATCH': header} if header is not None else {}
+        return if_none_match(RequestFactory().get('/', **headers), etag)
+
+    def test_exact_and_list_matches(self):
+        self.assertTrue(self.matches('"abc123"'))
+        self.assertTrue(self.matches('"other", "abc123"'))
+        self.assertTrue(self.matches('W/"abc123"'))
+        self.assertTrue(self.matches('"abc123"', etag='W/"abc123"'))
+        self.assertTrue(self.matches('*'))
+
+    def test_no_substring_matches(self):
+        for header in (None, '', '"abc1234"', '"xabc123"', '"abc12"', '"abc123-1-2-3"', 'abc123'):
+            with self.subTest(header=header):
+                self.assertFalse(self.matches(header))
+
+
+class ArchiveTests(TempDirMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.files = []
+        for name, data in (('ndvi.tif', os.urandom(3000)), ('metadata.json', b'{"ok": true}' * 200)):
+            path = self.tmp / name
+            path.write_bytes(data)
+            self.files.append((path, f"ndvi_1/{name}"))
+
+    def test_version_tracks_size_and_mtime(self):
+        version = archive_version(self.files)
+        self.assertEqual(len(version), 20)
+        self.assertEqual(archive_version(self.files), version)
+
+        path = self.files[0][0]
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        touched = archive_version(self.files)
+        self.assertNotEqual(touched, version)
+
+        with open(path, 'ab') as f:
+            f.write(b'x')
+        self.assertNotEqual(archive_version(self.files), touched)
+
+    def test_stream_archive_round_trip(self):
+        data = b''.join(stream_archive(self.files, chunk_size=512))
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            infos = {info.filename: info for info in zf.infolist()}
+            self.assertEqual(infos['ndvi_1/ndvi.tif'].compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(infos['ndvi_1/metadata.json'].compress_type, zipfile.ZIP_DEFLATED)
+            for path, arcname in self.files:
+                self.assertEqual(zf.read(arcname), path.read_bytes())
+
+    def test_build_archive_replaces_stale_versions(self):
+        stale = self.tmp / 'ndvi_1_old.zip'
+        stale.write_bytes(b'old')
+        cache_path = build_archive(self.files, self.tmp / 'ndvi_1_new.zip')
+
+        self.assertFalse(stale.exists())
+        self.assertEqual(list(self.tmp.glob('*.tmp')), [])
+        self.assertEqual(b''.join(stream_archive(self.files)), cache_path.read_bytes())
+
+        # 续传时按Range读取的区间与完整文件一致
+        start, end = parse_range('bytes=100-1099', cache_path.stat().st_size)
+        chunks = list(iter_file_range(cache_path, start, end - start + 1, chunk_size=300))
+        self.assertEqual([len(c) for c in chunks], [300, 300, 300, 100])
+        self.assertEqual(b''.join(chunks), cache_path.read_bytes()[100:1100])
+
+    def test_aborted_stream_discards_partial_cache(self):
+        cache_path = self.tmp / 'ndvi_1_abc.zip'
+        stream = stream_archive(self.files, cache_path, chunk_size=256)
+        next(stream)
+        stream.close()
+
+        self.assertFalse(cache_path.exists())
+        self.assertEqual(list(self.tmp.glob('*.tmp')), [])
+
+
+class RasterWKBTests(SimpleTestCase):
+    """PostGIS栅格WKB与COPY文本格式"""
+
+    # 版本0、1个波段、scale(10,-10)、左上角(100,200)、无旋转、SRID 4326、2x2
+    HEADER = ('01' '0000' '0100'
+              '0000000000002440' '00000000000024c0'
+              '0000000000005940' '0000000000006940'
+              '0000000000000000' '0000000000000000'
+              'e6100000' '0200' '0200')
+
+    def test_in_db_float32_band(self):
+        data = np.array([[0.5, -1.0], [0.25, 1.0]], dtype=np.float32)
+        wkb = raster_wkb(2, 2, (100.0, 10.0, 0.0, 200.0, 0.0, -10.0), 4326, np.float32, nodata=-1.0, data=data)
+        # 像元类型10（32BF）| 有nodata；nodata与像元均为小端float32
+        expected = self.HEADER + '4a' + '000080bf' + '0000003f' '000080bf' '0000803e' '0000803f'
+        self.assertEqual(wkb.hex(), expected)
+
+    def test_big_endian_input_and_no_nodata(self):
+        data = np.array([[1, 2], [3, 258]], dtype='>u2')
+        wkb = raster_wkb(2, 2, (100.0, 10.0, 0.0, 200.0, 0.0, -10.0), 4326, np.uint16, data=data)
+        self.assertEqual(wkb.hex(), self.HEADER + '06' + '0000' + '0100' '0200' '0300' '0201')
+
+    def test_out_db_band(self):
+        wkb = raster_wkb(2, 2, (100.0, 10.0, 0.0, 200.0, 0.0, -10.0), 4326, np.int16, nodata=-32768,
+                         outdb=('/data/ndvi/raster_4326.tif', 1))
+        # 离线 | 有nodata | 16BSI，随后是波段序号（从0开始）与以\0结尾的路径
+        self.assertEqual(wkb.hex(), self.HEADER + 'c5' + '0080' + '00' + b'/data/ndvi/raster_4326.tif\0'.hex())
+
+    def test_copy_text_escaping(self):
+        self.assertEqual(_copy_text(None), '\\N')
+        self.assertEqual(_copy_text(3), '3')
+        self.assertEqual(_copy_text('a\\b\tc\nd\re'), 'a\\\\b\\tc\\nd\\re')
+
+    def test_copy_reader_streams_lines(self):
+        lines = ['\t'.join(_copy_text(v) for v in row) + '\n'
+                 for row in (('n1', 'ab', None), ('n2', '{"k": "x\ty"}', 2))]
+        reader = _CopyReader(iter(lines))
+        chunks = []
+        while True:
+            chunk = reader.read(7)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 7)
+            chunks.append(chunk)
+        self.assertEqual(b''.join(chunks), b'n1\tab\t\\N\nn2\t{"k": "x\\ty"}\t2\n')
+        self.assertEqual(_CopyReader(iter(lines)).read(), b''.join(chunks))
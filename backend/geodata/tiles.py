@@ -0,0 +1,163 @@
+import io
+import logging
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from osgeo import gdal
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 256
+MAX_ZOOM = 22
+# Web墨卡托半周长（米）
+ORIGIN_SHIFT = math.pi * 6378137.0
+
+# NDVI色带（与static/styles/ndvi.sld保持一致）
+NDVI_COLOR_STOPS = [
+    (-1.0, (12, 12, 12)),
+    (0.0, (166, 97, 26)),
+    (0.2, (223, 194, 125)),
+    (0.4, (166, 217, 106)),
+    (0.6, (26, 150, 65)),
+    (1.0, (0, 77, 37)),
+]
+
+
+def _build_lut(stops, entries=256):
+    """把色带插值成256级查找表（RGBA）"""
+    values = np.linspace(-1.0, 1.0, entries)
+    positions = [s[0] for s in stops]
+    lut = np.empty((entries, 4), dtype=np.uint8)
+    for channel in range(3):
+        lut[:, channel] = np.interp(values, positions, [s[1][channel] for s in stops])
+    lut[:, 3] = 255
+    return lut
+
+
+NDVI_LUT = _build_lut(NDVI_COLOR_STOPS)
+
+
+def tile_bounds(z, x, y):
+    """XYZ瓦片在EPSG:3857下的范围 (minx, miny, maxx, maxy)"""
+    span = 2 * ORIGIN_SHIFT / (2 ** z)
+    minx = -ORIGIN_SHIFT + x * span
+    maxy = ORIGIN_SHIFT - y * span
+    return minx, maxy - span, minx + span, maxy
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def colorize(array, nodata=None):
+    """NDVI数组着色为RGBA，nodata透明"""
+    valid = np.isfinite(array)
+    if nodata is not None and not math.isnan(nodata):
+        valid &= array != nodata
+    index = np.zeros(array.shape, dtype=np.uint8)
+    scaled = np.clip((array[valid] + 1.0) * 127.5, 0, 255)
+    index[valid] = scaled.astype(np.uint8)
+    rgba = NDVI_LUT[index]
+    rgba[~valid, 3] = 0
+    return rgba
+
+
+def encode_png(rgba):
+    buf = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buf, format='PNG')
+    return buf.getvalue()
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def render_tile(source_path, z, x, y, size=TILE_SIZE):
+    """按瓦片范围窗口读取并重投影，COG存在概视图时自动读取合适层级"""
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    ds = gdal.Warp(
+        '', source_path,
+        options=gdal.WarpOptions(
+            format='MEM',
+            dstSRS='EPSG:3857',
+            outputBounds=(minx, miny, maxx, maxy),
+            width=size,
+            height=size,
+            outputType=gdal.GDT_Float32,
+            dstNodata=float('nan'),
+            resampleAlg='average' if z < 12 else 'bilinear',
+        )
+    )
+    if ds is None:
+        raise RuntimeError(f"瓦片渲染失败: {z}/{x}/{y}")
+    array = ds.GetRasterBand(1).ReadAsArray()
+    ds = None
+
+    if not np.isfinite(array).any():
+        return EMPTY_TILE
+    return encode_png(colorize(array))
+
+
+class TileCache:
+    """两级瓦片缓存：进程内LRU -> Redis"""
+
+    def __init__(self, max_items=None, timeout=None, alias='default'):
+        self.max_items = max_items or getattr(settings, 'NDVI_TILE_LRU_SIZE', 2048)
+        self.timeout = timeout or getattr(settings, 'NDVI_TILE_CACHE_TIMEOUT', 24 * 3600)
+        self.alias = alias
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                return value
+        try:
+            value = caches[self.alias].get(key)
+        except Exception as e:
+            # Redis不可用时退化为只用进程内缓存
+            logger.warning(f"瓦片缓存读取失败: {str(e)}")
+            value = None
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        self._remember(key, value)
+        try:
+            caches[self.alias].set(key, value, timeout=self.timeout)
+        except Exception as e:
+            logger.warning(f"瓦片缓存写入失败: {str(e)}")
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+tile_cache = TileCache()
+# 分段锁：多个请求同时取同一张未缓存瓦片时只渲染一次
+_render_locks = [threading.Lock() for _ in range(64)]
+
+
+def get_tile(pk, source_path, version, z, x, y):
+    """取瓦片PNG，缓存未命中时渲染并回填两级缓存"""
+    key = f"ndvi_tile:{pk}:{version}:{z}/{x}/{y}"
+    png = tile_cache.get(key)
+    if png is not None:
+        return png
+
+    with _render_locks[hash(key) % len(_render_locks)]:
+        png = tile_cache.get(key)
+        if png is None:
+            png = render_tile(source_path, z, x, y)
+            tile_cache.set(key, png)
+    return png
@@ -1,8 +1,17 @@
 from django.urls import path
 
-from .views import NDVIListAPI, NDVIDownloadAPI
+from .views import (
+    NDVIListAPI, NDVIDownloadAPI, NDVITileAPI, NDVIPointAPI, NDVIPointsAPI, NDVIZonalStatsAPI,
+    NDVITimeSeriesPointAPI, NDVITimeSeriesZonalAPI,
+)
 
 urlpatterns = [
     path('ndvi/', NDVIListAPI.as_view(), name='ndvi-list'),
     path('ndvi/<int:pk>/download/', NDVIDownloadAPI.as_view(), name='ndvi-download'),
+    path('ndvi/<int:pk>/tiles/<int:z>/<int:x>/<int:y>.png', NDVITileAPI.as_view(), name='ndvi-tile'),
+    path('ndvi/<int:pk>/point/', NDVIPointAPI.as_view(), name='ndvi-point'),
+    path('ndvi/<int:pk>/points/', NDVIPointsAPI.as_view(), name='ndvi-points'),
+    path('ndvi/<int:pk>/zonal/', NDVIZonalStatsAPI.as_view(), name='ndvi-zonal'),
+    path('ndvi/timeseries/point/', NDVITimeSeriesPointAPI.as_view(), name='ndvi-timeseries-point'),
+    path('ndvi/timeseries/zonal/', NDVITimeSeriesZonalAPI.as_view(), name='ndvi-timeseries-zonal'),
 ]
\ No newline at end of file
@@ -1,75 +1,414 @@
-from numpy import isinf
+import base64
+import binascii
+import hashlib
+import json
+import math
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.core.files.storage import default_storage
+from django.db.models import Q
 from rest_framework.permissions import AllowAny
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.http import FileResponse
-from pathlib import Path
-from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
+from geodata.archive import (
+    RangeNotSatisfiable, archive_members, archive_version, build_archive,
+    cached_archive_path, iter_file_range, parse_range, stream_archive,
+)
+from data_pipeline.utils.ndvi_cube import load_cube, region_cube_dir
+from geodata.cache import get_cached, list_cache_version, set_cached
 from geodata.models import NDVIData
+from geodata.raster_query import raster_info, sample_points, zonal_stats
+from geodata.raster_source import product_source
+from geodata.tiles import get_tile, is_valid_tile
+
+
+def if_none_match(request, etag):
+    """If-None-Match弱比较：逐个比较列表中的ETag（忽略W/前缀），*匹配任意版本"""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    etags = parse_etags(header)
+    if etags == ['*']:
+        return True
+    return etag.removeprefix('W/') in {e.removeprefix('W/') for e in etags}
+
+
+def _finite(value):
+    return value if value is not None and math.isfinite(value) else None
+
+
+def _encode_cursor(acquisition_date, pk):
+    raw = f"{acquisition_date.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    date_str, pk = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    return datetime.strptime(date_str, '%Y-%m-%d').date(), int(pk)
 
 
 class NDVIListAPI(APIView):
-    """获取NDVI数据列表"""
+    """获取NDVI数据列表
+
+    支持 limit / cursor 游标分页、start / end 日期过滤、bbox=minx,miny,maxx,maxy 空间过滤；
+    响应体仍为列表，下一页游标放在 Link 与 X-Next-Cursor 响应头中。
+    序列化结果按查询参数缓存在Redis，NDVIData变化时通过版本号整体失效。
+    """
     permission_classes = [AllowAny]  # 添加这行
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 100
 
     def get(self, request):
-        queryset = NDVIData.objects.all().order_by('-acquisition_date')[:10]
-
-        data = []
-        for item in queryset:
-            # 处理特殊浮点值
-            min_val = None if isinf(item.min_value) else item.min_value
-            max_val = None if isinf(item.max_value) else item.max_value
-            mean_val = None if isinf(item.mean_value) else item.mean_value
-
-            data.append({
-                'id': item.id,
-                'name': item.name,
-                'date': item.acquisition_date.strftime('%Y-%m-%d'),
-                'resolution': item.resolution,
-                'min': min_val,
-                'max': max_val,
-                'mean': mean_val,
-                'thumbnail_url': request.build_absolute_uri(item.thumbnail.url),
-                'coverage': {
-                    'type': 'Polygon',
-                    'coordinates': [list(item.coverage.coords[0])]
-                } if item.coverage else None
-            })
-
-        return Response(data)
+        params = request.query_params
+        try:
+            limit = min(int(params.get('limit', self.DEFAULT_LIMIT)), self.MAX_LIMIT)
+            cursor = _decode_cursor(params['cursor']) if params.get('cursor') else None
+            start = datetime.strptime(params['start'], '%Y-%m-%d').date() if params.get('start') else None
+            end = datetime.strptime(params['end'], '%Y-%m-%d').date() if params.get('end') else None
+            bbox = [float(v) for v in params['bbox'].split(',')] if params.get('bbox') else None
+            if limit <= 0 or (bbox is not None and len(bbox) != 4):
+                raise ValueError
+        except (ValueError, TypeError, UnicodeDecodeError, binascii.Error):
+            return Response({'error': '查询参数无效'}, status=400)
+
+        version = list_cache_version()
+        cache_key = None
+        if version is not None:
+            # 缩略图为绝对地址，缓存键需包含访问的主机
+            raw_key = f"{request.scheme}://{request.get_host()}|{limit}|{params.get('cursor')}|{start}|{end}|{bbox}"
+            cache_key = f"ndvi_list:{version}:{hashlib.sha1(raw_key.encode()).hexdigest()}"
+        page = get_cached(cache_key) if cache_key else None
+
+        if page is None:
+            page = self._build_page(request, limit, cursor, start, end, bbox)
+            if cache_key:
+                set_cached(cache_key, page)
+
+        if if_none_match(request, page['etag']):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(page['body'], content_type='application/json')
+        response['ETag'] = page['etag']
+        if page['next']:
+            next_url = request.build_absolute_uri(
+                f"{request.path}?{self._next_query(params, page['next'])}"
+            )
+            response['Link'] = f'<{next_url}>; rel="next"'
+            response['X-Next-Cursor'] = page['next']
+        return response
+
+    @staticmethod
+    def _next_query(params, next_cursor):
+        query = params.copy()
+        query['cursor'] = next_cursor
+        return query.urlencode()
+
+    @staticmethod
+    def _build_page(request, limit, cursor, start, end, bbox):
+        queryset = NDVIData.objects.order_by('-acquisition_date', '-id')
+        if start:
+            queryset = queryset.filter(acquisition_date__gte=start)
+        if end:
+            queryset = queryset.filter(acquisition_date__lte=end)
+        if bbox:
+            queryset = queryset.filter(coverage__intersects=Polygon.from_bbox(bbox))
+        if cursor:
+            cursor_date, cursor_pk = cursor
+            queryset = queryset.filter(
+                Q(acquisition_date__lt=cursor_date) | Q(acquisition_date=cursor_date, id__lt=cursor_pk)
+            )
+
+        rows = list(queryset.values(
+            'id', 'name', 'acquisition_date', 'resolution', 'min_value', 'max_value',
+            'mean_value', 'thumbnail', 'coverage'
+        )[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        data = [{
+            'id': row['id'],
+            'name': row['name'],
+            'date': row['acquisition_date'].strftime('%Y-%m-%d'),
+            'resolution': row['resolution'],
+            'min': _finite(row['min_value']),
+            'max': _finite(row['max_value']),
+            'mean': _finite(row['mean_value']),
+            'thumbnail_url': request.build_absolute_uri(default_storage.url(row['thumbnail']))
+            if row['thumbnail'] else None,
+            'coverage': {
+                'type': 'Polygon',
+                'coordinates': [list(row['coverage'].coords[0])]
+            } if row['coverage'] else None
+        } for row in rows]
+
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        return {
+            'body': body,
+            'etag': f'"{hashlib.sha1(body).hexdigest()}"',
+            'next': _encode_cursor(rows[-1]['acquisition_date'], rows[-1]['id']) if has_more else None,
+        }
 
 
 class NDVIDownloadAPI(APIView):
-    """下载NDVI数据"""
+    """下载NDVI数据（流式ZIP，支持ETag与断点续传）"""
     permission_classes = [AllowAny]  # 添加这行
 
     def get(self, request, pk):
         try:
             ndvi_data = NDVIData.objects.get(pk=pk)
-            data_dir = Path(settings.BASE_DIR) / ndvi_data.data_dir
-
-            # 创建ZIP压缩包
-            import zipfile
-            from io import BytesIO
-
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for tif_file in data_dir.glob('*.tif'):
-                    zipf.write(tif_file, tif_file.name)
-                # 包含元数据文件
-                metadata_file = data_dir / 'metadata.json'
-                if metadata_file.exists():
-                    zipf.write(metadata_file, 'metadata.json')
-
-            zip_buffer.seek(0)
-
-            return FileResponse(
-                zip_buffer,
-                as_attachment=True,
-                filename=f"{ndvi_data.name}.zip",
-                content_type='application/zip'
-            )
+        except NDVIData.DoesNotExist:
+            return Response({'error': '数据不存在'}, status=404)
+
+        bbox = None
+        if request.query_params.get('bbox'):
+            try:
+                bbox = [float(v) for v in request.query_params['bbox'].split(',')]
+                if len(bbox) != 4:
+                    raise ValueError
+            except ValueError:
+                return Response({'error': 'bbox格式应为minx,miny,maxx,maxy'}, status=400)
+
+        members = archive_members(ndvi_data, bbox)
+        if not members:
+            return Response({'error': '范围内没有数据'}, status=404)
+        version = archive_version(members)
+        etag = f'"{version}"'
+        filename = f"{ndvi_data.name}.zip"
+
+        if if_none_match(request, etag):
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            return response
+
+        if bbox is not None:
+            # 局部下载组合众多，只流式输出不做磁盘缓存
+            response = StreamingHttpResponse(stream_archive(members), content_type='application/zip')
+            response = self._finalize(response, filename, etag)
+            response['Accept-Ranges'] = 'none'
+            return response
+
+        cache_path = cached_archive_path(ndvi_data, version)
+        range_header = request.headers.get('Range')
+        # If-Range与当前版本不一致时忽略Range，返回完整新文件
+        if_range = request.headers.get('If-Range')
+        if if_range and if_range != etag:
+            range_header = None
 
+        if not cache_path.exists():
+            if not range_header:
+                # 首次下载：边生成边发送，同时写入磁盘缓存
+                response = StreamingHttpResponse(
+                    stream_archive(members, cache_path),
+                    content_type='application/zip'
+                )
+                return self._finalize(response, filename, etag)
+            build_archive(members, cache_path)
+
+        size = cache_path.stat().st_size
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+            return self._finalize(response, filename, etag)
+
+        if byte_range is None:
+            response = FileResponse(open(cache_path, 'rb'), content_type='application/zip')
+            response['Content-Length'] = str(size)
+            return self._finalize(response, filename, etag)
+
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            iter_file_range(cache_path, start, length),
+            status=206,
+            content_type='application/zip'
+        )
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        return self._finalize(response, filename, etag)
+
+    @staticmethod
+    def _finalize(response, filename, etag):
+        response['ETag'] = etag
+        response['Accept-Ranges'] = 'bytes'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class NDVITileAPI(APIView):
+    """NDVI XYZ栅格瓦片（PNG）"""
+    permission_classes = [AllowAny]
+
+    def get(self, request, pk, z, x, y):
+        if not is_valid_tile(z, x, y):
+            return Response({'error': '瓦片坐标无效'}, status=404)
+        try:
+            source_path, version = product_source(pk)
         except NDVIData.DoesNotExist:
-            return Response({'error': '数据不存在'}, status=404)
\ No newline at end of file
+            return Response({'error': '数据不存在'}, status=404)
+        except FileNotFoundError as e:
+            return Response({'error': str(e)}, status=404)
+
+        etag = f'"{version}-{z}-{x}-{y}"'
+        if if_none_match(request, etag):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(get_tile(pk, source_path, version, z, x, y),
+                                    content_type='image/png')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=86400'
+        return response
+
+
+MAX_BATCH_POINTS = 10000
+
+
+def _product_info(pk):
+    """按主键获取产品栅格信息，不存在时返回404响应"""
+    try:
+        return raster_info(*product_source(pk)), None
+    except NDVIData.DoesNotExist:
+        return None, Response({'error': '数据不存在'}, status=404)
+    except FileNotFoundError as e:
+        return None, Response({'error': str(e)}, status=404)
+
+
+class NDVIPointAPI(APIView):
+    """查询经纬度处的NDVI像元值"""
+    permission_classes = [AllowAny]
+
+    def get(self, request, pk):
+        try:
+            lon = float(request.query_params['lon'])
+            lat = float(request.query_params['lat'])
+        except (KeyError, ValueError):
+            return Response({'error': '需要有效的lon和lat参数'}, status=400)
+
+        info, error = _product_info(pk)
+        if error:
+            return error
+        value = sample_points(info, [(lon, lat)])[0]
+        return Response({'lon': lon, 'lat': lat, 'value': value})
+
+
+class NDVIPointsAPI(APIView):
+    """批量查询像元值，请求体: {"points": [[lon, lat], ...]}"""
+    permission_classes = [AllowAny]
+
+    def post(self, request, pk):
+        points = request.data.get('points')
+        if not isinstance(points, list) or not points:
+            return Response({'error': 'points不能为空'}, status=400)
+        if len(points) > MAX_BATCH_POINTS:
+            return Response({'error': f'单次最多查询{MAX_BATCH_POINTS}个点'}, status=400)
+        try:
+            points = [(float(p[0]), float(p[1])) for p in points]
+        except (TypeError, ValueError, IndexError):
+            return Response({'error': '点坐标格式应为[lon, lat]'}, status=400)
+
+        info, error = _product_info(pk)
+        if error:
+            return error
+        return Response({'values': sample_points(info, points)})
+
+
+class NDVIZonalStatsAPI(APIView):
+    """多边形分区统计，请求体: {"geometry": GeoJSON}（也接受Feature）"""
+    permission_classes = [AllowAny]
+
+    def post(self, request, pk):
+        geometry = request.data.get('geometry')
+        if isinstance(geometry, dict) and geometry.get('type') == 'Feature':
+            geometry = geometry.get('geometry')
+        if not isinstance(geometry, dict) or geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+            return Response({'error': 'geometry需为Polygon或MultiPolygon'}, status=400)
+
+        info, error = _product_info(pk)
+        if error:
+            return error
+        try:
+            stats = zonal_stats(info, json.dumps(geometry))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response(stats)
+
+
+def _cube_or_404(region=None):
+    """按region参数（默认区域可省略）定位与写入端一致的立方体目录"""
+    default_region = getattr(settings, 'NDVI_DEFAULT_REGION', 'beijing')
+    region = region or default_region
+    if region not in getattr(settings, 'NDVI_REGIONS', {}):
+        return None, Response({'error': f'未配置的区域: {region}'}, status=400)
+    cube = load_cube(region_cube_dir(settings.NDVI_CUBE_DIR, region, default_region))
+    if cube is None or not cube.dates:
+        return None, Response({'error': '时间序列立方体尚未生成'}, status=404)
+    return cube, None
+
+
+def _date_range(source):
+    """解析start/end（YYYY-MM-DD，可省略），格式错误时抛出ValueError"""
+    start, end = source.get('start'), source.get('end')
+    try:
+        start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+        end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+    except TypeError:
+        raise ValueError('日期需为YYYY-MM-DD字符串')
+    return start, end
+
+
+class NDVITimeSeriesPointAPI(APIView):
+    """单点NDVI时间序列，可选start/end（YYYY-MM-DD）、region（区域键）"""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        try:
+            lon = float(request.query_params['lon'])
+            lat = float(request.query_params['lat'])
+        except (KeyError, ValueError):
+            return Response({'error': '需要有效的lon和lat参数'}, status=400)
+
+        try:
+            start, end = _date_range(request.query_params)
+        except ValueError:
+            return Response({'error': 'start/end需为YYYY-MM-DD格式'}, status=400)
+
+        cube, error = _cube_or_404(request.query_params.get('region'))
+        if error:
+            return error
+        series = cube.point_series(lon, lat, start=start, end=end)
+        return Response({'lon': lon, 'lat': lat, 'series': series})
+
+
+class NDVITimeSeriesZonalAPI(APIView):
+    """多边形NDVI均值时间序列，请求体: {"geometry": GeoJSON, "start": ..., "end": ...}
+
+    区域通过region查询参数（或请求体中的region）指定，默认为NDVI_DEFAULT_REGION。
+    """
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        geometry = request.data.get('geometry')
+        if isinstance(geometry, dict) and geometry.get('type') == 'Feature':
+            geometry = geometry.get('geometry')
+        if not isinstance(geometry, dict) or geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+            return Response({'error': 'geometry需为Polygon或MultiPolygon'}, status=400)
+
+        try:
+            start, end = _date_range(request.data)
+        except ValueError:
+            return Response({'error': 'start/end需为YYYY-MM-DD格式'}, status=400)
+
+        cube, error = _cube_or_404(request.query_params.get('region') or request.data.get('region'))
+        if error:
+            return error
+        try:
+            series = cube.polygon_mean_series(json.dumps(geometry), start=start, end=end)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response({'series': series})
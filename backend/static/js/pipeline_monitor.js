@@ -0,0 +1,181 @@
+// 数据管道运行进度监控
+// 通过 /api/pipeline/runs/<id>/events/ 的Server-Sent Events接收进度（分块数、字节数、剩余时间）
+(function (global) {
+    'use strict';
+
+    var STAGE_LABELS = {
+        ee_graph: '构建计算图',
+        download: '下载分块',
+        validate: '校验分块',
+        revalidate: '复核已有分块',
+        local_ndvi: '本地NDVI计算',
+        composite: '时间合成',
+        split_tiles: '切分分块',
+        merge: '合并',
+        stats: '统计',
+        thumbnail: '缩略图',
+        tile_index: '分块索引',
+        db_save: '入库',
+        cube: '时间序列立方体',
+        raster_db: '栅格入库'
+    };
+
+    var STATUS_LABELS = {
+        running: '运行中',
+        success: '成功',
+        failed: '失败'
+    };
+
+    function formatBytes(bytes) {
+        if (!bytes) {
+            return '0 B';
+        }
+        var units = ['B', 'KB', 'MB', 'GB', 'TB'];
+        var i = Math.min(Math.floor(Math.log(bytes) / Math.log(1024)), units.length - 1);
+        return (bytes / Math.pow(1024, i)).toFixed(i === 0 ? 0 : 1) + ' ' + units[i];
+    }
+
+    function formatDuration(seconds) {
+        if (seconds === null || seconds === undefined) {
+            return '--';
+        }
+        seconds = Math.round(seconds);
+        var h = Math.floor(seconds / 3600);
+        var m = Math.floor((seconds % 3600) / 60);
+        var s = seconds % 60;
+        if (h) {
+            return h + '小时' + m + '分';
+        }
+        return m ? m + '分' + s + '秒' : s + '秒';
+    }
+
+    function PipelineMonitor(options) {
+        options = options || {};
+        this.baseUrl = (options.baseUrl || '/api/pipeline').replace(/\/$/, '');
+        this.container = typeof options.container === 'string'
+            ? document.querySelector(options.container)
+            : options.container || null;
+        this.onProgress = options.onProgress || null;
+        this.onEnd = options.onEnd || null;
+        this.onError = options.onError || null;
+        this.source = null;
+        this.runId = null;
+    }
+
+    // 订阅指定运行的进度流
+    PipelineMonitor.prototype.watch = function (runId) {
+        var self = this;
+        this.close();
+        this.runId = runId;
+        this.source = new EventSource(this.baseUrl + '/runs/' + runId + '/events/');
+
+        this.source.addEventListener('progress', function (event) {
+            self._handle(JSON.parse(event.data), false);
+        });
+        this.source.addEventListener('end', function (event) {
+            self._handle(JSON.parse(event.data), true);
+            self.close();
+        });
+        this.source.onerror = function (event) {
+            // 服务端每隔一段时间主动断开，EventSource会带Last-Event-ID按retry自动重连，
+            // 只有连接被放弃（CLOSED）时才通知调用方
+            if (self.onError && self.source && self.source.readyState === EventSource.CLOSED) {
+                self.onError(event);
+            }
+        };
+        return this;
+    };
+
+    // 订阅最近一次运行（优先运行中的）
+    PipelineMonitor.prototype.watchLatest = function () {
+        var self = this;
+        return fetch(this.baseUrl + '/runs/?limit=1&status=running')
+            .then(function (response) { return response.json(); })
+            .then(function (runs) {
+                if (runs.length) {
+                    return runs;
+                }
+                return fetch(self.baseUrl + '/runs/?limit=1').then(function (r) { return r.json(); });
+            })
+            .then(function (runs) {
+                if (!runs.length) {
+                    self._renderEmpty();
+                    return null;
+                }
+                self.watch(runs[0].id);
+                return runs[0];
+            })
+            .catch(function (error) {
+                if (self.onError) {
+                    self.onError(error);
+                }
+            });
+    };
+
+    PipelineMonitor.prototype.close = function () {
+        if (this.source) {
+            this.source.close();
+            this.source = null;
+        }
+    };
+
+    PipelineMonitor.prototype._handle = function (progress, finished) {
+        this.render(progress);
+        if (this.onProgress) {
+            this.onProgress(progress);
+        }
+        if (finished && this.onEnd) {
+            this.onEnd(progress);
+        }
+    };
+
+    PipelineMonitor.prototype._renderEmpty = function () {
+        if (this.container) {
+            this.container.textContent = '暂无运行记录';
+        }
+    };
+
+    // 渲染进度面板（未指定容器时跳过，由回调自行处理）
+    PipelineMonitor.prototype.render = function (p) {
+        if (!this.container) {
+            return;
+        }
+        var finished = p.tiles_done + p.tiles_failed;
+        var percent = p.tiles_total ? Math.round(finished / p.tiles_total * 100) : 0;
+        var stage = STAGE_LABELS[p.stage] || p.stage || '';
+
+        this.container.innerHTML = '';
+        var title = document.createElement('div');
+        title.className = 'pipeline-monitor-title';
+        title.textContent = p.name + '（' + (STATUS_LABELS[p.status] || p.status) + '）' +
+            (stage ? ' - ' + stage : '');
+
+        var bar = document.createElement('progress');
+        bar.className = 'pipeline-monitor-bar';
+        bar.max = 100;
+        bar.value = percent;
+
+        var detail = document.createElement('div');
+        detail.className = 'pipeline-monitor-detail';
+        detail.textContent = '分块 ' + p.tiles_done + '/' + p.tiles_total +
+            (p.tiles_failed ? '（失败 ' + p.tiles_failed + '）' : '') +
+            ' · 已下载 ' + formatBytes(p.bytes_downloaded) +
+            ' · 已用时 ' + formatDuration(p.elapsed_seconds) +
+            (p.status === 'running' ? ' · 预计剩余 ' + formatDuration(p.eta_seconds) : '');
+
+        this.container.appendChild(title);
+        this.container.appendChild(bar);
+        this.container.appendChild(detail);
+
+        if (p.error) {
+            var error = document.createElement('div');
+            error.className = 'pipeline-monitor-error';
+            error.textContent = p.error;
+            this.container.appendChild(error);
+        }
+    };
+
+    PipelineMonitor.formatBytes = formatBytes;
+    PipelineMonitor.formatDuration = formatDuration;
+    global.PipelineMonitor = PipelineMonitor;
+})(window);